@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+# count the ratings that were made before the counters existed
+backfill_rating_counters_sql = """
+UPDATE chul_communityhealthunit chu
+SET rating_sum = r.rating_sum, rating_count = r.rating_count
+FROM (
+    SELECT chu_id, SUM(rating) AS rating_sum, COUNT(*) AS rating_count
+    FROM chul_churating
+    WHERE deleted = false
+    GROUP BY chu_id
+) r
+WHERE r.chu_id = chu.id;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chul', '0001_auto_20160318_0338'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='communityhealthunit',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='communityhealthunit',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunSQL(backfill_rating_counters_sql),
+    ]
@@ -9,6 +9,7 @@ from django.utils import timezone, encoding
 
 from common.models import AbstractBase, Contact, SequenceMixin
 from common.fields import SequenceField
+from common.utilities.rating_counters import RatedMixin, RatingCounterMixin
 from facilities.models import Facility
 
 
@@ -57,7 +58,7 @@ class CommunityHealthUnitContact(AbstractBase):
 
 @reversion.register(follow=['facility', 'status'])
 @encoding.python_2_unicode_compatible
-class CommunityHealthUnit(SequenceMixin, AbstractBase):
+class CommunityHealthUnit(RatedMixin, SequenceMixin, AbstractBase):
 
     """
     This is a health service delivery structure within a defined geographical
@@ -93,6 +94,9 @@ class CommunityHealthUnit(SequenceMixin, AbstractBase):
     number_of_chvs = models.PositiveIntegerField(
         default=0,
         help_text='Number of Community Health volunteers in the CHU')
+    # the totals of the unit's ratings; kept by `CHURating`
+    rating_sum = models.PositiveIntegerField(default=0, editable=False)
+    rating_count = models.PositiveIntegerField(default=0, editable=False)
 
     def __str__(self):
         return self.name
@@ -224,11 +228,9 @@ class CommunityHealthUnit(SequenceMixin, AbstractBase):
 
     @property
     def average_rating(self):
-        return self.chu_ratings.aggregate(r=models.Avg('rating'))['r'] or 0
-
-    @property
-    def rating_count(self):
-        return self.chu_ratings.count()
+        if not self.rating_count:
+            return 0
+        return float(self.rating_sum) / self.rating_count
 
     class Meta(AbstractBase.Meta):
         unique_together = ('name', 'facility', )
@@ -313,9 +315,10 @@ class CHUService(AbstractBase):
 
 @reversion.register
 @encoding.python_2_unicode_compatible
-class CHURating(AbstractBase):
+class CHURating(RatingCounterMixin, AbstractBase):
 
     """Rating of a CHU"""
+    rated_field = 'chu'
 
     chu = models.ForeignKey(CommunityHealthUnit, related_name='chu_ratings')
     rating = models.PositiveIntegerField(
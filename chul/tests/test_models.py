@@ -115,6 +115,29 @@ class TestCommunityHealthUnit(TestCase):
         self.assertEqual(chu.rating_count, 0)
         self.assertEqual(chu2.rating_count, len(ratings))
 
+    def test_rating_counters_exclude_deleted_ratings(self):
+        chu = mommy.make(CommunityHealthUnit)
+        rating = mommy.make(CHURating, chu=chu, rating=1)
+        mommy.make(CHURating, chu=chu, rating=5)
+        rating.delete()
+
+        chu = CommunityHealthUnit.objects.get(id=chu.id)
+        self.assertEqual(chu.rating_sum, 5)
+        self.assertEqual(chu.rating_count, 1)
+        self.assertEqual(chu.average_rating, 5)
+
+    def test_saving_a_stale_chu_keeps_the_rating_counters(self):
+        chu = mommy.make(CommunityHealthUnit)
+        stale_chu = CommunityHealthUnit.objects.get(id=chu.id)
+        mommy.make(CHURating, chu=chu, rating=3)
+
+        stale_chu.households_monitored = 10
+        stale_chu.save()
+        chu = CommunityHealthUnit.objects.get(id=chu.id)
+        self.assertEqual(chu.households_monitored, 10)
+        self.assertEqual(chu.rating_sum, 3)
+        self.assertEqual(chu.rating_count, 1)
+
     def test_contacts(self):
         chu = mommy.make(CommunityHealthUnit)
         mommy.make(
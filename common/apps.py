@@ -0,0 +1,9 @@
+from django.apps import AppConfig
+
+
+class CommonConfig(AppConfig):
+    name = 'common'
+
+    def ready(self):
+        # connect the receivers that invalidate the scoped response caches
+        from .utilities import scoped_cache  # NOQA
@@ -1,8 +1,9 @@
+import copy
 import logging
 import uuid
 import pytz
 
-from django.db import models
+from django.db import connection, models
 from django.utils import timezone
 from django.contrib.auth import get_user_model
 from django.conf import settings
@@ -13,23 +14,36 @@ from ..utilities.sequence_helper import SequenceGenerator
 
 LOGGER = logging.getLogger(__file__)
 
+# the id of the default system user, once it is known to be committed
+_SYSTEM_USER_ID = {}
+
 
 def get_default_system_user_id():
     """
     Ensure that there is a default system user, unknown password
+
+    The id is remembered by the process unless it was looked up inside a
+    transaction, which could still be rolled back.
     """
+    user_id = _SYSTEM_USER_ID.get('id')
+    if user_id is not None:
+        return user_id
+
     try:
-        return get_user_model().objects.get(
+        user_id = get_user_model().objects.get(
             email='system@ehealth.or.ke',
             first_name='System',
             username='system'
         ).pk
     except get_user_model().DoesNotExist:
-        return get_user_model().objects.create(
+        user_id = get_user_model().objects.create(
             email='system@ehealth.or.ke',
             first_name='System',
             username='system'
         ).pk
+    if not connection.in_atomic_block:
+        _SYSTEM_USER_ID['id'] = user_id
+    return user_id
 
 
 def get_utc_localized_datetime(datetime_instance):
@@ -81,6 +95,23 @@ class AbstractBase(models.Model):
     objects = CustomDefaultManager()
     everything = models.Manager()
 
+    def __init__(self, *args, **kwargs):
+        super(AbstractBase, self).__init__(*args, **kwargs)
+        # the pk that the `id` default generated, if the pk was not given
+        self._generated_pk = None if args or 'id' in kwargs or \
+            'pk' in kwargs else self.pk
+
+    def is_new_record(self):
+        """
+        Whether the record is known not to be in the database
+
+        That is the case for an unsaved instance whose pk was generated by
+        the `id` default. The database has to be checked for an unsaved
+        instance that was given an existing record's pk.
+        """
+        return self._state.adding and self.pk is not None and \
+            self.pk == self._generated_pk
+
     def validate_updated_date_greater_than_created(self):
         if timezone.is_naive(self.updated):
             self.updated = get_utc_localized_datetime(self.updated)
@@ -94,6 +125,9 @@ class AbstractBase(models.Model):
         Ensures that in subsequent times created and created_by fields
         values are not overriden.
         """
+        if self.is_new_record():
+            # the record is being inserted, there is nothing to preserve
+            return
         try:
             original = self.__class__.objects.get(pk=self.pk)
             self.created = original.created
@@ -105,7 +139,15 @@ class AbstractBase(models.Model):
                 'this as a new record.'.format(self.__class__, self.pk))
 
     def save(self, *args, **kwargs):
-        self.full_clean(exclude=None)
+        """
+        Validate and save the record
+
+        Passing `validate=False` skips `full_clean`. It is meant for
+        internal writers whose values are already valid, never for data
+        that comes from the API.
+        """
+        if kwargs.pop('validate', True):
+            self.full_clean(exclude=None)
         self.preserve_created_and_created_by()
         self.validate_updated_date_greater_than_created()
         super(AbstractBase, self).save(*args, **kwargs)
@@ -144,3 +186,108 @@ class SequenceMixin(object):
             app_label=self._meta.app_label,
             model_name=self._meta.model_name
         ).next()
+
+
+class ChangeTrackerMixin(object):
+
+    """
+    Intended to be mixed into `AbstractBase` models to tell which fields
+    changed since the instance was loaded from, or saved to, the database
+
+    The values are remembered when the instance is loaded hence the
+    changes are found in memory. An instance that was created in memory
+    is reloaded, once, the first time its loaded values are needed.
+    """
+    _loaded_values = None
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(ChangeTrackerMixin, cls).from_db(
+            db, field_names, values)
+        instance._loaded_values = instance._get_current_values()
+        return instance
+
+    def _get_current_values(self):
+        # deferred fields are not in the instance's `__dict__`
+        return {
+            field.attname: copy.copy(self.__dict__[field.attname])
+            for field in self._meta.concrete_fields
+            if field.attname in self.__dict__
+        }
+
+    def get_loaded_values(self):
+        """
+        Returns the field values, by attname, that are in the database
+
+        The values are empty for a record that is not in the database.
+        """
+        if self._loaded_values is None and self.is_new_record():
+            return {}
+        if self._loaded_values is None:
+            attnames = [
+                field.attname for field in self._meta.concrete_fields]
+            self._loaded_values = self.__class__.everything.filter(
+                pk=self.pk).values(*attnames).first() or {}
+        return self._loaded_values
+
+    def get_changed_fields(self):
+        """
+        Returns the names of the fields whose values are not yet saved
+        """
+        loaded_values = self.get_loaded_values()
+        current_values = self._get_current_values()
+        return [
+            field.name for field in self._meta.concrete_fields
+            if field.attname in current_values and
+            (field.attname not in loaded_values or
+             current_values[field.attname] != loaded_values[field.attname])
+        ]
+
+    def get_loaded_instance(self):
+        """
+        Returns an in memory copy of the instance with the loaded values
+        """
+        loaded_values = self.get_loaded_values()
+        instance = self.__class__.__new__(self.__class__)
+        instance.__dict__ = dict(self.__dict__)
+        for field in self._meta.concrete_fields:
+            if field.attname in loaded_values:
+                instance.__dict__[field.attname] = loaded_values[
+                    field.attname]
+            if field.rel:
+                instance.__dict__.pop(field.get_cache_name(), None)
+        return instance
+
+    def preserve_created_and_created_by(self):
+        loaded_values = self.get_loaded_values()
+        if not loaded_values:
+            # a new record
+            return
+        if 'created' not in loaded_values or \
+                'created_by_id' not in loaded_values:
+            return super(
+                ChangeTrackerMixin, self).preserve_created_and_created_by()
+
+        self.created = loaded_values['created']
+        if self.created_by_id != loaded_values['created_by_id']:
+            self.created_by_id = loaded_values['created_by_id']
+            self.__dict__.pop(
+                self._meta.get_field('created_by').get_cache_name(), None)
+
+    def refresh_from_db(self, using=None, fields=None, **kwargs):
+        super(ChangeTrackerMixin, self).refresh_from_db(
+            using=using, fields=fields, **kwargs)
+        current_values = self._get_current_values()
+        if fields is None or self._loaded_values is None:
+            self._loaded_values = current_values
+            return
+
+        for field in self._meta.concrete_fields:
+            if field.attname in current_values and (
+                    field.name in fields or field.attname in fields):
+                self._loaded_values[field.attname] = current_values[
+                    field.attname]
+
+    def save(self, *args, **kwargs):
+        super(ChangeTrackerMixin, self).save(*args, **kwargs)
+        self._loaded_values = self._get_current_values()
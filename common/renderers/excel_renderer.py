@@ -1,3 +1,4 @@
+import itertools
 import xlsxwriter
 import string
 import cStringIO
@@ -63,9 +64,13 @@ def sanitize_field_names(sample_keys):
     return key_map
 
 
-def _write_excel_file(data):  # noqa
-    mem_file = cStringIO.StringIO()
-    workbook = xlsxwriter.Workbook(mem_file)
+def write_excel_rows(output, rows, workbook_options=None):  # noqa
+    """
+    Write an iterable of rows to an excel workbook in `output`
+
+    The columns are picked from the first row.
+    """
+    workbook = xlsxwriter.Workbook(output, workbook_options or {})
     format = workbook.add_format(
         {
             'bold': True,
@@ -83,15 +88,16 @@ def _write_excel_file(data):  # noqa
 
         row = 0
         col = 0
-        if len(work_sheet_data) >= 1:
-            example_dict = work_sheet_data[0]
+        work_sheet_data = iter(work_sheet_data)
+        example_dict = next(work_sheet_data, None)
+        if example_dict is not None:
             sample_keys = example_dict.keys()
 
             # remove columns that should not be in excel
             sample_keys = remove_keys(sample_keys)
 
             # find uuid fields and remove them from data
-            data = work_sheet_data[0]
+            data = example_dict
             reject_keys = []
             cleaned_fields = []
             for key in sample_keys:
@@ -103,11 +109,6 @@ def _write_excel_file(data):  # noqa
 
             sample_keys = cleaned_fields
 
-            # remove data with uuid fields
-            for data in work_sheet_data:
-                for key in reject_keys:
-                    del data[key]
-
             # write the excel column names
             sample_keys_map = sanitize_field_names(sample_keys)
             for key in sample_keys_map:
@@ -116,7 +117,11 @@ def _write_excel_file(data):  # noqa
                 col = col + 1
             row = 1
             col = 0
-            for data_dict in work_sheet_data:
+            for data_dict in itertools.chain([example_dict], work_sheet_data):
+                # remove data with uuid fields
+                for key in reject_keys:
+                    del data_dict[key]
+
                 data_keys = data_dict.keys()
 
                 # remove colums that should not be in excel
@@ -157,8 +162,13 @@ def _write_excel_file(data):  # noqa
             # the count is zero thus do not write the excel file
             pass
 
-    _add_data_to_worksheet(data)
+    _add_data_to_worksheet(rows)
     workbook.close()
+
+
+def _write_excel_file(data):
+    mem_file = cStringIO.StringIO()
+    write_excel_rows(mem_file, data)
     mem_file_contents = mem_file.getvalue()
     mem_file.close()
 
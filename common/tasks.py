@@ -31,19 +31,22 @@ def backup_db():
 
 
 @periodic_task(
-    run_every=(crontab(minute='*/10')),
+    run_every=(crontab(minute=0, hour='*/1')),
     name="refresh_material_views",
     ignore_result=True)
 def refresh_material_views():
     """
-    Refresh material views.
+    Reconcile the facilities excel export.
 
-    There is need to refresh the facilities materialized view every
-    time facility metadata changes. Hook the refreshes here.
+    The export is kept up to date by row level triggers on facilities,
+    facility services, wards and owners. Changes to the other lookups
+    that feed it e.g renaming a county are picked up here.
 
-    The the task will be running after every 10 minutes
+    Only rows that differ from their source are rewritten, so readers
+    are not blocked as they would be by a full refresh.
+    The task runs every hour.
     """
 
-    sql = """refresh materialized view facilities_excel_export;"""
+    sql = """select reconcile_facilities_excel_export();"""
     cursor = connection.cursor()
     cursor.execute(sql)
@@ -1,10 +1,13 @@
 from datetime import timedelta, datetime
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.contrib.auth import get_user_model
 from rest_framework.exceptions import ValidationError
 from django.conf import settings
+from django.db import connection
 from django.utils import timezone
 from model_mommy import mommy
+from mock import patch
 
 
 from ..models import (
@@ -21,6 +24,7 @@ from ..models import (
     SubCounty,
     ErrorQueue
 )
+from ..models.base import _SYSTEM_USER_ID, get_default_system_user_id
 from facilities.models import RegulationStatus
 
 
@@ -60,6 +64,47 @@ class AbstractBaseModelTest(TestCase):
         self.assertEqual(self.user_1.id, fake.created_by.id)
         self.assertEqual(self.user_2.id, fake.updated_by.id)
 
+    def test_save_new_record_without_validation(self):
+        contact_type = ContactType(
+            name='EMAIL', created_by=self.user_1, updated_by=self.user_1)
+        with CaptureQueriesContext(connection) as queries:
+            contact_type.save(validate=False)
+
+        # neither validated nor looked up before it is inserted
+        self.assertEqual(
+            [], [query for query in queries.captured_queries
+                 if query['sql'].startswith('SELECT')])
+        self.assertTrue(ContactType.objects.filter(name='EMAIL').exists())
+
+    def test_save_unsaved_instance_of_an_existing_record(self):
+        contact_type = mommy.make(ContactType, created_by=self.user_1)
+        created = contact_type.created
+        replacement = ContactType(
+            id=contact_type.id, name='PHONE', created_by=self.user_2,
+            updated_by=self.user_2, created=created + timedelta(days=1),
+            updated=created + timedelta(days=1))
+        self.assertFalse(replacement.is_new_record())
+        self.assertTrue(ContactType(name='FAX').is_new_record())
+        replacement.save()
+
+        contact_type = ContactType.objects.get(id=contact_type.id)
+        self.assertEqual('PHONE', contact_type.name)
+        self.assertEqual(created, contact_type.created)
+        self.assertEqual(self.user_1.id, contact_type.created_by_id)
+
+    def test_default_system_user_id_is_cached_once_committed(self):
+        self.addCleanup(_SYSTEM_USER_ID.clear)
+        user_id = get_default_system_user_id()
+        # looked up inside the test's transaction
+        self.assertEqual({}, _SYSTEM_USER_ID)
+
+        with patch('common.models.base.connection') as mock_connection:
+            mock_connection.in_atomic_block = False
+            self.assertEqual(user_id, get_default_system_user_id())
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(user_id, get_default_system_user_id())
+        self.assertEqual(0, len(queries.captured_queries))
+
     def test_delete_override(self):
         bp_type = mommy.make(ContactType, created=timezone.now(),
                              updated=timezone.now())
@@ -0,0 +1,166 @@
+from mock import patch
+
+from django.core.cache import cache
+from django.core.signals import request_started, request_finished
+from django.core.urlresolvers import reverse
+from django.test.utils import override_settings
+
+from rest_framework.test import APITestCase
+from model_mommy import mommy
+
+from facilities.models import Facility, FacilityType
+from facilities.views import DashBoard
+from chul.models import CommunityHealthUnit
+from ..models import County, Constituency, SubCounty, Ward, UserCounty
+from reporting.tasks import rebuild_rollups
+from ..utilities.scoped_cache import (
+    get_area_versions,
+    get_user_areas,
+    get_ward_areas,
+    NATIONAL_AREA
+)
+from ..views import FilteringSummariesView
+from .test_views import LoginMixin
+
+
+CACHES_TEST_SETTINGS = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+
+@override_settings(CACHES=CACHES_TEST_SETTINGS)
+class TestScopedCache(LoginMixin, APITestCase):
+
+    def setUp(self):
+        super(TestScopedCache, self).setUp()
+        cache.clear()
+        self.url = reverse('api:facilities:dashboard')
+
+    def _make_ward(self, county):
+        constituency = mommy.make(Constituency, county=county)
+        sub_county = mommy.make(SubCounty, county=county)
+        return mommy.make(
+            Ward, constituency=constituency, sub_county=sub_county)
+
+    def _make_county_user(self, county):
+        self.user.is_national = False
+        self.user.save()
+        mommy.make(UserCounty, county=county, user=self.user)
+
+    def test_user_areas(self):
+        self.assertEquals([NATIONAL_AREA], get_user_areas(self.user))
+        county = mommy.make(County)
+        self._make_county_user(county)
+        self.assertEquals(
+            ['county:{}'.format(county.id)], get_user_areas(self.user))
+
+    def test_dashboard_is_cached(self):
+        mommy.make(Facility)
+        with patch.object(
+                DashBoard, 'get_dashboard_data',
+                wraps=DashBoard.get_dashboard_data,
+                autospec=True) as mock_data:
+            self.client.get(self.url)
+            response = self.client.get(self.url)
+            self.assertEquals(1, mock_data.call_count)
+        self.assertEquals(1, response.data['total_facilities'])
+
+    def test_facility_changes_invalidate_the_dashboard(self):
+        mommy.make(Facility)
+        self.client.get(self.url)
+        mommy.make(Facility)
+        response = self.client.get(self.url)
+        self.assertEquals(2, response.data['total_facilities'])
+
+    def test_chu_changes_invalidate_the_dashboard(self):
+        facility = mommy.make(Facility)
+        self.client.get(self.url)
+        mommy.make(CommunityHealthUnit, facility=facility)
+        response = self.client.get(self.url)
+        self.assertEquals(1, response.data['total_chus'])
+
+    def test_changes_in_other_areas_keep_the_cache(self):
+        county = mommy.make(County)
+        other_county = mommy.make(County)
+        self._make_county_user(county)
+        mommy.make(Facility, ward=self._make_ward(county))
+        self.client.get(self.url)
+
+        with patch.object(DashBoard, 'get_dashboard_data') as mock_data:
+            mommy.make(Facility, ward=self._make_ward(other_county))
+            self.client.get(self.url)
+            self.assertFalse(mock_data.called)
+
+        mommy.make(Facility, ward=self._make_ward(county))
+        response = self.client.get(self.url)
+        self.assertEquals(2, response.data['total_facilities'])
+
+    def test_lookup_changes_invalidate_the_dashboard(self):
+        facility_type = mommy.make(FacilityType, name='Dispensary')
+        mommy.make(Facility, facility_type=facility_type)
+        self.client.get(self.url)
+
+        facility_type.name = 'Health Centre'
+        facility_type.save()
+        response = self.client.get(self.url)
+        self.assertIn(
+            'Health Centre',
+            [summary['name'] for summary in response.data['types_summary']])
+
+    def test_request_changes_invalidate_after_the_request(self):
+        facility = mommy.make(Facility)
+        self.client.get(self.url)
+        versions = get_area_versions([NATIONAL_AREA])
+
+        request_started.send(sender=self.__class__)
+        facility.name = 'Moved facility'
+        facility.save()
+        self.assertEquals(versions, get_area_versions([NATIONAL_AREA]))
+        request_finished.send(sender=self.__class__)
+
+        self.assertNotEquals(versions, get_area_versions([NATIONAL_AREA]))
+
+    def test_moving_a_facility_invalidates_the_old_areas(self):
+        county = mommy.make(County)
+        old_ward = self._make_ward(county)
+        facility = mommy.make(Facility, ward=old_ward)
+        old_areas = get_ward_areas(old_ward.id)
+        versions = get_area_versions(old_areas)
+
+        facility = Facility.objects.get(id=facility.id)
+        facility.ward = self._make_ward(mommy.make(County))
+        facility.save()
+
+        new_versions = get_area_versions(old_areas)
+        for version, new_version in zip(versions, new_versions):
+            self.assertNotEquals(version, new_version)
+
+    def test_rebuilding_the_rollups_invalidates_every_area(self):
+        county = mommy.make(County)
+        self._make_county_user(county)
+        mommy.make(Facility, ward=self._make_ward(county))
+        self.client.get(self.url)
+        versions = get_area_versions(get_user_areas(self.user))
+
+        rebuild_rollups()
+
+        self.assertNotEquals(
+            versions, get_area_versions(get_user_areas(self.user)))
+
+    def test_lookup_changes_invalidate_the_filtering_summaries(self):
+        url = reverse('api:common:filtering_summaries') + '?fields=county'
+        mommy.make(County, name='Kiambu')
+        self.client.get(url)
+        with patch.object(
+                FilteringSummariesView, 'get_summaries',
+                wraps=FilteringSummariesView.get_summaries,
+                autospec=True) as mock_summaries:
+            self.client.get(url)
+            self.assertFalse(mock_summaries.called)
+
+            mommy.make(County, name='Nyeri')
+            response = self.client.get(url)
+            self.assertTrue(mock_summaries.called)
+        self.assertEquals(2, len(response.data['county']))
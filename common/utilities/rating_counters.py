@@ -0,0 +1,83 @@
+"""
+Keep the rating totals of rated objects e.g facility services and CHUs
+
+The rated models have `rating_sum` and `rating_count` fields that are
+updated, in the same transaction, whenever one of their ratings is saved.
+Saving a rated object never writes the totals, so an instance that was
+loaded before a rating was saved can not overwrite them.
+"""
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import F
+
+
+RATING_COUNTER_FIELDS = ('rating_sum', 'rating_count')
+
+
+class RatedMixin(object):
+    """
+    Mixed into a rated model to leave the rating totals out of its saves
+
+    Only the loaded fields, other than the totals, of an existing object
+    are saved unless the fields to save are given.
+    """
+
+    def _is_saved(self):
+        if not self._state.adding:
+            return True
+        return not self.is_new_record() and \
+            self.__class__.everything.filter(pk=self.pk).exists()
+
+    def save(self, *args, **kwargs):
+        if kwargs.get('update_fields') is None and \
+                not kwargs.get('force_insert') and self._is_saved():
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and
+                field.name not in RATING_COUNTER_FIELDS and
+                field.attname in self.__dict__
+            ]
+        super(RatedMixin, self).save(*args, **kwargs)
+
+
+class RatingCounterMixin(object):
+    """
+    Mixed into a rating model to update the totals of the rated object
+
+    `rated_field` is the name of the foreign key to the rated object.
+    Soft deleting a rating removes it from the totals. The rated object
+    that is loaded on the rating, if any, is kept in step with the database.
+    """
+    rated_field = None
+
+    def _get_rating_changes(self, previous):
+        changes = defaultdict(lambda: [0, 0])
+        if previous and not previous['deleted']:
+            changes[previous[self.rated_field]][0] -= previous['rating']
+            changes[previous[self.rated_field]][1] -= 1
+        if not self.deleted:
+            rated_id = getattr(self, '{}_id'.format(self.rated_field))
+            changes[rated_id][0] += self.rating
+            changes[rated_id][1] += 1
+        return changes
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            previous = self.__class__.everything.select_for_update(
+            ).filter(pk=self.pk).values(
+                self.rated_field, 'rating', 'deleted').first()
+            super(RatingCounterMixin, self).save(*args, **kwargs)
+
+            field = self._meta.get_field(self.rated_field)
+            rated = getattr(self, field.get_cache_name(), None)
+            for rated_id, (sum_change, count_change) in \
+                    self._get_rating_changes(previous).items():
+                if not (sum_change or count_change):
+                    continue
+                field.related_model.everything.filter(pk=rated_id).update(
+                    rating_sum=F('rating_sum') + sum_change,
+                    rating_count=F('rating_count') + count_change)
+                if rated is not None and rated.pk == rated_id:
+                    rated.rating_sum += sum_change
+                    rated.rating_count += count_change
@@ -0,0 +1,251 @@
+"""
+Caching of API responses that only depend on the user's scope
+
+The scope of a user is the set of admin areas ( counties, constituencies
+and sub-counties ) that the user is attached to, or the whole country for
+national users and users with no areas, together with the user's
+regulatory body and permissions. Users with the same scope share cached
+responses.
+
+Each area has a version in the cache which is replaced whenever a facility
+or CHU in the area is saved; the versions of a user's areas are part of the
+cache key, so changes in an area only invalidate the responses of the
+users that can see them. The versions of the areas changed by a request are
+replaced once the request has finished i.e after its changes have been
+committed, so that a response computed from the uncommitted data is never
+cached under the new versions.
+"""
+import hashlib
+import threading
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.signals import request_started, request_finished
+from django.db.models.signals import post_init, post_save
+from django.dispatch import receiver
+
+from common.models import (
+    County,
+    Constituency,
+    SubCounty,
+    Ward,
+    UserCounty,
+    UserConstituency,
+    UserSubCounty
+)
+from facilities.models import (
+    Facility,
+    FacilityType,
+    FacilityStatus,
+    ServiceCategory,
+    Service,
+    OwnerType,
+    Owner,
+    KephLevel
+)
+from chul.models import CommunityHealthUnit, Status
+
+
+SCOPED_CACHE_PREFIX = 'scoped_cache'
+NATIONAL_AREA = 'national'
+LOOKUPS_AREA = 'lookups'
+
+# the models that FilteringSummariesView lists
+LOOKUP_MODELS = (
+    County, SubCounty, FacilityType, Constituency, Ward, FacilityStatus,
+    Status, ServiceCategory, OwnerType, Owner, Service, KephLevel
+)
+
+_PENDING_AREAS = threading.local()
+
+
+def _get_version_key(area):
+    return '{}:version:{}'.format(SCOPED_CACHE_PREFIX, area)
+
+
+def get_area_versions(areas):
+    versions = cache.get_many([_get_version_key(area) for area in areas])
+    return [versions.get(_get_version_key(area)) for area in areas]
+
+
+def invalidate_areas(areas):
+    """
+    Invalidate the cached responses of every scope that includes the areas
+    """
+    cache.set_many({
+        _get_version_key(area): uuid.uuid4().hex for area in areas
+    }, None)
+
+
+def get_all_areas():
+    """
+    Returns every admin area together with the national area
+    """
+    return [NATIONAL_AREA] + [
+        'county:{}'.format(county_id) for county_id in
+        County.everything.values_list('id', flat=True)
+    ] + [
+        'constituency:{}'.format(constituency_id) for constituency_id in
+        Constituency.everything.values_list('id', flat=True)
+    ] + [
+        'sub_county:{}'.format(sub_county_id) for sub_county_id in
+        SubCounty.everything.values_list('id', flat=True)
+    ]
+
+
+def start_invalidation_batch():
+    _PENDING_AREAS.areas = set()
+
+
+def flush_invalidation_batch():
+    areas = getattr(_PENDING_AREAS, 'areas', None)
+    _PENDING_AREAS.areas = None
+    if areas:
+        invalidate_areas(areas)
+
+
+def schedule_invalidation(areas):
+    """
+    Invalidate the areas once the current request has finished
+
+    Outside a request the areas are invalidated right away.
+    """
+    pending_areas = getattr(_PENDING_AREAS, 'areas', None)
+    if pending_areas is not None:
+        pending_areas.update(areas)
+    else:
+        invalidate_areas(areas)
+
+
+@receiver(request_started)
+def start_request_invalidation_batch(sender, **kwargs):
+    # flush anything left over by a request that did not finish cleanly
+    flush_invalidation_batch()
+    start_invalidation_batch()
+
+
+@receiver(request_finished)
+def flush_request_invalidation_batch(sender, **kwargs):
+    flush_invalidation_batch()
+
+
+def get_user_areas(user):
+    """
+    Returns the admin areas whose changes affect what the user can see
+    """
+    if user.is_national:
+        return [NATIONAL_AREA]
+    areas = [
+        'county:{}'.format(county_id) for county_id in
+        UserCounty.objects.filter(
+            user=user, active=True).values_list('county_id', flat=True)
+    ] + [
+        'constituency:{}'.format(constituency_id) for constituency_id in
+        UserConstituency.objects.filter(
+            user=user, active=True).values_list(
+                'constituency_id', flat=True)
+    ] + [
+        'sub_county:{}'.format(sub_county_id) for sub_county_id in
+        UserSubCounty.objects.filter(
+            user=user, active=True).values_list('sub_county_id', flat=True)
+    ]
+    return sorted(areas) or [NATIONAL_AREA]
+
+
+def get_ward_areas(ward_id):
+    areas = [NATIONAL_AREA]
+    ward = Ward.objects.filter(id=ward_id).values(
+        'constituency_id', 'constituency__county_id', 'sub_county_id')
+    for ward_areas in ward:
+        areas.extend([
+            'constituency:{}'.format(ward_areas['constituency_id']),
+            'county:{}'.format(ward_areas['constituency__county_id']),
+            'sub_county:{}'.format(ward_areas['sub_county_id'])
+        ])
+    return areas
+
+
+class ScopedCacheMixin(object):
+    """
+    Cache the data of a view's responses per user scope
+
+    Views call `get_cached_data` with a function that computes the data.
+    """
+
+    def get_cache_seconds(self):
+        return getattr(settings, 'SCOPED_CACHE_SECONDS', 60 * 15)
+
+    def get_cache_areas(self):
+        return get_user_areas(self.request.user)
+
+    def get_cache_scope(self):
+        user = self.request.user
+        regulator = user.regulator
+        return [
+            str(regulator.pk) if regulator else '',
+            ','.join(sorted(user.get_all_permissions()))
+        ]
+
+    def get_cache_key(self):
+        areas = self.get_cache_areas()
+        key_parts = [self.__class__.__name__] + areas + [
+            str(version) for version in get_area_versions(areas)
+        ] + self.get_cache_scope() + [
+            '{}={}'.format(param, value) for param, value in
+            sorted(self.request.query_params.items())
+        ]
+        return '{}:{}'.format(
+            SCOPED_CACHE_PREFIX,
+            hashlib.sha1('|'.join(key_parts).encode('utf-8')).hexdigest())
+
+    def get_cached_data(self, compute_data):
+        key = self.get_cache_key()
+        data = cache.get(key)
+        if data is None:
+            data = compute_data()
+            cache.set(key, data, self.get_cache_seconds())
+        return data
+
+
+@receiver(post_init, sender=Facility)
+def remember_facility_cache_ward(sender, instance, **kwargs):
+    # the ward the facility was loaded with, so that moving the facility
+    # also invalidates the areas it is leaving
+    instance._cache_ward_id = instance.__dict__.get('ward_id')
+
+
+@receiver(post_save, sender=Facility)
+def invalidate_facility_areas(sender, instance, **kwargs):
+    areas = set(get_ward_areas(instance.ward_id))
+    old_ward_id = getattr(instance, '_cache_ward_id', None)
+    if old_ward_id and old_ward_id != instance.ward_id:
+        areas.update(get_ward_areas(old_ward_id))
+    schedule_invalidation(areas)
+    instance._cache_ward_id = instance.ward_id
+
+
+@receiver(post_init, sender=CommunityHealthUnit)
+def remember_chu_cache_facility(sender, instance, **kwargs):
+    instance._cache_facility_id = instance.__dict__.get('facility_id')
+
+
+@receiver(post_save, sender=CommunityHealthUnit)
+def invalidate_chu_areas(sender, instance, **kwargs):
+    facility_ids = set([
+        getattr(instance, '_cache_facility_id', None), instance.facility_id])
+    ward_ids = Facility.everything.filter(
+        id__in=[
+            facility_id for facility_id in facility_ids if facility_id
+        ]).values_list('ward_id', flat=True)
+    areas = set([NATIONAL_AREA])
+    for ward_id in ward_ids:
+        areas.update(get_ward_areas(ward_id))
+    schedule_invalidation(areas)
+    instance._cache_facility_id = instance.facility_id
+
+
+@receiver(post_save)
+def invalidate_lookups(sender, **kwargs):
+    if sender in LOOKUP_MODELS:
+        schedule_invalidation([LOOKUPS_AREA])
@@ -69,6 +69,7 @@ from ..filters import (
 )
 from .shared_views import AuditableDetailViewMixin
 from ..utilities import CustomRetrieveUpdateDestroyView
+from ..utilities.scoped_cache import ScopedCacheMixin, LOOKUPS_AREA
 
 
 class UserSubCountyListView(generics.ListCreateAPIView):
@@ -517,15 +518,25 @@ class TownDetailView(
     serializer_class = TownSerializer
 
 
-class FilteringSummariesView(views.APIView):
+class FilteringSummariesView(ScopedCacheMixin, views.APIView):
 
     """
         Retrieves filtering summaries
     """
     serializer_cls = FilteringSummariesSerializer
 
+    def get_cache_areas(self):
+        return [LOOKUPS_AREA]
+
+    def get_cache_scope(self):
+        # the summaries are the same for every user
+        return []
+
     def get(self, request):
-        fields = request.query_params.get('fields', None)
+        return response.Response(self.get_cached_data(self.get_summaries))
+
+    def get_summaries(self):
+        fields = self.request.query_params.get('fields', None)
         fields_model_mapping = {
             'county': (County, ('id', 'name', )),
             'sub_county': (SubCounty, ('id', 'name', 'county', )),
@@ -545,11 +556,12 @@ class FilteringSummariesView(views.APIView):
             for key in fields.split(","):
                 if key in fields_model_mapping:
                     model, chosen_fields = fields_model_mapping[key]
-                    resp[key] = model.objects.values(*chosen_fields).distinct()
+                    resp[key] = list(
+                        model.objects.values(*chosen_fields).distinct())
             res = self.serializer_cls(data=resp).initial_data
         else:
             res = {}
-        return response.Response(res)
+        return res
 
 
 class UserConstituencyListView(generics.ListCreateAPIView):
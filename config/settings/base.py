@@ -292,6 +292,17 @@ CACHES = {
 }
 CACHE_MIDDLEWARE_SECONDS = 15  # Intentionally conservative by default
 
+# cache for the responses shared by the users with the same scope e.g the
+# dashboard; these are also invalidated when facilities and CHUs change
+SCOPED_CACHE_SECONDS = 60 * 15
+
+# reports generated in the background are kept, and reused by identical
+# requests, for a day; list endpoints are serialized 1000 rows at a time.
+# Pending or running jobs that have not moved for an hour are not reused
+REPORT_JOB_TTL_SECONDS = 60 * 60 * 24
+REPORT_JOB_CHUNK_SIZE = 1000
+REPORT_JOB_STALE_SECONDS = 60 * 60
+
 # cache for the gis views
 GIS_BORDERS_CACHE_SECONDS = (60 * 60 * 24 * 366)
 
@@ -310,7 +321,34 @@ SEARCH = {
     "ELASTIC_URL": "http://localhost:9200/",
     "INDEX_NAME": "mfl_index",
     "REALTIME_INDEX": env('REALTIME_INDEX'),
+    # seconds to wait for more saves before indexing the saved records
+    "REALTIME_INDEX_DEBOUNCE": 5,
     "SEARCH_RESULT_SIZE": 50,
+    # the most hits that can be paged through, elasticsearch's own default
+    "MAX_SEARCH_WINDOW": 10000,
+    # number of documents sent to elasticsearch per bulk request
+    "BULK_INDEX_CHUNK_SIZE": 500,
+    # the live index plus the previous generations kept for rollbacks
+    "INDEX_GENERATIONS_TO_KEEP": 2,
+    # draining of the failed indexing queue; a record that has failed n
+    # times waits RETRY_INDEXING_BACKOFF * (2 ** n - 1) seconds
+    "RETRY_INDEXING_CHUNK_SIZE": 500,
+    "RETRY_INDEXING_MAX_ROWS": 5000,
+    "RETRY_INDEXING_BACKOFF": 60,
+    "RETRY_INDEXING_MAX_BACKOFF": 60 * 60,
+    "RETRY_INDEXING_LOCK_TIMEOUT": 60 * 10,
+    # elasticsearch health checks; all values are in seconds
+    "HEALTH_CHECK_TTL": 10,
+    "HEALTH_CHECK_RETRY_INTERVAL": 30,
+    "HEALTH_CHECK_TIMEOUT": 2,
+    # connection pooling, timeouts and retries for elasticsearch requests
+    "HTTP_POOL_SIZE": 10,
+    "HTTP_CONNECT_TIMEOUT": 2,
+    "HTTP_READ_TIMEOUT": 10,
+    "HTTP_RETRIES": 2,
+    "HTTP_RETRY_BACKOFF": 0.5,
+    # request bodies at least this long are gzipped, None disables it
+    "HTTP_GZIP_MIN_LENGTH": 1024,
     "NON_INDEXABLE_MODELS": [
         "mfl_gis.FacilityCoordinates",
         "mfl_gis.WorldBorder",
@@ -320,9 +358,17 @@ SEARCH = {
         "mfl_gis.DrilldownView",
         "users.CustomGroup",
         "users.ProxyGroup",
-        "facilities.FacilityUpdates"
-
+        "facilities.FacilityUpdates",
+        "reporting.ReportJob",
+        "reporting.FacilityRollup",
+        "reporting.CommunityHealthUnitRollup"
     ],
+    # models searched with postgres full text search when elasticsearch
+    # is not available, mapped to the table holding their `search_vector`
+    "DATABASE_FULL_TEXT_MODELS": {
+        "facilities.facility": "facilities_facility",
+        "facilities.facilityexportexcelmaterialview": "facilities_facility"
+    },
     "STOP_WORDS": [
         "centre", "center", "health", "hospital", "clinic", "district",
         "sub-district", "dispensary"
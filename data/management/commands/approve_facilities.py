@@ -13,6 +13,7 @@ from django.core.exceptions import ValidationError
 
 from facilities.models import Facility
 from chul.models import CommunityHealthUnit
+from search.search_utils import batched_indexing
 
 logger = logging.getLogger(__name__)
 
@@ -37,8 +38,10 @@ class Command(BaseCommand):
 
     def handle(self, *args, **options):
         def do_approve_facilities():
-            for facility in Facility.objects.all():
-                update_facility(facility)
+            # the facilities are indexed together once they are all approved
+            with batched_indexing():
+                for facility in Facility.objects.all():
+                    update_facility(facility)
 
         def approve_community_units():
             q = Pool(5)
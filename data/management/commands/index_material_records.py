@@ -6,7 +6,7 @@ import logging
 from django.core.management import BaseCommand
 
 from facilities.models import FacilityExportExcelMaterialView
-from search.search_utils import index_instance
+from search.search_utils import bulk_index_queryset
 
 logger = logging.getLogger(__name__)
 
@@ -14,6 +14,6 @@ logger = logging.getLogger(__name__)
 class Command(BaseCommand):
 
     def handle(self, *args, **options):
-        for record in FacilityExportExcelMaterialView.objects.all():
-            index_instance(record)
-            logger.info("indexed instance {0}".format(record.name))
+        for batch in bulk_index_queryset(
+                FacilityExportExcelMaterialView.objects.all()):
+            logger.info("indexed {0} records".format(batch.get('indexed')))
@@ -4,6 +4,7 @@ import glob
 
 from django.core.management import BaseCommand
 
+from search.search_utils import batched_indexing
 from ...bootstrap import process_json_file
 
 
@@ -13,14 +14,16 @@ class Command(BaseCommand):
         parser.add_argument('data_file', nargs='+', type=str)
 
     def handle(self, *args, **options):
-        for suggestion in options['data_file']:
-            # if it's just a simple json file
-            if os.path.exists(suggestion) and os.path.isfile(suggestion):
-
-                process_json_file(suggestion)
-            else:
-                # check if it's a glob
-                for filename in glob.glob(suggestion):
-                    process_json_file(filename)
+        # the saved records are indexed together once everything is loaded
+        with batched_indexing():
+            for suggestion in options['data_file']:
+                # if it's just a simple json file
+                if os.path.exists(suggestion) and os.path.isfile(suggestion):
+
+                    process_json_file(suggestion)
+                else:
+                    # check if it's a glob
+                    for filename in glob.glob(suggestion):
+                        process_json_file(filename)
 
         self.stdout.write("Done loading")
@@ -151,9 +151,10 @@ def build_search_index(*args, **kwargs):
 
 
 def recreate_search_index(*args, **kwargs):
-    remove_search_index()
-    create_search_index()
-    build_search_index()
+    """
+    Rebuilds the search index in the background and swaps it in once done
+    """
+    manage('rebuild_index')
 
 
 def setup_db(*args, **kwargs):
@@ -0,0 +1,16 @@
+# -*- coding: utf-8 -*-
+import os
+from django.db import migrations
+
+with open(os.path.dirname(__file__)+'/facility_full_text_search.sql') as f:
+   full_text_search_sql = f.read()
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('facilities', 'update_export_facilities_material_view'),
+    ]
+
+    operations = [
+        migrations.RunSQL(full_text_search_sql),
+    ]
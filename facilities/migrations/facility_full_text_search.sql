@@ -0,0 +1,35 @@
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+ALTER TABLE facilities_facility ADD COLUMN search_vector tsvector;
+
+create or replace function facilities_facility_search_vector_update()
+returns trigger language plpgsql
+as $$
+begin
+    NEW.search_vector :=
+        setweight(to_tsvector('simple', coalesce(NEW.name, '')), 'A') ||
+        setweight(to_tsvector('simple', coalesce(NEW.official_name, '')), 'A') ||
+        setweight(to_tsvector('simple', coalesce(NEW.code::text, '')), 'A') ||
+        setweight(to_tsvector('simple', coalesce(NEW.registration_number, '')), 'B') ||
+        setweight(to_tsvector('simple', coalesce(NEW.abbreviation, '')), 'B') ||
+        setweight(to_tsvector('simple', coalesce(NEW.nearest_landmark, '')), 'C') ||
+        setweight(to_tsvector('simple', coalesce(NEW.location_desc, '')), 'C') ||
+        setweight(to_tsvector('simple', coalesce(NEW.description, '')), 'D');
+    return NEW;
+end $$;
+
+DROP TRIGGER IF EXISTS facilities_facility_search_vector ON facilities_facility;
+create trigger facilities_facility_search_vector
+before insert or update of name, official_name, code, registration_number,
+abbreviation, nearest_landmark, location_desc, description
+on facilities_facility for each row
+execute procedure facilities_facility_search_vector_update();
+
+-- populate the search vector for the existing facilities
+UPDATE facilities_facility SET name = name;
+
+CREATE INDEX facilities_facility_search_vector_idx
+ON facilities_facility USING gin(search_vector);
+
+CREATE INDEX facilities_facility_name_trgm_idx
+ON facilities_facility USING gin(name gin_trgm_ops);
@@ -0,0 +1,16 @@
+# -*- coding: utf-8 -*-
+import os
+from django.db import migrations
+
+with open(os.path.dirname(__file__)+'/incremental_excel_export.sql') as f:
+   excel_export_sql = f.read()
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('facilities', 'facility_full_text_search'),
+    ]
+
+    operations = [
+        migrations.RunSQL(excel_export_sql),
+    ]
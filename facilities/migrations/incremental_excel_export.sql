@@ -0,0 +1,174 @@
+-- Replace the materialized view, which was refreshed in full after every
+-- write to facilities, with a table that is kept up to date row by row.
+
+DROP TRIGGER IF EXISTS refresh_mat_view ON facilities_facility;
+DROP FUNCTION IF EXISTS refresh_mat_view();
+
+-- the export rows as they should be; only ever read for a few facilities
+-- at a time or by the periodic reconciliation
+CREATE OR REPLACE VIEW facilities_excel_export_source AS
+SELECT facilities_facility.id as id, facilities_facility.search as search,
+facilities_facility.name as name, facilities_facility.code as code,
+facilities_facility.registration_number, facilities_facility.number_of_beds as beds,
+facilities_facility.number_of_cots as cots, common_ward.name as ward_name,
+common_ward.id as ward,facilities_facility.approved,facilities_facility.created,
+facilities_facility.open_whole_day, facilities_facility.open_public_holidays,
+facilities_facility.open_weekends, facilities_facility.open_late_night,
+facilities_facility.closed, facilities_facility.is_published,
+common_county.name as county_name, common_county.id as county,
+common_constituency.name as constituency_name,common_constituency.id as constituency,
+common_subcounty.name as sub_county_name,common_subcounty.id as sub_county,
+facilities_facilitytype.name as facility_type_name, facilities_facilitytype.id as facility_type,
+facilities_kephlevel.name as keph_level_name,facilities_kephlevel.id as keph_level,
+facilities_owner.name as owner_name,facilities_owner.id as owner,
+facilities_ownertype.name as owner_type_name,facilities_ownertype.id as owner_type,
+facilities_regulatingbody.name as regulatory_body_name,facilities_regulatingbody.id as regulatory_body,
+facilities_facilitystatus.name as operation_status_name, facilities_facilitystatus.id as operation_status,
+facilities_facilitystatus.is_public_visible as is_public_visible,
+array(select distinct service_id from facilities_facilityservice where facilities_facilityservice.facility_id=facilities_facility.id) as services,
+array(select distinct category_id from facilities_facilityservice inner join facilities_service on facilities_service.id=facilities_facilityservice.service_id where facilities_facilityservice.facility_id=facilities_facility.id) as categories
+
+FROM facilities_facility
+LEFT JOIN facilities_kephlevel ON facilities_kephlevel.id = facilities_facility.keph_level_id
+LEFT JOIN facilities_owner ON facilities_owner.id = facilities_facility.owner_id
+LEFT JOIN facilities_ownertype ON facilities_owner.owner_type_id = facilities_ownertype.id
+LEFT JOIN facilities_facilitytype ON facilities_facilitytype.id = facilities_facility.facility_type_id
+LEFT JOIN facilities_regulatingbody ON facilities_regulatingbody.id = facilities_facility.regulatory_body_id
+LEFT JOIN facilities_facilitystatus ON facilities_facilitystatus.id = facilities_facility.operation_status_id
+LEFT JOIN common_ward ON  common_ward.id = facilities_facility.ward_id
+LEFT JOIN common_constituency ON  common_constituency.id = common_ward.constituency_id
+LEFT JOIN common_subcounty ON  common_subcounty.id = common_ward.sub_county_id
+LEFT JOIN common_county ON  common_county.id = common_constituency.county_id;
+
+DROP MATERIALIZED VIEW IF EXISTS facilities_excel_export;
+
+CREATE TABLE facilities_excel_export AS
+SELECT * FROM facilities_excel_export_source;
+
+ALTER TABLE facilities_excel_export ADD PRIMARY KEY (id);
+CREATE INDEX facilities_excel_export_created ON facilities_excel_export (created);
+
+
+-- concurrent refreshes of a facility are serialized by an advisory lock on
+-- its id, otherwise both could insert its row and one would fail, rolling
+-- back the write that fired it. The locks are taken in order to avoid
+-- deadlocks and are released when the transaction ends.
+create or replace function refresh_facilities_excel_export(facility_ids uuid[])
+returns void language plpgsql
+as $$
+declare
+    facility_id uuid;
+begin
+    FOR facility_id IN
+        SELECT DISTINCT ids.id FROM unnest(facility_ids) AS ids(id)
+        WHERE ids.id IS NOT NULL ORDER BY ids.id
+    LOOP
+        PERFORM pg_advisory_xact_lock(hashtext(facility_id::text));
+    END LOOP;
+
+    DELETE FROM facilities_excel_export WHERE id = ANY(facility_ids);
+    INSERT INTO facilities_excel_export
+    SELECT * FROM facilities_excel_export_source
+    WHERE id = ANY(facility_ids);
+end $$;
+
+
+-- brings the whole table in line with its source without blocking readers,
+-- the equivalent of `refresh materialized view concurrently`. Writers wait
+-- for it to finish so that their refreshes do not race its inserts.
+create or replace function reconcile_facilities_excel_export()
+returns void language plpgsql
+as $$
+begin
+    LOCK TABLE facilities_excel_export IN SHARE ROW EXCLUSIVE MODE;
+
+    DELETE FROM facilities_excel_export
+    WHERE NOT EXISTS (
+        SELECT 1 FROM facilities_facility
+        WHERE facilities_facility.id = facilities_excel_export.id);
+
+    DELETE FROM facilities_excel_export
+    USING facilities_excel_export_source
+    WHERE facilities_excel_export_source.id = facilities_excel_export.id
+    AND ROW(facilities_excel_export.*) IS DISTINCT FROM
+        ROW(facilities_excel_export_source.*);
+
+    INSERT INTO facilities_excel_export
+    SELECT * FROM facilities_excel_export_source
+    WHERE NOT EXISTS (
+        SELECT 1 FROM facilities_excel_export
+        WHERE facilities_excel_export.id = facilities_excel_export_source.id);
+end $$;
+
+
+create or replace function facility_excel_export_changed()
+returns trigger language plpgsql
+as $$
+begin
+    IF TG_OP = 'DELETE' THEN
+        PERFORM refresh_facilities_excel_export(ARRAY[OLD.id]);
+    ELSE
+        PERFORM refresh_facilities_excel_export(ARRAY[NEW.id]);
+    END IF;
+    return null;
+end $$;
+
+DROP TRIGGER IF EXISTS facility_excel_export ON facilities_facility;
+create trigger facility_excel_export
+after insert or update or delete
+on facilities_facility for each row
+execute procedure facility_excel_export_changed();
+
+
+create or replace function facility_service_excel_export_changed()
+returns trigger language plpgsql
+as $$
+begin
+    IF TG_OP = 'INSERT' THEN
+        PERFORM refresh_facilities_excel_export(ARRAY[NEW.facility_id]);
+    ELSIF TG_OP = 'DELETE' THEN
+        PERFORM refresh_facilities_excel_export(ARRAY[OLD.facility_id]);
+    ELSE
+        PERFORM refresh_facilities_excel_export(
+            ARRAY[OLD.facility_id, NEW.facility_id]);
+    END IF;
+    return null;
+end $$;
+
+DROP TRIGGER IF EXISTS facility_service_excel_export ON facilities_facilityservice;
+create trigger facility_service_excel_export
+after insert or update of facility_id, service_id or delete
+on facilities_facilityservice for each row
+execute procedure facility_service_excel_export_changed();
+
+
+create or replace function ward_excel_export_changed()
+returns trigger language plpgsql
+as $$
+begin
+    PERFORM refresh_facilities_excel_export(ARRAY(
+        SELECT id FROM facilities_facility WHERE ward_id = NEW.id));
+    return null;
+end $$;
+
+DROP TRIGGER IF EXISTS ward_excel_export ON common_ward;
+create trigger ward_excel_export
+after update of name, constituency_id, sub_county_id
+on common_ward for each row
+execute procedure ward_excel_export_changed();
+
+
+create or replace function owner_excel_export_changed()
+returns trigger language plpgsql
+as $$
+begin
+    PERFORM refresh_facilities_excel_export(ARRAY(
+        SELECT id FROM facilities_facility WHERE owner_id = NEW.id));
+    return null;
+end $$;
+
+DROP TRIGGER IF EXISTS owner_excel_export ON facilities_owner;
+create trigger owner_excel_export
+after update of name, owner_type_id
+on facilities_owner for each row
+execute procedure owner_excel_export_changed();
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+# count the ratings that were made before the counters existed
+backfill_rating_counters_sql = """
+UPDATE facilities_facilityservice fs
+SET rating_sum = r.rating_sum, rating_count = r.rating_count
+FROM (
+    SELECT facility_service_id, SUM(rating) AS rating_sum,
+        COUNT(*) AS rating_count
+    FROM facilities_facilityservicerating
+    WHERE deleted = false
+    GROUP BY facility_service_id
+) r
+WHERE r.facility_service_id = fs.id;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('facilities', 'incremental_excel_export'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='facilityservice',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='facilityservice',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunSQL(backfill_rating_counters_sql),
+    ]
@@ -17,12 +17,13 @@ from django.contrib.postgres.fields import ArrayField
 
 
 from users.models import JobTitle  # NOQA
-from search.search_utils import index_instance
+from search.search_utils import schedule_index
 from common.models import (
     AbstractBase, Ward, Contact, SequenceMixin, SubCounty, Town,
-    County
+    County, ChangeTrackerMixin
 )
 from common.fields import SequenceField
+from common.utilities.rating_counters import RatedMixin, RatingCounterMixin
 
 LOGGER = logging.getLogger(__name__)
 
@@ -641,7 +642,7 @@ class FacilityExportExcelMaterialView(models.Model):
     'parent', 'regulatory_body', 'keph_level', 'sub_county', 'town'
 ])
 @encoding.python_2_unicode_compatible
-class Facility(SequenceMixin, AbstractBase):
+class Facility(ChangeTrackerMixin, SequenceMixin, AbstractBase):
 
     """
     A health institution in Kenya.
@@ -795,8 +796,11 @@ class Facility(SequenceMixin, AbstractBase):
 
     @property
     def latest_update(self):
-        facility_updates = FacilityUpdates.objects.filter(
-            facility=self, approved=False, cancelled=False)
+        # prefetched by `facilities.query_plans` for lists of facilities
+        facility_updates = getattr(self, 'prefetched_pending_updates', None)
+        if facility_updates is None:
+            facility_updates = FacilityUpdates.objects.filter(
+                facility=self, approved=False, cancelled=False)
         if facility_updates:
             return str(facility_updates[0].id)
         else:
@@ -816,10 +820,13 @@ class Facility(SequenceMixin, AbstractBase):
 
     @property
     def current_regulatory_status(self):
+        regulatory_details = getattr(
+            self, 'prefetched_regulatory_details', None)
+        if regulatory_details is None:
+            regulatory_details = self.regulatory_details.filter(facility=self)
         try:
             # returns in reverse chronological order so just pick the first one
-            return self.regulatory_details.filter(
-                facility=self)[0].regulation_status.name
+            return regulatory_details[0].regulation_status.name
         except IndexError:
             return self.regulatory_body.default_status.name
 
@@ -854,10 +861,19 @@ class Facility(SequenceMixin, AbstractBase):
     def owner_type_name(self):
         return self.owner.owner_type.name
 
+    def _get_approvals(self, include_cancelled=False):
+        approvals = getattr(self, 'prefetched_approvals', None)
+        if approvals is None:
+            approvals = FacilityApproval.objects.filter(facility=self)
+            return approvals if include_cancelled else approvals.filter(
+                is_cancelled=False)
+        return approvals if include_cancelled else [
+            approval for approval in approvals if not approval.is_cancelled
+        ]
+
     @property
     def is_approved(self):
-        approvals = FacilityApproval.objects.filter(
-            facility=self, is_cancelled=False).count()
+        approvals = self._get_approvals()
         if approvals:
             return True
         else:
@@ -865,8 +881,7 @@ class Facility(SequenceMixin, AbstractBase):
 
     @property
     def latest_approval(self):
-        approvals = FacilityApproval.objects.filter(
-            facility=self, is_cancelled=False)
+        approvals = self._get_approvals()
         if approvals:
             return approvals[0]
         else:
@@ -874,7 +889,7 @@ class Facility(SequenceMixin, AbstractBase):
 
     @property
     def latest_approval_or_rejection(self):
-        approvals = FacilityApproval.objects.filter(facility=self)
+        approvals = self._get_approvals(include_cancelled=True)
         if approvals:
             return {
                 "id": str(approvals[0].id),
@@ -926,7 +941,7 @@ class Facility(SequenceMixin, AbstractBase):
             i.average_rating for i in self.facility_services.all()
         ]
         try:
-            return sum(avg_service_rating, 0) / self.facility_services.count()
+            return sum(avg_service_rating, 0) / len(avg_service_rating)
         except ZeroDivisionError:
             return 0
 
@@ -1007,7 +1022,7 @@ class Facility(SequenceMixin, AbstractBase):
         else:
             return getattr(self, field)
 
-    def _dump_updates(self, origi_model):
+    def _dump_updates(self, changed_fields):
         fields = [field.name for field in self._meta.fields]
         forbidden_fields = [
             'regulatory_status', 'facility_type',
@@ -1016,8 +1031,7 @@ class Facility(SequenceMixin, AbstractBase):
             'closing_reason', 'closed_date']
         data = []
         for field in fields:
-            if (getattr(self, field) != getattr(origi_model, field) and
-                    field not in forbidden_fields):
+            if field in changed_fields and field not in forbidden_fields:
                 field_data = getattr(self, field)
                 updated_details = {
                     "display_value": self._get_field_human_attribute(
@@ -1034,6 +1048,32 @@ class Facility(SequenceMixin, AbstractBase):
             message = "The facility was not scheduled for update"
             LOGGER.info(message)
 
+    def _has_serialized_changes(self, changed_fields):
+        """
+        Tells whether the changes alter the serialized facility
+
+        Only the changed fields are serialized, with and without the
+        changes.
+        """
+        from facilities.serializers import FacilityDetailSerializer
+        serializer_fields = FacilityDetailSerializer().fields
+        loaded_instance = self.get_loaded_instance()
+
+        def serialize(field, instance):
+            attribute = field.get_attribute(instance)
+            if getattr(attribute, 'pk', attribute) is None:
+                return None
+            return field.to_representation(attribute)
+
+        for field_name in changed_fields:
+            if field_name in ('updated', 'created', 'updated_by') or \
+                    field_name not in serializer_fields:
+                continue
+            field = serializer_fields[field_name]
+            if serialize(field, self) != serialize(field, loaded_instance):
+                return True
+        return False
+
     def index_facility_material_view(self):
         """
         Updates the search index with facilities in the material view
@@ -1043,16 +1083,15 @@ class Facility(SequenceMixin, AbstractBase):
         updates on the material views.
         This function ensures that once a facility is saved, the
         search index is updated with the  respective record in the
-        material view is updated
+        material view is updated.
+        The record is indexed asynchronously, once the request or the
+        `batched_indexing` block that saved the facility ends.
         """
-
-        mat_view_facility_record = FacilityExportExcelMaterialView.objects.get(
-            id=self.id)
-        index_instance(
+        schedule_index((
             "facilities",
             "FacilityExportExcelMaterialView",
-            str(mat_view_facility_record.id)
-        )
+            str(self.id)
+        ))
 
     def save(self, *args, **kwargs):  # NOQA
         """
@@ -1061,7 +1100,6 @@ class Facility(SequenceMixin, AbstractBase):
         The updates will appear on the facility once the updates have been
         approved.
         """
-        from facilities.serializers import FacilityDetailSerializer
         if not self.code:
             self.code = self.generate_next_code_sequence()
         if not self.official_name:
@@ -1072,10 +1110,10 @@ class Facility(SequenceMixin, AbstractBase):
             self.index_facility_material_view()
             return
 
-        old_details = self.__class__.objects.get(id=self.id)
+        was_closed = self.get_loaded_values().get('closed')
 
         # enable closing a facility
-        if not old_details.closed and self.closed:
+        if not was_closed and self.closed:
             self.is_published = False
             kwargs.pop('allow_save', None)
             super(Facility, self).save(*args, **kwargs)
@@ -1083,39 +1121,20 @@ class Facility(SequenceMixin, AbstractBase):
             return
 
         # enable opening a facility
-        if old_details.closed and not self.closed:
+        if was_closed and not self.closed:
             self.is_published = True
             kwargs.pop('allow_save', None)
             super(Facility, self).save(*args, **kwargs)
             self.index_facility_material_view()
             return
 
-        old_details_serialized = FacilityDetailSerializer(
-            old_details).data
-        del old_details_serialized['updated']
-        del old_details_serialized['created']
-        del old_details_serialized['updated_by']
-        new_details_serialized = FacilityDetailSerializer(
-            self).data
-        del new_details_serialized['updated']
-        del new_details_serialized['created']
-        del new_details_serialized['updated_by']
-
-        origi_model = self.__class__.objects.get(id=self.id)
         allow_save = kwargs.pop('allow_save', None)
         if allow_save:
             super(Facility, self).save(*args, **kwargs)
             self.index_facility_material_view()
         else:
-            updates = self._dump_updates(origi_model)
-            try:
-                updates.pop('updated_by')
-            except:
-                pass
-            try:
-                updates.pop('updated_by_id')
-            except:
-                pass
+            changed_fields = self.get_changed_fields()
+            updates = self._dump_updates(changed_fields)
             if updates:
                 try:
                     facility_update = FacilityUpdates.objects.filter(
@@ -1127,7 +1146,7 @@ class Facility(SequenceMixin, AbstractBase):
                     FacilityUpdates.objects.create(
                         facility_updates=updates, facility=self,
                         created_by=self.updated_by, updated_by=self.updated_by
-                    ) if new_details_serialized != old_details_serialized \
+                    ) if self._has_serialized_changes(changed_fields) \
                         else None
 
     def __str__(self):
@@ -1226,7 +1245,7 @@ class FacilityUpdates(AbstractBase):
             self.facility.has_edits = True
         else:
             self.facility.has_edits = False
-        old_facility = Facility.objects.get(id=self.facility.id)
+        old_facility = self.facility.get_loaded_instance()
         if self.facility_updates:
             data = json.loads(self.facility_updates)
             for field_changed in data:
@@ -1685,7 +1704,7 @@ class Service(SequenceMixin, AbstractBase):
 
 @reversion.register(follow=['facility', 'option', 'service'])
 @encoding.python_2_unicode_compatible
-class FacilityService(AbstractBase):
+class FacilityService(RatedMixin, AbstractBase):
 
     """
     A facility can have zero or more services.
@@ -1702,6 +1721,9 @@ class FacilityService(AbstractBase):
     # For services that do not have options, the service will be linked
     # directly to the
     service = models.ForeignKey(Service)
+    # the totals of the service's ratings; kept by `FacilityServiceRating`
+    rating_sum = models.PositiveIntegerField(default=0, editable=False)
+    rating_count = models.PositiveIntegerField(default=0, editable=False)
 
     @property
     def service_has_options(self):
@@ -1709,7 +1731,7 @@ class FacilityService(AbstractBase):
 
     @property
     def number_of_ratings(self):
-        return self.facility_service_ratings.count()
+        return self.rating_count
 
     @property
     def service_name(self):
@@ -1721,8 +1743,9 @@ class FacilityService(AbstractBase):
 
     @property
     def average_rating(self):
-        avg = self.facility_service_ratings.aggregate(models.Avg('rating'))
-        return avg['rating__avg'] or 0.0
+        if not self.rating_count:
+            return 0.0
+        return self.rating_sum / self.rating_count
 
     def __str__(self):
         if self.option:
@@ -1749,9 +1772,10 @@ class FacilityService(AbstractBase):
 
 @reversion.register(follow=['facility_service', ])
 @encoding.python_2_unicode_compatible
-class FacilityServiceRating(AbstractBase):
+class FacilityServiceRating(RatingCounterMixin, AbstractBase):
 
     """Rating of a facility's service"""
+    rated_field = 'facility_service'
 
     facility_service = models.ForeignKey(
         FacilityService, related_name='facility_service_ratings'
@@ -0,0 +1,62 @@
+"""
+Query plans for serializing many facilities
+
+Serializing a facility reads its admin areas, owner, regulation status,
+approvals, pending updates and rated services. Without a plan every one
+of those is at least one query per facility. `plan_facility_queryset`
+selects the related rows in the facilities query and prefetches the rest
+in one query per relation. The `Facility` properties use the prefetched
+rows when they are present and the services carry their rating totals.
+"""
+from django.db.models import Prefetch
+
+from .models import (
+    FacilityApproval,
+    FacilityRegulationStatus,
+    FacilityService,
+    FacilityUpdates
+)
+
+FACILITY_SELECT_RELATED = (
+    'ward__constituency__county',
+    'ward__sub_county',
+    'facility_type',
+    'operation_status',
+    'owner__owner_type',
+    'regulatory_body__default_status',
+    'keph_level',
+)
+
+
+def get_facility_prefetches():
+    services = FacilityService.objects.select_related(
+        'service__category', 'option')
+    return [
+        Prefetch('facility_services', queryset=services),
+        Prefetch(
+            'regulatory_details',
+            queryset=FacilityRegulationStatus.objects.select_related(
+                'regulation_status'),
+            to_attr='prefetched_regulatory_details'),
+        Prefetch(
+            'facilityapproval_set',
+            queryset=FacilityApproval.objects.all(),
+            to_attr='prefetched_approvals'),
+        Prefetch(
+            'updates',
+            queryset=FacilityUpdates.objects.filter(
+                approved=False, cancelled=False).only(
+                    'id', 'facility', 'updated', 'created'),
+            to_attr='prefetched_pending_updates'),
+    ]
+
+
+def plan_facility_queryset(queryset):
+    """
+    Fetch everything that the facility serializers read with the queryset
+    """
+    return queryset.select_related(
+        *FACILITY_SELECT_RELATED
+    ).prefetch_related(
+        *get_facility_prefetches()
+    )
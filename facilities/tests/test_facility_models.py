@@ -3,11 +3,13 @@ import json
 from datetime import timedelta
 
 from django.contrib.auth import get_user_model
+from django.db import connection
 from django.utils import timezone
 from django.core.exceptions import ObjectDoesNotExist, ValidationError
 
 from model_mommy import mommy
 
+from common.tasks import refresh_material_views
 from common.tests.test_models import BaseTestCase
 from common.models import (
     Contact,
@@ -267,6 +269,50 @@ class TestFacilityService(BaseTestCase):
         mommy.make(FacilityServiceRating, facility_service=fs_2, rating=3)
         self.assertEquals(3, fs_2.number_of_ratings)
 
+    def test_rating_counters(self):
+        fs = mommy.make(FacilityService)
+        other_fs = mommy.make(FacilityService)
+        rating = mommy.make(
+            FacilityServiceRating, facility_service=fs, rating=2)
+        mommy.make(FacilityServiceRating, facility_service=fs, rating=4)
+
+        fs = FacilityService.objects.get(id=fs.id)
+        self.assertEquals((6, 2), (fs.rating_sum, fs.rating_count))
+        self.assertEquals(3, fs.average_rating)
+
+        # changing a rating replaces it in the totals
+        rating.rating = 5
+        rating.save()
+        fs = FacilityService.objects.get(id=fs.id)
+        self.assertEquals((9, 2), (fs.rating_sum, fs.rating_count))
+
+        # moving a rating to another service moves it between the totals
+        rating.facility_service = other_fs
+        rating.save()
+        fs = FacilityService.objects.get(id=fs.id)
+        other_fs = FacilityService.objects.get(id=other_fs.id)
+        self.assertEquals((4, 1), (fs.rating_sum, fs.rating_count))
+        self.assertEquals(
+            (5, 1), (other_fs.rating_sum, other_fs.rating_count))
+
+        # a deleted rating is no longer counted
+        rating.delete()
+        other_fs = FacilityService.objects.get(id=other_fs.id)
+        self.assertEquals(
+            (0, 0), (other_fs.rating_sum, other_fs.rating_count))
+        self.assertEquals(0, other_fs.average_rating)
+
+    def test_saving_a_stale_service_keeps_the_rating_counters(self):
+        fs = mommy.make(FacilityService)
+        stale_fs = FacilityService.objects.get(id=fs.id)
+        mommy.make(FacilityServiceRating, facility_service=fs, rating=4)
+
+        stale_fs.is_confirmed = True
+        stale_fs.save()
+        fs = FacilityService.objects.get(id=fs.id)
+        self.assertTrue(fs.is_confirmed)
+        self.assertEquals((4, 1), (fs.rating_sum, fs.rating_count))
+
     def test_facility_service(self):
         facility = mommy.make(Facility, name='thifitari')
         service_category = mommy.make(ServiceCategory, name='a good service')
@@ -1116,6 +1162,27 @@ class TestFacilityUpdates(BaseTestCase):
         facility.save()
         self.assertEquals(1, FacilityUpdates.objects.count())
 
+    def test_facility_changed_fields(self):
+        facility = mommy.make(Facility, name='Original', is_classified=False)
+        facility = Facility.objects.get(id=facility.id)
+        self.assertEquals([], facility.get_changed_fields())
+
+        facility.name = 'Changed'
+        facility.is_classified = True
+        self.assertEquals(
+            ['is_classified', 'name'], sorted(facility.get_changed_fields()))
+        self.assertEquals('Original', facility.get_loaded_instance().name)
+
+        facility.save()
+        self.assertEquals([], facility.get_changed_fields())
+
+    def test_edit_facility_updated_by_only(self):
+        facility = mommy.make(Facility)
+        mommy.make(FacilityApproval, facility=facility)
+        facility.updated_by = mommy.make(get_user_model())
+        facility.save()
+        self.assertEquals(0, FacilityUpdates.objects.count())
+
     def test_facility_updates(self):
         original_name = 'Some facility name'
         updated_name = 'The name has been editted'
@@ -1257,3 +1324,51 @@ class TestFacilityMaterializedModel(BaseTestCase):
             0,
             FacilityExportExcelMaterialView.objects.count()
         )
+
+    def test_facility_changes_are_exported(self):
+        facility = mommy.make(Facility, name='Ile Noma')
+        exported = FacilityExportExcelMaterialView.objects.get(id=facility.id)
+        self.assertEquals('Ile Noma', exported.name)
+
+        facility.name = 'Ile Noma Sana'
+        facility.save()
+        exported = FacilityExportExcelMaterialView.objects.get(id=facility.id)
+        self.assertEquals('Ile Noma Sana', exported.name)
+
+    def test_facility_service_changes_are_exported(self):
+        facility = mommy.make(Facility)
+        facility_service = mommy.make(FacilityService, facility=facility)
+        exported = FacilityExportExcelMaterialView.objects.get(id=facility.id)
+        self.assertEquals([facility_service.service.id], exported.services)
+
+        FacilityService.objects.filter(id=facility_service.id).delete()
+        exported = FacilityExportExcelMaterialView.objects.get(id=facility.id)
+        self.assertEquals([], exported.services)
+
+    def test_ward_and_owner_changes_are_exported(self):
+        facility = mommy.make(Facility)
+        ward = facility.ward
+        ward.name = 'Kileleshwa'
+        ward.save()
+        owner = facility.owner
+        owner.name = 'Wizara ya Afya'
+        owner.save()
+        exported = FacilityExportExcelMaterialView.objects.get(id=facility.id)
+        self.assertEquals('Kileleshwa', exported.ward_name)
+        self.assertEquals('Wizara ya Afya', exported.owner_name)
+
+    def test_reconcile_stale_export(self):
+        facility = mommy.make(Facility, name='Ile Noma')
+        cursor = connection.cursor()
+        cursor.execute(
+            "update facilities_excel_export set name = 'stale' "
+            "where id = %s", [str(facility.id)])
+        cursor.execute(
+            "insert into facilities_excel_export (id, name, created) "
+            "values (%s, 'orphan', now())",
+            ['37d9efc4-4d19-4c2f-a8e6-3d4c9a9b3d2e'])
+
+        refresh_material_views()
+        exported = FacilityExportExcelMaterialView.objects.get(id=facility.id)
+        self.assertEquals('Ile Noma', exported.name)
+        self.assertEquals(1, FacilityExportExcelMaterialView.objects.count())
@@ -1,7 +1,10 @@
 import json
 from datetime import timedelta
+from mock import patch
 
 from django.core.urlresolvers import reverse
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.contrib.auth import get_user_model
 from django.utils import timezone
 
@@ -12,6 +15,7 @@ from common.tests.test_views import (
     LoginMixin,
     default
 )
+from chul.models import CommunityHealthUnit
 from common.models import (
     Ward, UserCounty,
     County,
@@ -46,6 +50,7 @@ from ..models import (
     Service,
     Option,
     FacilityService,
+    FacilityServiceRating,
     FacilityContact,
     FacilityOfficer,
     Officer,
@@ -58,6 +63,7 @@ from ..models import (
     KephLevel,
     FacilityLevelChangeReason
 )
+from ..views import DashBoard
 
 from django.contrib.auth.models import Group, Permission
 
@@ -248,6 +254,52 @@ class TestFacilityView(LoginMixin, TestGroupAndPermissions, APITestCase):
             load_dump(response.data['results'], default=default)
         )
 
+    def _make_facility_with_related_rows(self):
+        facility = mommy.make(Facility)
+        facility_service = mommy.make(FacilityService, facility=facility)
+        mommy.make(
+            FacilityServiceRating, facility_service=facility_service,
+            rating=4)
+        mommy.make(FacilityRegulationStatus, facility=facility)
+        mommy.make(FacilityApproval, facility=facility)
+        update = [
+            {
+                "actual_value": "Some name",
+                "display_value": "Some name",
+                "field_name": "name",
+                "human_field_name": "name"
+            }
+        ]
+        mommy.make(
+            FacilityUpdates, facility=facility,
+            facility_updates=json.dumps(update))
+        return facility
+
+    def test_facility_listing_reads_prefetched_rows(self):
+        self._make_facility_with_related_rows()
+        with CaptureQueriesContext(connection) as one_facility:
+            self.client.get(self.url)
+
+        for _ in range(3):
+            self._make_facility_with_related_rows()
+        with CaptureQueriesContext(connection) as many_facilities:
+            response = self.client.get(self.url)
+        self.assertEquals(
+            len(one_facility.captured_queries),
+            len(many_facilities.captured_queries))
+
+        expected_data = [
+            FacilitySerializer(
+                facility, context={'request': response.request}).data
+            for facility in Facility.objects.all()
+        ]
+        self.assertEquals(
+            load_dump(expected_data, default=default),
+            load_dump(response.data['results'], default=default)
+        )
+        self.assertEquals(
+            4.0, response.data['results'][0]['average_rating'])
+
     def test_facilties_that_need_regulation_or_not(self):
         facility_1 = mommy.make(Facility)
         facility_2 = mommy.make(Facility)
@@ -1284,6 +1336,73 @@ class TestDashBoardView(LoginMixin, APITestCase):
         self.assertEquals(200, response.status_code)
         self.assertEquals(response.data, {"recently_created": 3})
 
+    def test_dashboard_only_computes_requested_fields(self):
+        mommy.make(Facility, closed=True)
+        url = self.url + "?fields=closed_facilities_count,owners_summary"
+        with patch.object(DashBoard, 'get_facility_county_summary') as mock:
+            response = self.client.get(url)
+            self.assertFalse(mock.called)
+        self.assertEquals(200, response.status_code)
+        self.assertEquals(
+            ["closed_facilities_count", "owners_summary"],
+            sorted(response.data.keys()))
+        self.assertEquals(1, response.data["closed_facilities_count"])
+
+    def test_dashboard_pending_updates(self):
+        self.user.is_national = False
+        self.user.save()
+        constituency = mommy.make(Constituency, county=self.user.county)
+        ward = mommy.make(Ward, constituency=constituency)
+        other_ward = mommy.make(Ward)
+        # the edited and the new facilities in the user's county, each
+        # counted once
+        mommy.make(
+            Facility, ward=ward, approved=True, has_edits=True)
+        mommy.make(Facility, ward=ward, has_edits=True)
+        mommy.make(Facility, ward=ward)
+        mommy.make(Facility, ward=ward, rejected=True)
+        mommy.make(Facility, ward=ward, approved=True)
+        # the facilities outside the user's county
+        mommy.make(
+            Facility, ward=other_ward, approved=True, has_edits=True)
+        mommy.make(Facility, ward=other_ward)
+
+        response = self.client.get(self.url + "?fields=pending_updates")
+        self.assertEquals(200, response.status_code)
+        self.assertEquals({"pending_updates": 3}, response.data)
+
+    def test_dashboard_facility_types_summary_order(self):
+        for name, quantity in [
+                ('Gamma', 1), ('Zeta', 2), ('Beta', 1), ('Epsilon', 1),
+                ('Alpha', 1), ('Delta', 1)]:
+            mommy.make(
+                Facility, facility_type=mommy.make(FacilityType, name=name),
+                _quantity=quantity)
+
+        response = self.client.get(self.url + "?fields=types_summary")
+        self.assertEquals(200, response.status_code)
+        # the most common types first, then by name
+        self.assertEquals(
+            [("Zeta", 2), ("Alpha", 1), ("Beta", 1), ("Delta", 1),
+             ("Epsilon", 1)],
+            [(summary["name"], summary["count"])
+             for summary in response.data["types_summary"]])
+
+    def test_dashboard_queries_do_not_grow_with_the_data(self):
+        mommy.make(Facility)
+        with CaptureQueriesContext(connection) as first_load:
+            self.client.get(self.url)
+
+        facilities = mommy.make(Facility, _quantity=5)
+        for facility in facilities[0:3]:
+            mommy.make(CommunityHealthUnit, facility=facility)
+        with CaptureQueriesContext(connection) as second_load:
+            response = self.client.get(self.url)
+        self.assertEquals(6, response.data["total_facilities"])
+        self.assertEquals(
+            len(first_load.captured_queries),
+            len(second_load.captured_queries))
+
 
 class TestFacilityContactView(LoginMixin, APITestCase):
 
@@ -1,10 +1,15 @@
 from datetime import timedelta
 
 from django.utils import timezone
-from django.db.models import Q
+from django.db.models import Case, Count, IntegerField, Q, Sum, Value, When
 
 from rest_framework.views import APIView, Response
 from common.models import County, SubCounty, Ward
+from common.utilities.scoped_cache import (
+    ScopedCacheMixin,
+    LOOKUPS_AREA,
+    get_user_areas
+)
 from chul.models import CommunityHealthUnit
 
 from ..models import (
@@ -17,217 +22,176 @@ from ..models import (
 from ..views import QuerysetFilterMixin
 
 
-class DashBoard(QuerysetFilterMixin, APIView):
-    queryset = Facility.objects.all()
+def count_where(condition):
+    """
+    Count the rows that match a condition as part of an aggregation
+    """
+    return Sum(
+        Case(
+            When(condition, then=Value(1)),
+            default=Value(0),
+            output_field=IntegerField()
+        )
+    )
 
-    def get_chu_count_in_county_summary(self, county):
-        return CommunityHealthUnit.objects.filter(
-            facility__ward__sub_county__county=county).count()
 
-    def get_chu_count_in_constituency_summary(self, const):
-        return CommunityHealthUnit.objects.filter(
-            facility__ward__sub_county=const).count()
+class DashBoard(ScopedCacheMixin, QuerysetFilterMixin, APIView):
+    queryset = Facility.objects.all()
 
-    def get_chu_count_in_ward_summary(self, ward):
-        return CommunityHealthUnit.objects.filter(
-            facility__ward=ward).count()
+    facility_count_fields = (
+        "total_facilities", "pending_updates", "recently_created",
+        "rejected_facilities_count", "closed_facilities_count"
+    )
+    chu_count_fields = (
+        "total_chus", "chus_pending_approval", "recently_created_chus"
+    )
+
+    def get_facilities(self):
+        # the scoped facilities are computed once per request
+        if not hasattr(self, '_facilities'):
+            self._facilities = self.get_queryset()
+        return self._facilities
+
+    def _count_by(self, queryset, lookup):
+        return dict(
+            queryset.order_by().values_list(lookup).annotate(
+                count=Count('id'))
+        )
 
-    def get_facility_county_summary(self):
-        counties = County.objects.all()
-        facility_county_summary = {}
-        for county in counties:
-            facility_county_count = self.get_queryset().filter(
-                ward__sub_county__county=county).count()
-            facility_county_summary[str(county.name)] = facility_county_count
+    def get_area_summary(self, areas, lookup, chu_lookup):
+        """
+        The top 20 areas by number of facilities and their CHU counts
+        """
+        counts = self._count_by(self.get_facilities(), lookup)
+        top_areas = sorted(
+            areas, key=lambda area: counts.get(area.pk, 0),
+            reverse=True)[0:20]
+        chu_counts = self._count_by(
+            CommunityHealthUnit.objects.filter(**{
+                chu_lookup + '__in': [area.pk for area in top_areas]
+            }),
+            chu_lookup)
+        return [
+            {
+                "name": area.name,
+                "count": counts.get(area.pk, 0),
+                "chu_count": chu_counts.get(area.pk, 0)
+            }
+            for area in top_areas
+        ]
 
-        top_10_counties = sorted(
-            facility_county_summary.items(),
-            key=lambda x: x[1], reverse=True)[0:20]
-        facility_county_summary
-        top_10_counties_summary = []
-        for item in top_10_counties:
-            county = County.objects.get(name=item[0])
-            chu_count = self.get_chu_count_in_county_summary(county)
-            top_10_counties_summary.append(
-                {
-                    "name": item[0],
-                    "count": item[1],
-                    "chu_count": chu_count
-                })
-        return top_10_counties_summary if self.request.user.is_national else []
+    def get_facility_county_summary(self):
+        return self.get_area_summary(
+            County.objects.all(), 'ward__sub_county__county',
+            'facility__ward__sub_county__county')
 
     def get_facility_constituency_summary(self):
-        constituencies = SubCounty.objects.filter(
-            county=self.request.user.county)
-        constituencies = constituencies if self.request.user.county else []
-
-        facility_constituency_summary = {}
-        for const in constituencies:
-            facility_const_count = self.get_queryset().filter(
-                ward__sub_county=const).count()
-            facility_constituency_summary[
-                str(const.name)] = facility_const_count
-        top_10_consts = sorted(
-            facility_constituency_summary.items(),
-            key=lambda x: x[1], reverse=True)[0:20]
-        top_10_consts_summary = []
-        for item in top_10_consts:
-            const = SubCounty.objects.get(name=item[0])
-            chu_count = self.get_chu_count_in_constituency_summary(const)
-            top_10_consts_summary.append(
-                {
-                    "name": item[0],
-                    "count": item[1],
-                    "chu_count": chu_count
-                })
-        return top_10_consts_summary
+        county = self.request.user.county
+        if not county:
+            return []
+        return self.get_area_summary(
+            SubCounty.objects.filter(county=county), 'ward__sub_county',
+            'facility__ward__sub_county')
 
     def get_facility_ward_summary(self):
-        wards = Ward.objects.filter(
-            sub_county=self.request.user.sub_county) \
-            if self.request.user.sub_county else []
-        facility_ward_summary = {}
-        for ward in wards:
-            facility_ward_count = self.get_queryset().filter(
-                ward=ward).count()
-            facility_ward_summary[
-                str(ward.name + "|" + str(ward.code))] = facility_ward_count
-        top_10_wards = sorted(
-            facility_ward_summary.items(),
-            key=lambda x: x[1], reverse=True)[0:20]
-        top_10_wards_summary = []
-        for item in top_10_wards:
-            ward = Ward.objects.get(code=item[0].split('|')[1])
-            chu_count = self.get_chu_count_in_ward_summary(ward)
-            top_10_wards_summary.append(
-                {
-                    "name": item[0].split('|')[0],
-                    "count": item[1],
-                    "chu_count": chu_count
-                })
-        return top_10_wards_summary
+        sub_county = self.request.user.sub_county
+        if not sub_county:
+            return []
+        return self.get_area_summary(
+            Ward.objects.filter(sub_county=sub_county), 'ward',
+            'facility__ward')
+
+    def get_summary(self, instances, lookup):
+        counts = self._count_by(self.get_facilities(), lookup)
+        return [
+            {
+                "name": instance.name,
+                "count": counts.get(instance.pk, 0)
+            }
+            for instance in instances
+        ]
 
     def get_facility_type_summary(self):
-        facility_types = FacilityType.objects.all()
-        facility_type_summary = []
-        for facility_type in facility_types:
-                facility_type_summary.append(
-                    {
-                        "name": str(facility_type.name),
-                        "count": self.get_queryset().filter(
-                            facility_type=facility_type).count()
-                    })
-        facility_type_summary_sorted = sorted(
-            facility_type_summary,
-            key=lambda x: x, reverse=True)[0:5]
+        """
+        The top 5 facility types by number of facilities
 
-        return facility_type_summary_sorted
+        Types with the same number of facilities are ordered by name.
+        """
+        return sorted(
+            self.get_summary(FacilityType.objects.all(), 'facility_type'),
+            key=lambda summary: (-summary["count"], summary["name"]))[0:5]
 
     def get_facility_owner_summary(self):
-        owners = Owner.objects.all()
-        facility_owners_summary = []
-        for owner in owners:
-            facility_owners_summary.append(
-                {
-                    "name": owner.name,
-                    "count": self.get_queryset().filter(
-                        owner=owner).count()
-                })
-        return facility_owners_summary
+        return self.get_summary(Owner.objects.all(), 'owner')
 
     def get_facility_status_summary(self):
-        statuses = FacilityStatus.objects.all()
-        status_summary = []
-        for status in statuses:
-                status_summary.append(
-                    {
-                        "name": status.name,
-                        "count": self.get_queryset().filter(
-                            operation_status=status).count()
-                    })
-
-        return status_summary
+        return self.get_summary(
+            FacilityStatus.objects.all(), 'operation_status')
 
     def get_facility_owner_types_summary(self):
-        owner_types = OwnerType.objects.all()
-        owner_types_summary = []
-        for owner_type in owner_types:
-            owner_types_summary.append(
-                {
-                    "name": owner_type.name,
-                    "count": self.get_queryset().filter(
-                        owner__owner_type=owner_type).count()
-                })
-        return owner_types_summary
-
-    def get_recently_created_facilities(self):
-        right_now = timezone.now()
-        last_week = self.request.query_params.get('last_week', None)
-        last_month = self.request.query_params.get('last_month', None)
-        last_three_months = self.request.query_params.get(
-            'last_three_months', None)
-        three_months_ago = right_now - timedelta(days=90)
-        if last_week:
-            weekly = right_now - timedelta(days=7)
-            return self.get_queryset().filter(
-                created__gte=weekly).count()
-
-        if last_month:
-            monthly = right_now - timedelta(days=30)
-            return self.get_queryset().filter(
-                created__gte=monthly).count()
-
-        if last_three_months:
-            return self.get_queryset().filter(
-                created__gte=three_months_ago).count()
+        return self.get_summary(
+            OwnerType.objects.all(), 'owner__owner_type')
 
-        return self.get_queryset().filter(
-            created__gte=three_months_ago).count()
+    def get_recent_period(self):
+        if self.request.query_params.get('last_week', None):
+            return timedelta(days=7)
+        if self.request.query_params.get('last_month', None):
+            return timedelta(days=30)
+        return timedelta(days=90)
 
-    def get_recently_created_chus(self):
-        right_now = timezone.now()
-        last_week = self.request.query_params.get('last_week', None)
-        last_month = self.request.query_params.get('last_month', None)
-        last_three_months = self.request.query_params.get(
-            'last_three_months', None)
-        three_months_ago = right_now - timedelta(days=90)
-        if last_week:
-            weekly = right_now - timedelta(days=7)
-            return CommunityHealthUnit.objects.filter(
-                facility__in=self.get_queryset(),
-                created__gte=weekly).count()
-
-        if last_month:
-            monthly = right_now - timedelta(days=30)
-            return CommunityHealthUnit.objects.filter(
-                facility__in=self.get_queryset(),
-                created__gte=monthly).count()
-
-        if last_three_months:
-            return CommunityHealthUnit.objects.filter(
-                facility__in=self.get_queryset(),
-                date_established__gte=three_months_ago).count()
-
-        return CommunityHealthUnit.objects.filter(
-            facility__in=self.get_queryset(),
-            date_established__gte=three_months_ago).count()
-
-    def facilities_pending_approval_count(self):
-        updated_pending_approval = self.get_queryset().filter(has_edits=True)
-        newly_created = self.queryset.filter(approved=False, rejected=False)
-        return len(
-            list(set(list(updated_pending_approval) + list(newly_created)))
-        )
-
-    def get_chus_pending_approval(self):
+    def get_facility_counts(self, fields):
         """
-        Get the number of CHUs pending approval
+        Compute the requested facility counts in a single aggregate query
         """
+        recently = timezone.now() - self.get_recent_period()
+        aggregates = {
+            "total_facilities": Count('id'),
+            # like before, the edited and the newly created facilities are
+            # both counted in the user's scope; the unfiltered
+            # `self.queryset` that used to be read for the new facilities
+            # had already been narrowed by `get_queryset`
+            "pending_updates": count_where(
+                Q(has_edits=True) | Q(approved=False, rejected=False)),
+            "recently_created": count_where(Q(created__gte=recently)),
+            "rejected_facilities_count": count_where(Q(rejected=True)),
+            "closed_facilities_count": count_where(Q(closed=True))
+        }
+        requested = {
+            field: aggregates[field] for field in self.facility_count_fields
+            if field in fields
+        }
+        if not requested:
+            return {}
+        counts = self.get_facilities().order_by().aggregate(**requested)
+        return {field: count or 0 for field, count in counts.items()}
 
-        return CommunityHealthUnit.objects.filter(
-            Q(is_approved=False, is_rejected=False) |
-            Q(has_edits=True)).distinct().filter(
-                facility__in=self.get_queryset()).count()
+    def get_chu_counts(self, fields):
+        """
+        Compute the requested CHU counts in a single aggregate query
+        """
+        recently = timezone.now() - self.get_recent_period()
+        params = self.request.query_params
+        if params.get('last_week', None) or params.get('last_month', None):
+            recent_lookup = Q(created__gte=recently)
+        else:
+            # the units established in the last three months
+            recent_lookup = Q(date_established__gte=recently)
+        aggregates = {
+            "total_chus": Count('id'),
+            "chus_pending_approval": count_where(
+                Q(is_approved=False, is_rejected=False) | Q(has_edits=True)),
+            "recently_created_chus": count_where(recent_lookup)
+        }
+        requested = {
+            field: aggregates[field] for field in self.chu_count_fields
+            if field in fields
+        }
+        if not requested:
+            return {}
+        counts = CommunityHealthUnit.objects.filter(
+            facility__in=self.get_facilities()
+        ).order_by().aggregate(**requested)
+        return {field: count or 0 for field, count in counts.items()}
 
     def get_rejected_chus(self):
         """
@@ -235,42 +199,46 @@ class DashBoard(QuerysetFilterMixin, APIView):
         """
         return CommunityHealthUnit.objects.filter(is_rejected=True).count()
 
-    def get_rejected_facilities_count(self):
-        return self.get_queryset().filter(rejected=True).count()
-
-    def get_closed_facilities_count(self):
-        return self.get_queryset().filter(closed=True).count()
-
-    def get(self, *args, **kwargs):
+    def get_dashboard_data(self, fields):
+        """
+        Compute the dashboard blocks named in `fields`
+        """
         user = self.request.user
-        data = {
-            "total_facilities": self.get_queryset().count(),
-            "county_summary": self.get_facility_county_summary()
+        summaries = {
+            "county_summary": lambda: self.get_facility_county_summary()
             if user.is_national else [],
-            "constituencies_summary": self.get_facility_constituency_summary()
-            if user.county else [],
-            "wards_summary": self.get_facility_ward_summary()
+            "constituencies_summary": self.get_facility_constituency_summary,
+            "wards_summary": lambda: self.get_facility_ward_summary()
             if user.constituency else [],
-            "owners_summary": self.get_facility_owner_summary(),
-            "types_summary": self.get_facility_type_summary(),
-            "status_summary": self.get_facility_status_summary(),
-            "owner_types": self.get_facility_owner_types_summary(),
-            "recently_created": self.get_recently_created_facilities(),
-            "recently_created_chus": self.get_recently_created_chus(),
-            "pending_updates": self.facilities_pending_approval_count(),
-            "rejected_facilities_count": self.get_rejected_facilities_count(),
-            "closed_facilities_count": self.get_closed_facilities_count(),
-            "rejected_chus": self.get_rejected_chus(),
-            "chus_pending_approval": self.get_chus_pending_approval(),
-            "total_chus": CommunityHealthUnit.objects.filter(
-                facility__in=self.get_queryset()).count()
-
+            "owners_summary": self.get_facility_owner_summary,
+            "types_summary": self.get_facility_type_summary,
+            "status_summary": self.get_facility_status_summary,
+            "owner_types": self.get_facility_owner_types_summary,
+            "rejected_chus": self.get_rejected_chus
         }
+        data = {
+            name: summary() for name, summary in summaries.items()
+            if name in fields
+        }
+        data.update(self.get_facility_counts(fields))
+        data.update(self.get_chu_counts(fields))
+        return data
+
+    def get_fields(self):
         fields = self.request.query_params.get("fields", None)
         if fields:
-            required = fields.split(",")
-            required_data = {
-                i: data[i] for i in data if i in required
-            }
-            return Response(required_data)
-        return Response(data)
+            return fields.split(",")
+        return (
+            ("county_summary", "constituencies_summary", "wards_summary",
+             "owners_summary", "types_summary", "status_summary",
+             "owner_types", "rejected_chus") +
+            self.facility_count_fields + self.chu_count_fields
+        )
+
+    def get_cache_areas(self):
+        # the summaries are also named after the lookups e.g facility types
+        return get_user_areas(self.request.user) + [LOOKUPS_AREA]
+
+    def get(self, *args, **kwargs):
+        return Response(self.get_cached_data(
+            lambda: self.get_dashboard_data(self.get_fields())))
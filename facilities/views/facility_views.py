@@ -1,7 +1,7 @@
 import json
 
 from django.utils import timezone
-from rest_framework import generics, status
+from rest_framework import generics, permissions, status
 from rest_framework.views import Response, APIView
 
 from common.views import AuditableDetailViewMixin
@@ -71,6 +71,7 @@ from ..utils import (
     _validate_contacts,
     _officer_data_is_valid
 )
+from ..query_plans import plan_facility_queryset
 
 
 class QuerysetFilterMixin(object):
@@ -324,7 +325,25 @@ class OwnerDetailView(
     serializer_class = OwnerSerializer
 
 
-class FacilityListView(QuerysetFilterMixin, generics.ListCreateAPIView):
+class FacilityQueryPlanMixin(object):
+    """
+    Fetch what the facility serializers read together with the facilities
+
+    Only applied to reads; the response to a write is serialized from the
+    saved instance and the rows prefetched before the write would be stale.
+    """
+
+    def get_queryset(self, *args, **kwargs):
+        queryset = super(FacilityQueryPlanMixin, self).get_queryset(
+            *args, **kwargs)
+        if self.request.method in permissions.SAFE_METHODS:
+            return plan_facility_queryset(queryset)
+        return queryset
+
+
+class FacilityListView(
+        FacilityQueryPlanMixin, QuerysetFilterMixin,
+        generics.ListCreateAPIView):
     """
     Lists and creates facilities
 
@@ -363,7 +382,8 @@ class FacilityListView(QuerysetFilterMixin, generics.ListCreateAPIView):
     )
 
 
-class FacilityListReadOnlyView(QuerysetFilterMixin, generics.ListAPIView):
+class FacilityListReadOnlyView(
+        FacilityQueryPlanMixin, QuerysetFilterMixin, generics.ListAPIView):
     """
     Returns a slimmed payload of the facility.
     """
@@ -384,7 +404,7 @@ class FacilityExportMaterialListView(
 
 
 class FacilityDetailView(
-        QuerysetFilterMixin, AuditableDetailViewMixin,
+        FacilityQueryPlanMixin, QuerysetFilterMixin, AuditableDetailViewMixin,
         generics.RetrieveUpdateDestroyAPIView):
     """
     Retrieves a particular facility
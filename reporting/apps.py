@@ -0,0 +1,9 @@
+from django.apps import AppConfig
+
+
+class ReportingConfig(AppConfig):
+    name = 'reporting'
+
+    def ready(self):
+        # connect the receivers that keep the rollups up to date
+        from . import rollups  # NOQA
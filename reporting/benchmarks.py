@@ -0,0 +1,324 @@
+"""
+Benchmarks of the reporting and dashboard endpoints at national scale
+
+`seed_national_dataset` fills the database with a synthetic registry the
+size of the national one and `run_benchmarks` requests every report and
+the dashboard as a national user, measuring the number of queries, the
+wall time and the growth of the process' peak memory of each request.
+
+The `benchmark_reports` command runs them against a throwaway test
+database and fails when a measurement is over its budget.
+"""
+import gc
+import itertools
+import random
+import resource
+import time
+
+from collections import OrderedDict
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.urlresolvers import reverse
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from rest_framework.test import APIClient
+from model_mommy import mommy
+
+from common.models import County, Constituency, SubCounty, Ward
+from common.models.base import get_default_system_user_id
+from facilities.models import (
+    Facility,
+    FacilityLevelChangeReason,
+    FacilityService,
+    FacilityServiceRating,
+    FacilityStatus,
+    FacilityType,
+    FacilityUpgrade,
+    KephLevel,
+    Owner,
+    OwnerType,
+    RegulatingBody,
+    Service
+)
+from chul.models import CommunityHealthUnit, Status
+
+from .report_config import REPORTS
+from .rollups import refresh_facility_rollup, refresh_chu_rollup
+
+# the size of the national registry
+NATIONAL_DATASET = {
+    "counties": 47,
+    "constituencies": 290,
+    "wards": 1450,
+    "facilities": 12000,
+    "community_health_units": 8000,
+    "services": 100,
+    "services_per_facility": 3,
+    "facility_upgrades": 1000
+}
+
+# the reports that are not configured in `REPORTS`
+EXTRA_REPORT_TYPES = (
+    "facility_constituency_report",
+    "beds_and_cots_by_county",
+    "beds_and_cots_by_constituency",
+    "beds_and_cots_by_ward"
+)
+
+DEFAULT_BUDGET = {
+    "queries": 25,
+    "seconds": 5,
+    "memory_mb": 200
+}
+
+# budgets that differ from the default, by benchmark name
+BENCHMARK_BUDGETS = {
+    "dashboard": {
+        "queries": 40
+    }
+}
+
+BULK_CREATE_BATCH_SIZE = 1000
+
+
+def _scaled(count, scale):
+    return max(1, int(count * scale))
+
+
+def _make_lookups(model, count, **kwargs):
+    return [mommy.make(model, **kwargs) for _ in range(count)]
+
+
+def seed_national_dataset(scale=1, seed=0):
+    """
+    Create a reproducible synthetic registry
+
+    The counts in `NATIONAL_DATASET` are multiplied by `scale`. The bulk
+    of the rows are inserted with `bulk_create`, hence the side effects of
+    their `save` methods e.g the rollups are applied at the end.
+    """
+    rand = random.Random(seed)
+    sizes = {
+        name: _scaled(count, scale) if name != "services_per_facility"
+        else count for name, count in NATIONAL_DATASET.items()
+    }
+    user_id = get_default_system_user_id()
+    audit = {"created_by_id": user_id, "updated_by_id": user_id}
+    codes = itertools.count(100000)
+    now = timezone.now()
+
+    def bulk_create(model, instances):
+        model.objects.bulk_create(instances, batch_size=BULK_CREATE_BATCH_SIZE)
+        return instances
+
+    counties = bulk_create(County, [
+        County(name="County {}".format(i), code=next(codes), **audit)
+        for i in range(sizes["counties"])
+    ])
+    constituencies = bulk_create(Constituency, [
+        Constituency(
+            name="Constituency {}".format(i), code=next(codes),
+            county=counties[i % len(counties)], **audit)
+        for i in range(sizes["constituencies"])
+    ])
+    sub_counties = bulk_create(SubCounty, [
+        SubCounty(
+            name="Sub County {}".format(i), code=next(codes),
+            county=constituency.county, **audit)
+        for i, constituency in enumerate(constituencies)
+    ])
+    wards = bulk_create(Ward, [
+        Ward(
+            name="Ward {}".format(i), code=next(codes),
+            constituency=constituencies[i % len(constituencies)],
+            sub_county=sub_counties[i % len(sub_counties)], **audit)
+        for i in range(sizes["wards"])
+    ])
+
+    owners = [
+        mommy.make(Owner, owner_type=owner_type)
+        for owner_type in _make_lookups(OwnerType, 4) for _ in range(3)
+    ]
+    facility_types = _make_lookups(FacilityType, 12)
+    keph_levels = _make_lookups(KephLevel, 6)
+    operation_statuses = _make_lookups(FacilityStatus, 4)
+    regulating_bodies = _make_lookups(RegulatingBody, 3)
+    services = _make_lookups(Service, sizes["services"])
+    reasons = _make_lookups(FacilityLevelChangeReason, 3)
+    chu_statuses = _make_lookups(Status, 4)
+
+    facilities = []
+    for i in range(sizes["facilities"]):
+        ward = rand.choice(wards)
+        created = now - timedelta(days=rand.randint(0, 1000))
+        facilities.append(Facility(
+            name="Facility {}".format(i), code=next(codes), ward=ward,
+            sub_county=ward.sub_county,
+            facility_type=rand.choice(facility_types),
+            keph_level=rand.choice(keph_levels),
+            operation_status=rand.choice(operation_statuses),
+            owner=rand.choice(owners),
+            regulatory_body=rand.choice(regulating_bodies),
+            number_of_beds=rand.randint(0, 100),
+            number_of_cots=rand.randint(0, 20),
+            approved=rand.random() < 0.9,
+            rejected=rand.random() < 0.02,
+            closed=rand.random() < 0.05,
+            is_published=rand.random() < 0.8,
+            has_edits=rand.random() < 0.05,
+            created=created, updated=created, **audit))
+    bulk_create(Facility, facilities)
+
+    facility_services = [
+        FacilityService(facility=facility, service=service, **audit)
+        for facility in facilities
+        for service in rand.sample(services, min(
+            sizes["services_per_facility"], len(services)))
+    ]
+    ratings = [
+        FacilityServiceRating(
+            facility_service=facility_service,
+            rating=rand.randint(1, 5), **audit)
+        for facility_service in facility_services
+        if rand.random() < 0.5
+    ]
+    # `bulk_create` does not keep the rating counters of the services
+    for rating in ratings:
+        rating.facility_service.rating_sum = rating.rating
+        rating.facility_service.rating_count = 1
+    bulk_create(FacilityService, facility_services)
+    bulk_create(FacilityServiceRating, ratings)
+
+    units = []
+    for i in range(sizes["community_health_units"]):
+        created = now - timedelta(days=rand.randint(0, 1000))
+        units.append(CommunityHealthUnit(
+            name="Community Health Unit {}".format(i), code=next(codes),
+            facility=rand.choice(facilities),
+            status=rand.choice(chu_statuses),
+            is_approved=rand.random() < 0.9,
+            is_rejected=rand.random() < 0.02,
+            is_closed=rand.random() < 0.05,
+            date_established=created.date(),
+            created=created, updated=created, **audit))
+    bulk_create(CommunityHealthUnit, units)
+
+    bulk_create(FacilityUpgrade, [
+        FacilityUpgrade(
+            facility=facility,
+            facility_type=rand.choice(facility_types),
+            keph_level=rand.choice(keph_levels),
+            reason=rand.choice(reasons),
+            is_upgrade=rand.random() < 0.7,
+            is_confirmed=True,
+            current_facility_type_name=facility.facility_type.name,
+            current_keph_level_name=facility.keph_level.name, **audit)
+        for facility in rand.sample(facilities, min(
+            sizes["facility_upgrades"], len(facilities)))
+    ])
+
+    refresh_facility_rollup()
+    refresh_chu_rollup()
+    return sizes
+
+
+def get_benchmark_urls():
+    """
+    Returns the name and url of every benchmarked request
+    """
+    reports_url = reverse("api:reporting:reports")
+    chul_url = reverse("api:reporting:chul_reports")
+    upgrades_url = reverse("api:reporting:upgrade_downgrade_report")
+
+    urls = OrderedDict(
+        ("reports:{}".format(report_type),
+         "{}?report_type={}".format(reports_url, report_type))
+        for report_type in sorted(REPORTS) + list(EXTRA_REPORT_TYPES)
+    )
+    urls["chul_reports:county"] = chul_url
+    for report_type in ("constituency", "ward", "status"):
+        urls["chul_reports:{}".format(report_type)] = (
+            "{}?report_type={}".format(chul_url, report_type))
+    urls["chul_reports:last_quarter"] = chul_url + "?last_quarter=true"
+    urls["upgrades_downgrades:county_summary"] = upgrades_url
+    county = County.objects.order_by('code').first()
+    if county:
+        urls["upgrades_downgrades:county"] = "{}?county={}".format(
+            upgrades_url, county.id)
+    urls["dashboard"] = reverse("api:facilities:dashboard")
+    return urls
+
+
+def _get_peak_memory_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def measure_request(client, url):
+    """
+    Measure an uncached request
+
+    The memory is the growth of the process' peak memory; it is zero
+    when the request needs less memory than an earlier one did.
+    """
+    cache.clear()
+    gc.collect()
+    peak_memory = _get_peak_memory_mb()
+    with CaptureQueriesContext(connection) as queries:
+        start = time.time()
+        response = client.get(url)
+        seconds = time.time() - start
+    return {
+        "status_code": response.status_code,
+        "queries": len(queries.captured_queries),
+        "seconds": seconds,
+        "memory_mb": _get_peak_memory_mb() - peak_memory
+    }
+
+
+def run_benchmarks(user=None):
+    """
+    Request every benchmarked url as a national user
+    """
+    if user is None:
+        user = get_user_model().objects.filter(
+            email='benchmarks@ehealth.or.ke').first() or \
+            get_user_model().objects.create_superuser(
+                email='benchmarks@ehealth.or.ke',
+                first_name='Benchmarks',
+                employee_number='benchmarks',
+                password='benchmarks',
+                is_national=True)
+    client = APIClient()
+    client.force_authenticate(user=user)
+    return OrderedDict(
+        (name, measure_request(client, url))
+        for name, url in get_benchmark_urls().items()
+    )
+
+
+def get_budget(name):
+    budget = dict(DEFAULT_BUDGET)
+    budget.update(BENCHMARK_BUDGETS.get(name, {}))
+    return budget
+
+
+def check_budgets(results):
+    """
+    Returns a description of every failed request and exceeded budget
+    """
+    failures = []
+    for name, result in results.items():
+        if result["status_code"] != 200:
+            failures.append("{} responded with {}".format(
+                name, result["status_code"]))
+        for measure, limit in sorted(get_budget(name).items()):
+            if result[measure] > limit:
+                failures.append(
+                    "{} {} is {:.2f}, over the budget of {}".format(
+                        name, measure, result[measure], limit))
+    return failures
@@ -0,0 +1,58 @@
+"""Cross-tabulation ( pivot ) of record counts"""
+import itertools
+
+from collections import OrderedDict
+
+from django.apps import apps
+
+
+def get_dimension_instances(dimension):
+    app_label, model_name = dimension.get("path").split('.')
+    return apps.get_model(app_label, model_name).objects.all()
+
+
+def cross_tab(dimensions, counts, count_name="number_of_facilities"):
+    """
+    Lay out grouped counts over every combination of the dimensions
+
+    Each dimension is a dict with:
+        name: the key under which an instance's name is returned
+        path: the `app_label.ModelName` whose instances make up the dimension
+        field_name: the lookup to that model the counts were grouped by
+
+    `counts` maps the tuple of each combination's primary keys, in the
+    order of the dimensions, to its count e.g as returned by
+    `reporting.rollups.count_facilities`. Every combination of the
+    dimensions' instances is returned, with a zero count where no records
+    exist, together with the totals of each instance of every dimension and
+    the grand total e.g for a county x facility type cross-tab:
+
+        {
+            "county": {"Nairobi": 12, ...},
+            "facility_type": {"Dispensary": 8, ...},
+            "number_of_facilities": 120
+        }
+    """
+    dimension_instances = [
+        list(get_dimension_instances(dimension)) for dimension in dimensions
+    ]
+    totals = OrderedDict(
+        (dimension.get("name"), OrderedDict(
+            (instance.name, 0) for instance in instances))
+        for dimension, instances in zip(dimensions, dimension_instances)
+    )
+
+    data = []
+    grand_total = 0
+    for combination in itertools.product(*dimension_instances):
+        count = counts.get(tuple(instance.pk for instance in combination), 0)
+        cell = OrderedDict()
+        for dimension, instance in zip(dimensions, combination):
+            cell[dimension.get("name")] = instance.name
+            totals[dimension.get("name")][instance.name] += count
+        cell[count_name] = count
+        data.append(cell)
+        grand_total += count
+
+    totals[count_name] = grand_total
+    return data, totals
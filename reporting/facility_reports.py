@@ -3,26 +3,27 @@ import functools
 from datetime import timedelta
 
 from django.apps import apps
-from django.db.models import Sum
+from django.db.models import Count
 from django.utils import timezone
 
 from rest_framework.views import APIView, Response
 from rest_framework.exceptions import NotFound
 
-from facilities.models import (
-    Facility,
-    FacilityType,
-    KephLevel,
-    FacilityUpgrade)
+from facilities.models import FacilityUpgrade
 from common.constants import TRUTH_NESS, FALSE_NESS
 from common.models import County, Constituency, Ward
-from chul.models import CommunityHealthUnit, Status
-
+from common.utilities.scoped_cache import (
+    ScopedCacheMixin, NATIONAL_AREA, LOOKUPS_AREA)
+from chul.models import Status
+
+from .cross_tab import cross_tab
+from .rollups import (
+    count_facilities, count_community_health_units,
+    get_facility_rollup_totals)
 from .report_config import REPORTS
 
 
 class FilterReportMixin(object):
-    queryset = Facility.objects.all()
 
     def _prepare_filters(self, filtering_data):
         filtering_data = filtering_data.split('=')
@@ -33,9 +34,6 @@ class FilterReportMixin(object):
             filter_field_name: value
         }
 
-    def _filter_queryset(self, filter_dict):
-        return self.queryset.filter(**filter_dict)
-
     def _filter_relation_obj(self, model, field_name, value):
         filter_dict = {
             field_name: value
@@ -53,7 +51,7 @@ class FilterReportMixin(object):
         filtering_dict = self._build_dict_filter(
             requested_filters_filter_field_name, more_filters[1])
 
-        self.queryset = self._filter_queryset(filtering_dict)
+        self.report_filters.update(filtering_dict)
         model_instances = self._filter_relation_obj(
             model, more_filters[0], more_filters[1])
         return model_instances
@@ -61,47 +59,65 @@ class FilterReportMixin(object):
     def _get_return_data(
             self, filter_field_name, model_instances, return_instance_name,
             return_count_name):
-        data = []
+        """
+        Count the facilities for every instance in a single grouped query
 
-        for instance in model_instances:
-            filiter_data = {
-                filter_field_name: instance
+        Instances that have no facilities are reported with a zero count.
+        """
+        counts = count_facilities([filter_field_name], self.report_filters)
+        return [
+            {
+                return_instance_name: instance.name,
+                return_count_name: counts.get((instance.pk, ), 0)
             }
-            count = self.queryset.filter(**filiter_data).count()
-            instance_name = instance.name
-            data.append(
-                {
-                    return_instance_name: instance_name,
-                    return_count_name: count
-                }
-            )
-        return data
+            for instance in model_instances
+        ]
+
+    def _get_grouped_return_data(
+            self, group_by, filter_field_name, model_instances,
+            return_instance_name, return_count_name):
+        """
+        Count the facilities for every group and instance pair in a single
+        grouped query
+        """
+        app_label, model_name = group_by.get("path").split('.')
+        group_model = apps.get_model(app_label, model_name)
+        counts = count_facilities(
+            [group_by.get("field_name"), filter_field_name],
+            self.report_filters)
+        model_instances = list(model_instances)
+        return [
+            {
+                group_by.get("name"): group.name,
+                return_instance_name: instance.name,
+                return_count_name: counts.get((group.pk, instance.pk), 0)
+            }
+            for group in group_model.objects.all()
+            for instance in model_instances
+        ]
 
     def get_report_data(self, *args, **kwargs):
+        self.report_filters = {}
         report_type = self.request.query_params.get(
             "report_type", "facility_count_by_county")
-        if report_type == "facility_count_by_facility_type_detailed":
-            return self._get_facility_type_data()
-        if report_type == "facility_keph_level_report":
-            return self._get_facility_keph_level_data()
         if report_type == "facility_constituency_report":
             return self._get_facility_constituency_data()
 
         if report_type == "beds_and_cots_by_county":
             return self._get_beds_and_cots({
-                'ward__constituency__county__name': 'county_name',
-                'ward__constituency__county': 'county'
+                'county__name': 'county_name',
+                'county': 'county'
             })
 
         if report_type == "beds_and_cots_by_constituency":
             county_id = self.request.query_params.get("county", None)
             filters = (
                 {} if county_id is None
-                else {"ward__constituency__county": county_id}
+                else {"county": county_id}
             )
             return self._get_beds_and_cots(vals={
-                'ward__constituency__name': 'constituency_name',
-                'ward__constituency': 'constituency'
+                'constituency__name': 'constituency_name',
+                'constituency': 'constituency'
             }, filters=filters)
 
         if report_type == "beds_and_cots_by_ward":
@@ -110,7 +126,7 @@ class FilterReportMixin(object):
             )
             filters = (
                 {} if constituency_id is None
-                else {"ward__constituency": constituency_id}
+                else {"constituency": constituency_id}
             )
             return self._get_beds_and_cots(
                 vals={'ward__name': 'ward_name', 'ward': "ward"},
@@ -122,6 +138,8 @@ class FilterReportMixin(object):
         report_config = REPORTS.get(report_type, None)
         if report_config is None:
             raise NotFound(detail="Report not found.")
+        if report_config.get("type") == "cross_tab":
+            return self._get_cross_tab_data(report_config)
 
         group_by = report_config.get("group_by")
         app_label, model_name = report_config.get(
@@ -140,99 +158,56 @@ class FilterReportMixin(object):
         return_count_name = report_config.get(
             "filter_fields").get("return_field")[1]
         if group_by:
-            pass
+            data = self._get_grouped_return_data(
+                group_by, filter_field_name, model_instances,
+                return_instance_name, return_count_name)
         else:
             data = self._get_return_data(
                 filter_field_name, model_instances, return_instance_name,
                 return_count_name)
-        return data, self.queryset.count()
-
-    def _get_facility_type_data(self):
-        owner_category = self.request.query_params.get("owner_category")
-        facility_type = self.request.query_params.get("facility_type")
-
-        data = []
-
-        for county in County.objects.all():
-            for facility_type in FacilityType.objects.all():
-                if not owner_category:
-                    count = Facility.objects.filter(
-                        facility_type=facility_type,
-                        ward__constituency__county=county).count()
-                else:
-                    count = Facility.objects.filter(
-                        facility_type=facility_type,
-                        ward__constituency__county=county,
-                        owner__owner_type=owner_category).count()
-
-                data.append(
-                    {
-                        "county": county.name,
-                        "facility_type": facility_type.name,
-                        "number_of_facilities": count
-                    }
-                )
-
-        totals = []
-
-        return data, totals
-
-    def _get_facility_keph_level_data(self):
-        owner_category = self.request.query_params.get("owner_category")
-
-        data = []
-
-        for county in County.objects.all():
-            for level in KephLevel.objects.all():
-                if not owner_category:
-                    count = Facility.objects.filter(
-                        keph_level=level,
-                        ward__constituency__county=county).count()
-                else:
-                    count = Facility.objects.filter(
-                        level=level,
-                        ward__constituency__county=county,
-                        owner__owner_type=owner_category).count()
-
-                data.append({
-                    "county": county.name,
-                    "keph_level": level.name,
-                    "number_of_facilities": count
-                })
-
-        totals = []
-        return data, totals
+        return data, count_facilities(filters=self.report_filters)[()]
+
+    def _get_cross_tab_data(self, report_config):
+        for param, field_name in report_config.get(
+                "query_filters", {}).items():
+            value = self.request.query_params.get(param)
+            if value:
+                self.report_filters[field_name] = value
+        dimensions = report_config.get("dimensions")
+        counts = count_facilities(
+            [dimension.get("field_name") for dimension in dimensions],
+            self.report_filters)
+        return cross_tab(
+            dimensions, counts,
+            report_config.get("count_name", "number_of_facilities"))
 
     def _get_facility_constituency_data(self):
         owner_category = self.request.query_params.get("owner_category")
+        if owner_category:
+            self.report_filters["owner__owner_type"] = owner_category
+        counts = count_facilities(
+            ['ward__constituency'], self.report_filters)
 
-        data = []
+        constituencies = {}
+        for const in Constituency.objects.all():
+            constituencies.setdefault(const.county_id, []).append(const)
 
+        data = []
         for county in County.objects.all():
-            for const in Constituency.objects.filter(county=county):
-                if not owner_category:
-                    count = Facility.objects.filter(
-                        ward__constituency=const).count()
-                else:
-                    count = Facility.objects.filter(
-                        ward__constituency=const,
-                        owner__owner_type=owner_category).count()
-
+            for const in constituencies.get(county.id, []):
                 data.append({
                     "county": county.name,
                     "constituency": const.name,
-                    "number_of_facilities": count
+                    "number_of_facilities": counts.get((const.id, ), 0)
                 })
 
-            totals = []
+        totals = []
         return data, totals
 
     def _get_beds_and_cots(self, vals={}, filters={}):
         fields = vals.keys()
         assert len(fields) == 2
-        items = Facility.objects.values(*fields).filter(**filters).annotate(
-            cots=Sum('number_of_cots'), beds=Sum('number_of_beds')
-        ).order_by()
+        items = get_facility_rollup_totals(fields, filters)
 
         total_cots, total_beds = functools.reduce(
             lambda x, y: (x[0] + y['cots'], x[1] + y['beds']),
@@ -249,10 +224,23 @@ class FilterReportMixin(object):
         ], {"total_cots": total_cots, "total_beds": total_beds}
 
 
-class ReportView(FilterReportMixin, APIView):
+class ReportView(ScopedCacheMixin, FilterReportMixin, APIView):
+    """
+    Facility counts, beds and cots by the `report_type` in `REPORTS`
+
+    The reports are cached until a facility or a lookup e.g a county or
+    facility type is saved.
+    """
+
+    def get_cache_areas(self):
+        return [NATIONAL_AREA, LOOKUPS_AREA]
+
+    def get_cache_scope(self):
+        # the reports are the same for every user
+        return []
 
     def get(self, *args, **kwargs):
-        data, totals = self.get_report_data()
+        data, totals = self.get_cached_data(self.get_report_data)
 
         return Response(data={
             "results": data,
@@ -262,8 +250,7 @@ class ReportView(FilterReportMixin, APIView):
 
 class FacilityUpgradeDowngrade(APIView):
 
-    def get(self, *args, **kwargs):
-        county = self.request.query_params.get('county', None)
+    def get_changes(self):
         upgrade = self.request.query_params.get('upgrade', None)
 
         right_now = timezone.now()
@@ -290,239 +277,175 @@ class FacilityUpgradeDowngrade(APIView):
             all_changes = all_changes.filter(created__gte=last_one_month)
         if last_three_months:
             all_changes = all_changes.filter(created__gte=three_months_ago)
+        return all_changes
+
+    def get_county_summary(self, all_changes):
+        """
+        The number of changed facilities in each county
+
+        Deleted facilities are not counted, but their changes are part of
+        the total number of changes.
+        """
+        counts = dict(
+            all_changes.filter(facility__deleted=False).order_by().values_list(
+                'facility__ward__constituency__county').annotate(
+                changes=Count('facility', distinct=True))
+        )
+        results = [
+            {
+                "county": county.name,
+                "county_id": county.id,
+                "changes": counts.get(county.pk, 0)
+            }
+            for county in County.objects.all()
+        ]
+        return Response(data={
+            "total_number_of_changes": all_changes.count(),
+            "results": results
+        })
 
-        facilities_ids = [change.facility.id for change in all_changes]
-        changed_facilities = Facility.objects.filter(id__in=facilities_ids)
-        if not county:
-            results = []
-            for county in County.objects.all():
-                facility_count = changed_facilities.filter(
-                    ward__constituency__county=county).count()
-                data = {
-                    "county": county.name,
-                    "county_id": county.id,
-                    "changes": facility_count
-                }
-                results.append(data)
-            return Response(data={
-                "total_number_of_changes": len(facilities_ids),
-                "results": results
-            })
-        else:
+    def get_county_changes(self, all_changes, county):
+        """
+        The latest change of each changed facility in the county
+
+        The latest changes are picked in a single `DISTINCT ON` query.
+        """
+        latest_changes = FacilityUpgrade.objects.filter(
+            facility__in=all_changes.values('facility'),
+            facility__ward__constituency__county_id=county,
+            facility__deleted=False
+        ).select_related(
+            'facility', 'keph_level', 'facility_type', 'reason'
+        ).order_by(
+            'facility', '-updated', '-created'
+        ).distinct('facility')
+        # list the facilities most recently updated first as before
+        latest_changes = sorted(
+            latest_changes,
+            key=lambda change: (
+                change.facility.updated, change.facility.created),
+            reverse=True)
+        records = [
+            {
+                "name": change.facility.name,
+                "code": change.facility.code,
+                "current_keph_level":
+                    change.keph_level.name if change.keph_level else None,
+                "previous_keph_level": change.current_keph_level_name,
+                "previous_facility_type": change.current_facility_type_name,
+                "current_facility_type": change.facility_type.name,
+                "reason": change.reason.reason
+            }
+            for change in latest_changes
+        ]
+        return Response(data={
+            "total_facilities_changed": len(records),
+            "results": records
+        })
 
-            facilities = changed_facilities.filter(
-                ward__constituency__county_id=county)
-            records = []
-            for facility in facilities:
-                latest_facility_change = FacilityUpgrade.objects.filter(
-                    facility=facility)[0]
-                data = {
-                    "name": facility.name,
-                    "code": facility.code,
-                    "current_keph_level":
-                        latest_facility_change.keph_level.name,
-                    "previous_keph_level":
-                        latest_facility_change.current_keph_level_name,
-                    "previous_facility_type":
-                        latest_facility_change.current_facility_type_name,
-                    "current_facility_type":
-                        latest_facility_change.facility_type.name,
-                    "reason": latest_facility_change.reason.reason
-                }
-                records.append(data)
-
-            return Response(data={
-                "total_facilities_changed": len(facilities),
-                "results": records
-            })
+    def get(self, *args, **kwargs):
+        county = self.request.query_params.get('county', None)
+        all_changes = self.get_changes()
+        if not county:
+            return self.get_county_summary(all_changes)
+        return self.get_county_changes(all_changes, county)
 
 
 class CommunityHealthUnitReport(APIView):
-    queryset = CommunityHealthUnit.objects.all()
+    """
+    Counts of community health units by county, constituency, ward or status
 
-    def get_county_reports(self, queryset=queryset):
-        data = []
-        counties = County.objects.all()
-        total_chus = 0
-        for county in counties:
-            chu_count = queryset.filter(
-                facility__ward__constituency__county=county).count()
-            total_chus += chu_count
-            data.append(
-                {
-                    "county_name": county.name,
-                    "county_id": county.id,
-                    "number_of_units": chu_count
-                }
-            )
-        return data, total_chus
+    Every report is a single grouped count; areas and statuses without
+    units are reported with a zero count.
+    """
+
+    def get_report_filters(
+            self, county=None, constituency=None, last_quarter=False):
+        filters = {}
+        if county:
+            filters["facility__ward__constituency__county"] = county
+        if constituency:
+            filters["facility__ward__constituency"] = constituency
+        if last_quarter:
+            filters["created__gte"] = timezone.now() - timedelta(days=90)
+        return filters
 
-    def get_constituency_reports(self, county=None, queryset=queryset):
+    def _get_report(self, instances, lookup, name_key, id_key, filters):
+        counts = count_community_health_units([lookup], filters)
         data = []
+        for instance in instances:
+            item = {name_key: instance.name}
+            if id_key:
+                item[id_key] = instance.id
+            item["number_of_units"] = counts.get((instance.pk, ), 0)
+            data.append(item)
+        return data, sum(item["number_of_units"] for item in data)
+
+    def get_county_reports(self, filters=None):
+        return self._get_report(
+            County.objects.all(), "facility__ward__constituency__county",
+            "county_name", "county_id", filters)
+
+    def get_constituency_reports(self, county=None, filters=None):
         constituencies = Constituency.objects.all()
-
         if county:
             constituencies = constituencies.filter(county_id=county)
-        total_chus = 0
-        for const in constituencies:
-            chu_count = queryset.filter(
-                facility__ward__constituency=const).count()
-            total_chus += chu_count
-            data.append(
-                {
-                    "constituency_name": const.name,
-                    "constituency_id": const.id,
-                    "number_of_units": chu_count
-                }
-            )
-        return data, total_chus
+        return self._get_report(
+            constituencies, "facility__ward__constituency",
+            "constituency_name", "constituency_id", filters)
 
-    def get_ward_reports(self, constituency=None, queryset=queryset):
-        data = []
+    def get_ward_reports(self, constituency=None, filters=None):
         wards = Ward.objects.all()
         if constituency:
             wards = wards.filter(constituency_id=constituency)
-        total_chus = 0
-        for ward in wards:
-            chu_count = queryset.filter(
-                facility__ward=ward).count()
-            total_chus += chu_count
-            data.append(
-                {
-                    "ward_name": ward.name,
-                    "ward_id": ward.id,
-                    "number_of_units": chu_count
-                }
-            )
-        return data, total_chus
+        return self._get_report(
+            wards, "facility__ward", "ward_name", "ward_id", filters)
 
-    def get_date_established_report(
-            self, county=None, constituency=None):
-        now = timezone.now()
-        three_months_ago = now - timedelta(days=90)
-        queryset = self.queryset.filter(created__gte=three_months_ago)
+    def get_status_report(self, filters=None):
+        return self._get_report(
+            Status.objects.all(), "status", "status_name", None, filters)
 
-        if county:
+    def get_report_data(self):
+        params = self.request.query_params
+        county = params.get('county', None)
+        constituency = params.get('constituency', None)
+        report_type = params.get('report_type', None)
+        last_quarter = params.get('last_quarter', None)
+
+        if report_type == 'constituency':
             return self.get_constituency_reports(
-                county=county, queryset=queryset)
-        elif constituency:
-            return self.get_ward_reports(
-                constituency=constituency, queryset=queryset)
-        else:
-            return self.get_county_reports(queryset=queryset)
+                county=county,
+                filters=self.get_report_filters(county=county))
 
-    def get_status_report(self, constituency=None, county=None):
-        data = []
-        if county:
-            self.queryset = self.queryset.filter(
-                facility__ward__constituency__county_id=county)
-        if constituency:
-            self.queryset = self.queryset.filter(
-                facility__ward__constituency_id=constituency)
-        total_chus = 0
-        for status in Status.objects.all():
-            chu_count = self.queryset.filter(
-                status=status).count()
-            total_chus += chu_count
-            data.append(
-                {
-                    "status_name": status.name,
-                    "number_of_units": chu_count
-                }
-            )
-        return data, self.queryset.count()
+        if report_type == 'ward':
+            return self.get_ward_reports(
+                constituency=constituency,
+                filters=self.get_report_filters(constituency=constituency))
+
+        if last_quarter:
+            if constituency:
+                return self.get_ward_reports(
+                    constituency=constituency,
+                    filters=self.get_report_filters(
+                        constituency=constituency, last_quarter=True))
+            if county:
+                return self.get_constituency_reports(
+                    county=county,
+                    filters=self.get_report_filters(
+                        county=county, last_quarter=True))
+            return self.get_county_reports(
+                filters=self.get_report_filters(last_quarter=True))
+
+        if report_type == 'status':
+            return self.get_status_report(
+                filters=self.get_report_filters(
+                    county=county, constituency=constituency))
+
+        return self.get_county_reports()
 
     def get(self, *args, **kwargs):
-        county = self.request.query_params.get('county', None)
-        constituency = self.request.query_params.get('constituency', None)
-        report_type = self.request.query_params.get('report_type', None)
-        last_quarter = self.request.query_params.get('last_quarter', None)
-
-        if report_type == 'constituency' and county:
-            report_data = self.get_constituency_reports(county=county)
-
-            data = {
-                "total": report_data[1],
-                "results": report_data[0]
-            }
-            return Response(data)
-
-        if report_type == 'constituency' and not county:
-            report_data = self.get_constituency_reports()
-            data = {
-                "total": report_data[1],
-                "results": report_data[0]
-            }
-            return Response(data)
-
-        if report_type == 'ward' and not constituency:
-            report_data = self.get_ward_reports()
-            data = {
-                "total": report_data[1],
-                "results": report_data[0]
-            }
-            return Response(data)
-
-        if report_type == 'ward' and constituency:
-            report_data = self.get_ward_reports(constituency=constituency)
-            data = {
-                "total": report_data[1],
-                "results": report_data[0]
-            }
-            return Response(data)
-
-        if last_quarter and county and not constituency:
-            report_data = self.get_date_established_report(county=county)
-            data = {
-                "total": report_data[1],
-                "results": report_data[0]
-            }
-            return Response(data)
-
-        if last_quarter and constituency:
-            report_data = self.get_date_established_report(
-                constituency=constituency)
-            data = {
-                "total": report_data[1],
-                "results": report_data[0]
-            }
-            return Response(data)
-
-        if last_quarter and not county and not constituency:
-            report_data = self.get_date_established_report()
-            data = {
-                "total": report_data[1],
-                "results": report_data[0]
-            }
-            return Response(data)
-
-        if report_type == 'status' and not county and not constituency:
-            report_data = self.get_status_report()
-            data = {
-                "total": report_data[1],
-                "results": report_data[0]
-            }
-            return Response(data)
-
-        if report_type == 'status' and county and not constituency:
-            report_data = self.get_status_report(county=county)
-            data = {
-                "total": report_data[1],
-                "results": report_data[0]
-            }
-            return Response(data)
-
-        if report_type == 'status' and not county and constituency:
-
-            report_data = self.get_status_report(constituency=constituency)
-            data = {
-                "total": report_data[1],
-                "results": report_data[0]
-            }
-            return Response(data)
-
-        data = {
-            "total": self.get_county_reports()[1],
-            "results": self.get_county_reports()[0]
-        }
-        return Response(data)
+        results, total = self.get_report_data()
+        return Response({
+            "total": total,
+            "results": results
+        })
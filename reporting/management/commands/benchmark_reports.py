@@ -0,0 +1,61 @@
+"""
+Benchmarks the reports and the dashboard against a national scale dataset
+
+The dataset is seeded into a throwaway test database, like the one the
+test suite uses, so the command never touches the configured database.
+The command fails when a request fails or is over its budget.
+"""
+from django.conf import settings
+from django.core.management import BaseCommand, CommandError
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+from reporting.benchmarks import (
+    seed_national_dataset, run_benchmarks, check_budgets, get_budget)
+
+BENCHMARK_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+
+class Command(BaseCommand):
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--scale',
+            type=float,
+            dest='scale',
+            default=1.0,
+            help='Multiply the size of the national dataset e.g 0.1')
+
+    def handle(self, *args, **options):
+        runner = DiscoverRunner(verbosity=0, interactive=False)
+        runner.setup_test_environment()
+        old_config = runner.setup_databases()
+        try:
+            # saves should neither hit the shared cache nor the search index
+            with override_settings(
+                    CACHES=BENCHMARK_CACHES,
+                    SEARCH=dict(settings.SEARCH, REALTIME_INDEX=False)):
+                sizes = seed_national_dataset(scale=options.get('scale'))
+                self.stdout.write("Seeded {}".format(", ".join(
+                    "{} {}".format(count, name)
+                    for name, count in sorted(sizes.items()))))
+                results = run_benchmarks()
+        finally:
+            runner.teardown_databases(old_config)
+            runner.teardown_test_environment()
+
+        for name, result in results.items():
+            budget = get_budget(name)
+            self.stdout.write(
+                "{:<55} {:>4} queries (max {}) {:>7.3f}s (max {}) "
+                "{:>7.1f}MB (max {})".format(
+                    name, result["queries"], budget["queries"],
+                    result["seconds"], budget["seconds"],
+                    result["memory_mb"], budget["memory_mb"]))
+
+        failures = check_budgets(results)
+        if failures:
+            raise CommandError("\n".join(failures))
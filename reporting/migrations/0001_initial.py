@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('common', '0006_usersubcounty'),
+        ('facilities', 'incremental_excel_export'),
+        ('chul', '0001_auto_20160318_0338'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CommunityHealthUnitRollup',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('has_edits', models.BooleanField(default=False)),
+                ('is_approved', models.BooleanField(default=False)),
+                ('is_rejected', models.BooleanField(default=False)),
+                ('is_closed', models.BooleanField(default=False)),
+                ('number_of_units', models.PositiveIntegerField(default=0)),
+                ('constituency', models.ForeignKey(related_name='+', blank=True, to='common.Constituency', null=True)),
+                ('county', models.ForeignKey(related_name='+', blank=True, to='common.County', null=True)),
+                ('status', models.ForeignKey(related_name='+', blank=True, to='chul.Status', null=True)),
+                ('sub_county', models.ForeignKey(related_name='+', blank=True, to='common.SubCounty', null=True)),
+                ('ward', models.ForeignKey(related_name='+', blank=True, to='common.Ward', null=True)),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='FacilityRollup',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('has_edits', models.BooleanField(default=False)),
+                ('approved', models.BooleanField(default=False)),
+                ('rejected', models.BooleanField(default=False)),
+                ('closed', models.BooleanField(default=False)),
+                ('is_published', models.BooleanField(default=False)),
+                ('number_of_facilities', models.PositiveIntegerField(default=0)),
+                ('number_of_beds', models.PositiveIntegerField(default=0)),
+                ('number_of_cots', models.PositiveIntegerField(default=0)),
+                ('constituency', models.ForeignKey(related_name='+', blank=True, to='common.Constituency', null=True)),
+                ('county', models.ForeignKey(related_name='+', blank=True, to='common.County', null=True)),
+                ('facility_type', models.ForeignKey(related_name='+', blank=True, to='facilities.FacilityType', null=True)),
+                ('keph_level', models.ForeignKey(related_name='+', blank=True, to='facilities.KephLevel', null=True)),
+                ('operation_status', models.ForeignKey(related_name='+', blank=True, to='facilities.FacilityStatus', null=True)),
+                ('owner', models.ForeignKey(related_name='+', blank=True, to='facilities.Owner', null=True)),
+                ('owner_type', models.ForeignKey(related_name='+', blank=True, to='facilities.OwnerType', null=True)),
+                ('sub_county', models.ForeignKey(related_name='+', blank=True, to='common.SubCounty', null=True)),
+                ('ward', models.ForeignKey(related_name='+', blank=True, to='common.Ward', null=True)),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+    ]
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import common.models.base
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('reporting', 'populate_rollups'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReportJob',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, serialize=False, editable=False, primary_key=True)),
+                ('created', models.DateTimeField(default=django.utils.timezone.now)),
+                ('updated', models.DateTimeField(default=django.utils.timezone.now)),
+                ('deleted', models.BooleanField(default=False)),
+                ('active', models.BooleanField(default=True, help_text=b'Indicates whether the record has been retired?')),
+                ('search', models.CharField(max_length=255, null=True, editable=False, blank=True)),
+                ('report_type', models.CharField(max_length=100)),
+                ('query_string', models.TextField(default=b'', help_text=b'The query parameters of the report e.g county=<pk>', blank=True)),
+                ('file_format', models.CharField(default=b'json', max_length=10, choices=[(b'json', b'JSON'), (b'csv', b'CSV'), (b'excel', b'Excel')])),
+                ('job_key', models.CharField(max_length=40, editable=False, db_index=True)),
+                ('status', models.CharField(default=b'PENDING', max_length=20, choices=[(b'PENDING', b'The report is waiting to be generated'), (b'RUNNING', b'The report is being generated'), (b'COMPLETED', b'The report is ready for download'), (b'FAILED', b'The report could not be generated')])),
+                ('artifact', models.FileField(null=True, upload_to=b'report_jobs', blank=True)),
+                ('error', models.TextField(null=True, blank=True)),
+                ('expires', models.DateTimeField(help_text=b'The time after which the job is no longer reused and the report is deleted')),
+                ('created_by', models.ForeignKey(related_name='+', on_delete=django.db.models.deletion.PROTECT, default=common.models.base.get_default_system_user_id, to=settings.AUTH_USER_MODEL)),
+                ('updated_by', models.ForeignKey(related_name='+', on_delete=django.db.models.deletion.PROTECT, default=common.models.base.get_default_system_user_id, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ('-updated', '-created'),
+                'default_permissions': ('add', 'change', 'delete', 'view'),
+                'abstract': False,
+            },
+        ),
+    ]
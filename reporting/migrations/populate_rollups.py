@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from django.db import migrations
+
+
+def populate_rollups(apps, schema_editor):
+    from reporting.rollups import refresh_facility_rollup, refresh_chu_rollup
+    refresh_facility_rollup()
+    refresh_chu_rollup()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reporting', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(populate_rollups),
+    ]
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+from django.db import migrations
+
+# the grouping columns are mostly nullable foreign keys and postgres does
+# not consider nulls equal, hence the nulls are coalesced
+NULL_UUID = "'00000000-0000-0000-0000-000000000000'::uuid"
+
+
+def _unique_index_sql(table, foreign_keys, flags):
+    columns = [
+        "COALESCE({}, {})".format(column, NULL_UUID)
+        for column in foreign_keys
+    ] + list(flags)
+    return "CREATE UNIQUE INDEX {0}_unique_group ON {0} ({1});".format(
+        table, ", ".join(columns))
+
+
+facility_rollup_index_sql = _unique_index_sql(
+    'reporting_facilityrollup',
+    ['ward_id', 'sub_county_id', 'constituency_id', 'county_id',
+     'facility_type_id', 'keph_level_id', 'owner_id', 'owner_type_id',
+     'operation_status_id'],
+    ['has_edits', 'approved', 'rejected', 'closed', 'is_published'])
+
+chu_rollup_index_sql = _unique_index_sql(
+    'reporting_communityhealthunitrollup',
+    ['ward_id', 'sub_county_id', 'constituency_id', 'county_id',
+     'status_id'],
+    ['has_edits', 'is_approved', 'is_rejected', 'is_closed'])
+
+
+def rebuild_rollups(apps, schema_editor):
+    # drop any rows that were counted twice before the index exists
+    from reporting.rollups import refresh_facility_rollup, refresh_chu_rollup
+    refresh_facility_rollup()
+    refresh_chu_rollup()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reporting', '0002_reportjob'),
+    ]
+
+    operations = [
+        migrations.RunPython(rebuild_rollups),
+        migrations.RunSQL(
+            facility_rollup_index_sql,
+            "DROP INDEX reporting_facilityrollup_unique_group;"),
+        migrations.RunSQL(
+            chu_rollup_index_sql,
+            "DROP INDEX reporting_communityhealthunitrollup_unique_group;"),
+    ]
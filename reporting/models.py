@@ -0,0 +1,118 @@
+from django.db import models
+from django.utils import encoding
+
+from common.models import AbstractBase
+
+
+class RollupBase(models.Model):
+    """
+    The administrative area and approval state that rollups are counted by
+    """
+    ward = models.ForeignKey(
+        'common.Ward', null=True, blank=True, related_name='+')
+    sub_county = models.ForeignKey(
+        'common.SubCounty', null=True, blank=True, related_name='+')
+    constituency = models.ForeignKey(
+        'common.Constituency', null=True, blank=True, related_name='+')
+    county = models.ForeignKey(
+        'common.County', null=True, blank=True, related_name='+')
+    has_edits = models.BooleanField(default=False)
+
+    class Meta(object):
+        abstract = True
+
+
+@encoding.python_2_unicode_compatible
+class FacilityRollup(RollupBase):
+    """
+    Pre-aggregated facility counts, beds and cots.
+
+    There is a row for every combination of ward, facility type, keph level,
+    owner, operation status and approval flags that has facilities.
+    The rows of a ward are recomputed whenever one of its facilities is
+    saved and the whole table is rebuilt periodically to pick up changes
+    that bypass `save` e.g a ward moving to another constituency.
+    A unique index on the grouping columns, created by the
+    `rollup_unique_groups` migration, rejects a group counted twice.
+    """
+    facility_type = models.ForeignKey(
+        'facilities.FacilityType', null=True, blank=True, related_name='+')
+    keph_level = models.ForeignKey(
+        'facilities.KephLevel', null=True, blank=True, related_name='+')
+    owner = models.ForeignKey(
+        'facilities.Owner', null=True, blank=True, related_name='+')
+    owner_type = models.ForeignKey(
+        'facilities.OwnerType', null=True, blank=True, related_name='+')
+    operation_status = models.ForeignKey(
+        'facilities.FacilityStatus', null=True, blank=True, related_name='+')
+    approved = models.BooleanField(default=False)
+    rejected = models.BooleanField(default=False)
+    closed = models.BooleanField(default=False)
+    is_published = models.BooleanField(default=False)
+    number_of_facilities = models.PositiveIntegerField(default=0)
+    number_of_beds = models.PositiveIntegerField(default=0)
+    number_of_cots = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return "{} - {}".format(self.ward_id, self.number_of_facilities)
+
+
+@encoding.python_2_unicode_compatible
+class CommunityHealthUnitRollup(RollupBase):
+    """
+    Pre-aggregated community health unit counts.
+
+    Maintained like `FacilityRollup`, by the ward of the unit's facility.
+    """
+    status = models.ForeignKey(
+        'chul.Status', null=True, blank=True, related_name='+')
+    is_approved = models.BooleanField(default=False)
+    is_rejected = models.BooleanField(default=False)
+    is_closed = models.BooleanField(default=False)
+    number_of_units = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return "{} - {}".format(self.ward_id, self.number_of_units)
+
+
+REPORT_JOB_STATUSES = (
+    ('PENDING', 'The report is waiting to be generated'),
+    ('RUNNING', 'The report is being generated'),
+    ('COMPLETED', 'The report is ready for download'),
+    ('FAILED', 'The report could not be generated'),
+)
+
+REPORT_JOB_FORMATS = (
+    ('json', 'JSON'),
+    ('csv', 'CSV'),
+    ('excel', 'Excel'),
+)
+
+
+@encoding.python_2_unicode_compatible
+class ReportJob(AbstractBase):
+    """
+    A report generated in the background.
+
+    The report is generated by a celery task and stored in the default
+    file storage until the job expires. Identical requests by a user are
+    served by the same job while it has not expired.
+    """
+    report_type = models.CharField(max_length=100)
+    query_string = models.TextField(
+        blank=True, default='',
+        help_text='The query parameters of the report e.g county=<pk>')
+    file_format = models.CharField(
+        max_length=10, choices=REPORT_JOB_FORMATS, default='json')
+    job_key = models.CharField(max_length=40, db_index=True, editable=False)
+    status = models.CharField(
+        max_length=20, choices=REPORT_JOB_STATUSES, default='PENDING')
+    artifact = models.FileField(
+        upload_to='report_jobs', null=True, blank=True)
+    error = models.TextField(null=True, blank=True)
+    expires = models.DateTimeField(
+        help_text='The time after which the job is no longer reused and '
+        'the report is deleted')
+
+    def __str__(self):
+        return "{} - {}".format(self.report_type, self.status)
@@ -77,35 +77,46 @@ REPORTS = {
         },
         "top_level_field": "total"
     },
+    # facility count by county and facility type
     "facility_count_by_facility_type_detailed": {
-        "type": "complex",
-        "filter_fields": {
-            "model": "facilities.FacilityType",
-            "filter_field_name": "facility_type",
-            "return_field": ["type_category", "number_of_facilities"]
-        },
-        "extra_filters": {
-            "owner_type": {
-                "path": "facilities.OwnerType",
-                "filter_field_name": "owner__owner_type"
+        "type": "cross_tab",
+        "dimensions": [
+            {
+                "name": "county",
+                "path": "common.County",
+                "field_name": "ward__constituency__county"
+            },
+            {
+                "name": "facility_type",
+                "path": "facilities.FacilityType",
+                "field_name": "facility_type"
             }
+        ],
+        "query_filters": {
+            "owner_category": "owner__owner_type"
         },
-        "facility_fields": [
+        "count_name": "number_of_facilities"
+    },
+
+    # facility count by county and keph level
+    "facility_keph_level_report": {
+        "type": "cross_tab",
+        "dimensions": [
             {
                 "name": "county",
-                "field_name": "ward.constituency.county.name"
+                "path": "common.County",
+                "field_name": "ward__constituency__county"
             },
             {
-                "name": "owner_category",
-                "field_name": "owner.owner_type.name"
+                "name": "keph_level",
+                "path": "facilities.KephLevel",
+                "field_name": "keph_level"
             }
         ],
-        "group_by": {
-            "path": "common.County",
-            "name": "county",
-            "field_name": "ward__constituency__county"
+        "query_filters": {
+            "owner_category": "owner__owner_type"
         },
-        "top_level_field": "total"
+        "count_name": "number_of_facilities"
     }
 
 }
@@ -0,0 +1,328 @@
+"""
+Generation of large reports outside the request / response cycle
+
+A report job re-runs one of the report endpoints in a celery worker, as
+the user that requested it, and stores the rendered report in the default
+file storage. Users poll the job and download the report once it is ready.
+"""
+import csv
+import hashlib
+import logging
+import pickle
+import tempfile
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.base import ContentFile, File
+from django.db import connection, transaction
+from django.http import HttpRequest, QueryDict
+from django.utils import six, timezone
+from django.utils.module_loading import import_string
+
+from rest_framework.generics import GenericAPIView
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework_csv.renderers import CSVRenderer
+
+from search.search_utils import iterate_in_chunks
+from common.renderers.excel_renderer import (
+    _write_excel_file,
+    write_excel_rows
+)
+
+from .models import ReportJob
+
+LOGGER = logging.getLogger(__name__)
+
+# the endpoints that can be generated in the background
+REPORT_JOB_VIEWS = {
+    "reports": "reporting.facility_reports.ReportView",
+    "chul_reports": "reporting.facility_reports.CommunityHealthUnitReport",
+    "upgrade_downgrade_report":
+        "reporting.facility_reports.FacilityUpgradeDowngrade",
+    "facilities_list": "facilities.views.FacilityListView",
+    "facilities_material": "facilities.views.FacilityExportMaterialListView"
+}
+
+REPORT_JOB_EXTENSIONS = {
+    "json": "json",
+    "csv": "csv",
+    "excel": "xlsx"
+}
+
+# parameters that only affect how a synchronous response is rendered
+IGNORED_PARAMS = ('format', 'page', 'page_size')
+
+
+def get_report_job_ttl():
+    return timedelta(
+        seconds=getattr(settings, 'REPORT_JOB_TTL_SECONDS', 60 * 60 * 24))
+
+
+def get_report_job_stale_window():
+    return timedelta(
+        seconds=getattr(settings, 'REPORT_JOB_STALE_SECONDS', 60 * 60))
+
+
+def normalize_query_string(query_string):
+    """
+    Order the parameters so that identical requests have the same string
+    """
+    params = QueryDict(query_string, mutable=True)
+    for param in IGNORED_PARAMS:
+        params.pop(param, None)
+    normalized = QueryDict('', mutable=True)
+    for param in sorted(params.keys()):
+        normalized.setlist(param, sorted(params.getlist(param)))
+    return normalized.urlencode()
+
+
+def get_report_job_key(user, report_type, query_string, file_format):
+    key_parts = [str(user.pk), report_type, file_format, query_string]
+    return hashlib.sha1('|'.join(key_parts).encode('utf-8')).hexdigest()
+
+
+def get_or_create_report_job(user, report_type, query_string, file_format):
+    """
+    Returns the job that generates the report and whether it was created
+
+    A job that has the same parameters, was requested by the same user and
+    has not failed or expired is reused. A pending or running job that has
+    not been updated within the stale window e.g because its worker died
+    is not reused. Concurrent requests for the same job are serialized by
+    a transaction level advisory lock so that they all get the job created
+    by the first one.
+    """
+    query_string = normalize_query_string(query_string)
+    job_key = get_report_job_key(
+        user, report_type, query_string, file_format)
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT pg_advisory_xact_lock(hashtext(%s));", [job_key])
+        now = timezone.now()
+        job = ReportJob.objects.filter(
+            job_key=job_key, expires__gt=now
+        ).exclude(status='FAILED').exclude(
+            status__in=['PENDING', 'RUNNING'],
+            updated__lt=now - get_report_job_stale_window()
+        ).first()
+        if job:
+            return job, False
+
+        job = ReportJob.objects.create(
+            report_type=report_type,
+            query_string=query_string,
+            file_format=file_format,
+            job_key=job_key,
+            expires=timezone.now() + get_report_job_ttl(),
+            created_by=user,
+            updated_by=user
+        )
+
+    # imported here to avoid a circular import with the tasks module
+    from .tasks import generate_report_job
+    try:
+        generate_report_job.delay(str(job.id))
+    except Exception:
+        # e.g the broker is down; the job would otherwise stay pending
+        LOGGER.exception("Unable to schedule report job {}".format(job.id))
+        job.status = 'FAILED'
+        job.error = "The report could not be scheduled"
+        job.updated = timezone.now()
+        ReportJob.objects.filter(id=job.id).update(
+            status=job.status, error=job.error, updated=job.updated)
+    return job, True
+
+
+def build_report_view(user, report_type, query_string):
+    """
+    Set up a report's view as if the user had requested the report
+    """
+    http_request = HttpRequest()
+    http_request.method = 'GET'
+    http_request.GET = QueryDict(query_string)
+    http_request.user = user
+    request = Request(http_request)
+    request.user = user
+
+    view_class = import_string(REPORT_JOB_VIEWS[report_type])
+    view = view_class()
+    view.request = request
+    view.args = ()
+    view.kwargs = {}
+    view.format_kwarg = None
+    view.headers = {}
+    return view
+
+
+def check_report_permissions(user, report_type, query_string):
+    """
+    Raise `PermissionDenied` if the user can not view the report
+
+    The report's view checks its permissions like it would for a
+    synchronous request.
+    """
+    view = build_report_view(user, report_type, query_string)
+    view.check_permissions(view.request)
+    return view
+
+
+def get_report_view(job):
+    """
+    Set up the report's view as if the job's user had requested it
+
+    The permissions are checked again since they could have been revoked
+    after the job was created.
+    """
+    return check_report_permissions(
+        job.created_by, job.report_type, job.query_string)
+
+
+def get_report_rows(view):
+    """
+    Serialize the rows of a list endpoint a chunk at a time
+
+    The rows are serialized in primary key order, chunk by chunk, instead
+    of being paginated; rows that are updated while the report is being
+    generated are therefore neither skipped nor repeated.
+    """
+    queryset = view.filter_queryset(view.get_queryset())
+    for chunk in iterate_in_chunks(
+            queryset, getattr(settings, 'REPORT_JOB_CHUNK_SIZE', 1000)):
+        for row in view.get_serializer(chunk, many=True).data:
+            yield row
+
+
+def get_report_data(job, view=None):
+    """
+    Compute the report's data
+    """
+    view = view or get_report_view(job)
+    if not isinstance(view, GenericAPIView):
+        return view.get(view.request).data
+
+    results = list(get_report_rows(view))
+    return {
+        "count": len(results),
+        "results": results
+    }
+
+
+def render_report(data, file_format):
+    """
+    Render the report like the corresponding synchronous download
+    """
+    if file_format == 'json':
+        return JSONRenderer().render(data)
+
+    if not isinstance(data.get('results', None), list):
+        raise ValueError(
+            "Only reports with a list of results can be exported "
+            "to {}".format(file_format))
+    if file_format == 'csv':
+        return CSVRenderer().render(data['results'])
+    return _write_excel_file(data['results'])
+
+
+def _encode_csv_row(row):
+    return [
+        elem.encode('utf-8') if isinstance(elem, six.text_type) else elem
+        for elem in row
+    ]
+
+
+def write_csv_rows(report_file, rows):
+    """
+    Write the rows to `report_file` like `CSVRenderer` would
+
+    The columns are the sorted keys of all the flattened rows, so the
+    flattened rows are spooled to a temporary file until all the columns
+    are known.
+    """
+    renderer = CSVRenderer()
+    header = set()
+    row_count = 0
+    with tempfile.TemporaryFile() as flat_rows:
+        for row in rows:
+            flat_row = renderer.flatten_item(row)
+            header.update(flat_row.keys())
+            pickle.dump(flat_row, flat_rows, pickle.HIGHEST_PROTOCOL)
+            row_count += 1
+        if not row_count:
+            return
+
+        header = sorted(header)
+        csv_writer = csv.writer(report_file)
+        csv_writer.writerow(_encode_csv_row(header))
+        flat_rows.seek(0)
+        for _ in range(row_count):
+            flat_row = pickle.load(flat_rows)
+            csv_writer.writerow(
+                _encode_csv_row([flat_row.get(key) for key in header]))
+
+
+def write_report_file(rows, file_format):
+    """
+    Write the rows of a list report to a temporary file
+
+    The rows are written as they are serialized so that the whole report
+    is never held in memory.
+    """
+    report_file = tempfile.TemporaryFile()
+    if file_format == 'csv':
+        write_csv_rows(report_file, rows)
+    else:
+        write_excel_rows(report_file, rows, {'constant_memory': True})
+    report_file.seek(0)
+    return File(report_file)
+
+
+def run_report_job(job_id):
+    """
+    Generate the report of a pending job
+
+    A job that has already been picked up e.g by a re-delivered task
+    is not run again.
+    """
+    started = ReportJob.objects.filter(
+        id=job_id, status='PENDING'
+    ).update(status='RUNNING', updated=timezone.now())
+    if not started:
+        return
+
+    job = ReportJob.objects.get(id=job_id)
+    try:
+        view = get_report_view(job)
+        if job.file_format != 'json' and isinstance(view, GenericAPIView):
+            report_file = write_report_file(
+                get_report_rows(view), job.file_format)
+        else:
+            report_file = ContentFile(render_report(
+                get_report_data(job, view), job.file_format))
+        with report_file:
+            job.artifact.save(
+                "{}-{}.{}".format(
+                    job.report_type, job.id,
+                    REPORT_JOB_EXTENSIONS[job.file_format]),
+                report_file, save=False)
+        job.status = 'COMPLETED'
+    except Exception as error:
+        LOGGER.exception("Report job {} failed".format(job.id))
+        job.status = 'FAILED'
+        job.error = getattr(error, 'detail', None) or str(error)
+
+    job.updated = timezone.now()
+    job.expires = job.updated + get_report_job_ttl()
+    job.save(validate=False)
+
+
+def delete_expired_report_jobs():
+    """
+    Delete the expired jobs and their reports
+    """
+    expired_jobs = ReportJob.everything.filter(expires__lte=timezone.now())
+    for job in expired_jobs.exclude(artifact=None).exclude(artifact=''):
+        job.artifact.delete(save=False)
+    expired_jobs.delete()
@@ -0,0 +1,235 @@
+"""
+Maintenance of and queries against the facility and CHU rollups
+
+The rollups hold counts grouped by the lookups in `FACILITY_ROLLUP_FIELDS`
+and `CHU_ROLLUP_FIELDS`. Reports that only group and filter by those
+lookups are answered from the rollups; anything else falls back to
+counting the live records.
+"""
+from collections import OrderedDict
+
+from django.db import connection, transaction
+from django.db.models import Count, Sum
+from django.db.models.signals import post_delete, post_init, post_save
+from django.dispatch import receiver
+
+from facilities.models import Facility
+from chul.models import CommunityHealthUnit
+
+from .models import FacilityRollup, CommunityHealthUnitRollup
+
+
+# facility lookups mapped to the rollup fields they are stored in
+FACILITY_ROLLUP_FIELDS = OrderedDict([
+    ('ward', 'ward'),
+    ('ward__sub_county', 'sub_county'),
+    ('ward__constituency', 'constituency'),
+    ('ward__constituency__county', 'county'),
+    ('facility_type', 'facility_type'),
+    ('keph_level', 'keph_level'),
+    ('owner', 'owner'),
+    ('owner__owner_type', 'owner_type'),
+    ('operation_status', 'operation_status'),
+    ('approved', 'approved'),
+    ('rejected', 'rejected'),
+    ('has_edits', 'has_edits'),
+    ('closed', 'closed'),
+    ('is_published', 'is_published'),
+])
+
+CHU_ROLLUP_FIELDS = OrderedDict([
+    ('facility__ward', 'ward'),
+    ('facility__ward__sub_county', 'sub_county'),
+    ('facility__ward__constituency', 'constituency'),
+    ('facility__ward__constituency__county', 'county'),
+    ('status', 'status'),
+    ('is_approved', 'is_approved'),
+    ('is_rejected', 'is_rejected'),
+    ('is_closed', 'is_closed'),
+    ('has_edits', 'has_edits'),
+])
+
+
+def _get_rollup_rows(queryset, rollup_model, rollup_fields, aggregates):
+    rows = queryset.order_by().values(*rollup_fields.keys()).annotate(
+        **aggregates)
+    for row in rows:
+        values = {
+            rollup_model._meta.get_field(field_name).attname: row[lookup]
+            for lookup, field_name in rollup_fields.items()
+        }
+        values.update({
+            aggregate: row[aggregate] or 0 for aggregate in aggregates
+        })
+        yield values
+
+
+def get_facility_rollup_rows(facilities):
+    return _get_rollup_rows(
+        facilities, FacilityRollup, FACILITY_ROLLUP_FIELDS, {
+            "number_of_facilities": Count('id'),
+            "number_of_beds": Sum('number_of_beds'),
+            "number_of_cots": Sum('number_of_cots')
+        })
+
+
+def get_chu_rollup_rows(units):
+    return _get_rollup_rows(
+        units, CommunityHealthUnitRollup, CHU_ROLLUP_FIELDS, {
+            "number_of_units": Count('id')
+        })
+
+
+def _lock_rollup(rollup_model, ward_ids):
+    """
+    Serialize the refreshes of the rollup of the given wards
+
+    Without the lock two refreshes of a ward would both delete its rows
+    and both insert a full set. The ward locks are advisory locks taken in
+    order, while refreshing all the wards locks the table against writers.
+    The locks are held until the transaction ends.
+    """
+    table = rollup_model._meta.db_table
+    with connection.cursor() as cursor:
+        if ward_ids is None:
+            cursor.execute(
+                "LOCK TABLE {} IN SHARE ROW EXCLUSIVE MODE;".format(table))
+            return
+        for ward_id in sorted(str(ward_id) for ward_id in ward_ids):
+            cursor.execute(
+                "SELECT pg_advisory_xact_lock(hashtext(%s));",
+                ["{}:{}".format(table, ward_id)])
+
+
+def refresh_facility_rollup(ward_ids=None):
+    """
+    Recompute the facility rollup of the given wards, or of all the wards
+    """
+    facilities = Facility.objects.all()
+    rollups = FacilityRollup.objects.all()
+    if ward_ids is not None:
+        facilities = facilities.filter(ward_id__in=ward_ids)
+        rollups = rollups.filter(ward_id__in=ward_ids)
+    with transaction.atomic():
+        _lock_rollup(FacilityRollup, ward_ids)
+        rollups.delete()
+        FacilityRollup.objects.bulk_create(
+            [
+                FacilityRollup(**values)
+                for values in get_facility_rollup_rows(facilities)
+            ],
+            batch_size=1000)
+
+
+def refresh_chu_rollup(ward_ids=None):
+    """
+    Recompute the CHU rollup of the given wards, or of all the wards
+    """
+    units = CommunityHealthUnit.objects.all()
+    rollups = CommunityHealthUnitRollup.objects.all()
+    if ward_ids is not None:
+        units = units.filter(facility__ward_id__in=ward_ids)
+        rollups = rollups.filter(ward_id__in=ward_ids)
+    with transaction.atomic():
+        _lock_rollup(CommunityHealthUnitRollup, ward_ids)
+        rollups.delete()
+        CommunityHealthUnitRollup.objects.bulk_create(
+            [
+                CommunityHealthUnitRollup(**values)
+                for values in get_chu_rollup_rows(units)
+            ],
+            batch_size=1000)
+
+
+def _count(rollup_model, rollup_fields, rollup_count, live_queryset,
+           group_by, filters):
+    filters = filters or {}
+    lookups = list(group_by) + list(filters.keys())
+    if all(lookup in rollup_fields for lookup in lookups):
+        queryset = rollup_model.objects.filter(**{
+            rollup_fields[lookup]: value
+            for lookup, value in filters.items()
+        })
+        fields = [rollup_fields[lookup] for lookup in group_by]
+        aggregate = Sum(rollup_count)
+    else:
+        queryset = live_queryset.filter(**filters)
+        fields = list(group_by)
+        aggregate = Count('id')
+
+    if not fields:
+        return {(): queryset.aggregate(count=aggregate)['count'] or 0}
+    return {
+        row[:-1]: row[-1]
+        for row in queryset.order_by().values_list(*fields).annotate(
+            count=aggregate)
+    }
+
+
+def count_facilities(group_by=(), filters=None):
+    """
+    Count the facilities grouped by the given facility lookups
+
+    Returns a dict of the tuple of each group's values to its count e.g
+    `{(county_id, ): 12}` when grouping by `ward__constituency__county`;
+    without `group_by` the only key is the empty tuple.
+    """
+    return _count(
+        FacilityRollup, FACILITY_ROLLUP_FIELDS, 'number_of_facilities',
+        Facility.objects.all(), group_by, filters)
+
+
+def count_community_health_units(group_by=(), filters=None):
+    """
+    Count the community health units grouped by the given lookups
+
+    The same as `count_facilities` but for community health units.
+    """
+    return _count(
+        CommunityHealthUnitRollup, CHU_ROLLUP_FIELDS, 'number_of_units',
+        CommunityHealthUnit.objects.all(), group_by, filters)
+
+
+def get_facility_rollup_totals(group_by, filters=None):
+    """
+    Sum the facility rollup's beds and cots grouped by rollup fields
+    """
+    return FacilityRollup.objects.filter(**(filters or {})).order_by(
+    ).values(*group_by).annotate(
+        beds=Sum('number_of_beds'), cots=Sum('number_of_cots'))
+
+
+@receiver(post_init, sender=Facility)
+def remember_facility_ward(sender, instance, **kwargs):
+    # read from __dict__ so that a deferred ward is not fetched
+    instance._rollup_ward_id = instance.__dict__.get('ward_id')
+
+
+@receiver(post_save, sender=Facility)
+@receiver(post_delete, sender=Facility)
+def update_facility_rollup(sender, instance, **kwargs):
+    ward_ids = set([
+        getattr(instance, '_rollup_ward_id', None), instance.ward_id])
+    ward_ids.discard(None)
+    refresh_facility_rollup(ward_ids)
+    if len(ward_ids) > 1:
+        # the facility's units have moved along with it
+        refresh_chu_rollup(ward_ids)
+    instance._rollup_ward_id = instance.ward_id
+
+
+@receiver(post_init, sender=CommunityHealthUnit)
+def remember_chu_facility(sender, instance, **kwargs):
+    instance._rollup_facility_id = instance.__dict__.get('facility_id')
+
+
+@receiver(post_save, sender=CommunityHealthUnit)
+@receiver(post_delete, sender=CommunityHealthUnit)
+def update_chu_rollup(sender, instance, **kwargs):
+    facility_ids = set([
+        getattr(instance, '_rollup_facility_id', None), instance.facility_id])
+    facility_ids.discard(None)
+    ward_ids = Facility.everything.filter(
+        id__in=facility_ids).values_list('ward_id', flat=True)
+    refresh_chu_rollup(set(ward_ids))
+    instance._rollup_facility_id = instance.facility_id
@@ -0,0 +1,54 @@
+from django.core.urlresolvers import reverse
+
+from rest_framework import serializers
+
+from common.serializers import AbstractFieldsMixin
+
+from .models import ReportJob
+from .report_jobs import (
+    REPORT_JOB_VIEWS,
+    check_report_permissions,
+    get_or_create_report_job
+)
+
+
+class ReportJobSerializer(AbstractFieldsMixin, serializers.ModelSerializer):
+    download_url = serializers.SerializerMethodField()
+
+    def get_download_url(self, obj):
+        if obj.status != 'COMPLETED':
+            return None
+        url = reverse(
+            'api:reporting:report_job_download', kwargs={'pk': str(obj.pk)})
+        request = self.context.get('request', None)
+        return request.build_absolute_uri(url) if request else url
+
+    def validate_report_type(self, value):
+        if value not in REPORT_JOB_VIEWS:
+            raise serializers.ValidationError(
+                "The report type should be one of {}".format(
+                    ", ".join(sorted(REPORT_JOB_VIEWS.keys()))))
+        return value
+
+    def validate(self, attrs):
+        check_report_permissions(
+            self.context['request'].user,
+            attrs['report_type'],
+            attrs.get('query_string', ''))
+        return attrs
+
+    def create(self, validated_data):
+        job, created = get_or_create_report_job(
+            self.context['request'].user,
+            validated_data['report_type'],
+            validated_data.get('query_string', ''),
+            validated_data.get('file_format', 'json'))
+        return job
+
+    class Meta(object):
+        model = ReportJob
+        exclude = ('artifact', 'job_key', )
+        read_only_fields = (
+            'created', 'created_by', 'updated', 'updated_by', 'deleted',
+            'status', 'error', 'expires',
+        )
@@ -0,0 +1,47 @@
+from celery import shared_task
+from celery.schedules import crontab
+from celery.decorators import periodic_task
+
+from common.utilities.scoped_cache import get_all_areas, invalidate_areas
+
+from .rollups import refresh_facility_rollup, refresh_chu_rollup
+from .report_jobs import run_report_job, delete_expired_report_jobs
+
+
+@periodic_task(
+    run_every=(crontab(minute=30, hour='*/1')),
+    name="rebuild_rollups",
+    ignore_result=True)
+def rebuild_rollups():
+    """
+    Rebuild the facility and CHU rollups.
+
+    The rollups are kept up to date as facilities and CHUs are saved;
+    this reconciles them with changes that do not go through `save`
+    e.g queryset updates or a ward moving to another constituency.
+    The cached responses of every area are invalidated afterwards since
+    any of them could have been computed from the stale rollups.
+
+    The task runs every hour.
+    """
+    refresh_facility_rollup()
+    refresh_chu_rollup()
+    invalidate_areas(get_all_areas())
+
+
+@shared_task(name='generate_report_job', ignore_result=True)
+def generate_report_job(job_id):
+    run_report_job(job_id)
+
+
+@periodic_task(
+    run_every=(crontab(minute=45, hour='*/1')),
+    name="delete_expired_report_jobs",
+    ignore_result=True)
+def remove_expired_report_jobs():
+    """
+    Delete the report jobs that have expired together with their reports.
+
+    The task runs every hour.
+    """
+    delete_expired_report_jobs()
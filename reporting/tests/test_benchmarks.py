@@ -0,0 +1,45 @@
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from common.models import County, Ward
+from facilities.models import Facility
+from chul.models import CommunityHealthUnit
+
+from ..benchmarks import (
+    seed_national_dataset, run_benchmarks, check_budgets, get_budget)
+from ..models import FacilityRollup
+
+
+@override_settings(CACHES={
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+})
+class TestBenchmarks(TestCase):
+
+    def test_seed_national_dataset(self):
+        sizes = seed_national_dataset(scale=0.01)
+        self.assertEquals(sizes["counties"], County.objects.count())
+        self.assertEquals(sizes["wards"], Ward.objects.count())
+        self.assertEquals(sizes["facilities"], Facility.objects.count())
+        self.assertEquals(
+            sizes["community_health_units"],
+            CommunityHealthUnit.objects.count())
+        self.assertTrue(FacilityRollup.objects.exists())
+
+    def test_run_benchmarks(self):
+        seed_national_dataset(scale=0.01)
+        results = run_benchmarks()
+        self.assertIn("dashboard", results)
+        self.assertIn("reports:facility_count_by_county", results)
+        self.assertEquals([], [
+            name for name, result in results.items()
+            if result["status_code"] != 200
+        ])
+
+    def test_check_budgets(self):
+        within_budget = dict(get_budget("dashboard"), status_code=200)
+        self.assertEquals([], check_budgets({"dashboard": within_budget}))
+
+        over_budget = dict(within_budget, queries=1000, status_code=500)
+        self.assertEquals(2, len(check_budgets({"dashboard": over_budget})))
@@ -4,12 +4,15 @@ from django.utils import timezone
 
 from rest_framework.test import APITestCase
 from django.core.urlresolvers import reverse
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 
 from model_mommy import mommy
 from facilities.models import (
     Facility,)
 
 from chul.models import CommunityHealthUnit
+from common.models import County
 from common.tests.test_views import LoginMixin
 
 
@@ -194,3 +197,35 @@ class TestFacilityCountByCountyReport(LoginMixin, APITestCase):
         response_2 = self.client.get(url)
         self.assertEquals(200, response_2.status_code)
         self.assertEquals(1, response_2.data.get('total'))
+
+    def test_areas_without_units_are_reported(self):
+        county = mommy.make(County)
+        facility = mommy.make(Facility)
+        mommy.make(CommunityHealthUnit, facility=facility)
+        url = reverse("api:reporting:chul_reports")
+        response = self.client.get(url)
+        self.assertEquals(200, response.status_code)
+        self.assertEquals(1, response.data.get('total'))
+        self.assertIn(
+            {
+                "county_name": county.name,
+                "county_id": county.id,
+                "number_of_units": 0
+            },
+            response.data.get('results'))
+
+    def test_number_of_queries_does_not_grow_with_areas(self):
+        url = reverse("api:reporting:chul_reports") + "?last_quarter=true"
+        facility = mommy.make(Facility)
+        mommy.make(CommunityHealthUnit, facility=facility)
+        with CaptureQueriesContext(connection) as few_areas:
+            self.client.get(url)
+
+        for facility in mommy.make(Facility, _quantity=5):
+            mommy.make(CommunityHealthUnit, facility=facility)
+        with CaptureQueriesContext(connection) as many_areas:
+            response = self.client.get(url)
+        self.assertEquals(6, response.data.get('total'))
+        self.assertEquals(
+            len(few_areas.captured_queries),
+            len(many_areas.captured_queries))
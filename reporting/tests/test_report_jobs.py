@@ -0,0 +1,253 @@
+import json
+import zipfile
+
+from datetime import timedelta
+from mock import patch
+
+from django.contrib.auth import get_user_model
+from django.core.urlresolvers import reverse
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from rest_framework.permissions import BasePermission
+from rest_framework.test import APITestCase
+from model_mommy import mommy
+
+from facilities.models import Facility
+from facilities.views import FacilityListView
+from chul.models import CommunityHealthUnit
+from common.tests.test_views import LoginMixin
+from search import registry
+
+from ..facility_reports import FacilityUpgradeDowngrade
+from ..models import (
+    ReportJob,
+    FacilityRollup,
+    CommunityHealthUnitRollup
+)
+from ..report_jobs import (
+    get_or_create_report_job,
+    run_report_job,
+    delete_expired_report_jobs
+)
+from ..tasks import generate_report_job
+
+
+class CanViewFacilities(BasePermission):
+
+    def has_permission(self, request, view):
+        return request.user.has_perm('facilities.view_facility')
+
+
+class TestReportJobs(LoginMixin, APITestCase):
+
+    def setUp(self):
+        super(TestReportJobs, self).setUp()
+        self.url = reverse("api:reporting:report_jobs_list")
+        patcher = patch.object(generate_report_job, 'delay')
+        self.mock_delay = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _run_job(self, report_type, query_string='', file_format='json'):
+        job, created = get_or_create_report_job(
+            self.user, report_type, query_string, file_format)
+        run_report_job(job.id)
+        job = ReportJob.objects.get(id=job.id)
+        if job.artifact:
+            self.addCleanup(job.artifact.delete, False)
+        return job
+
+    def test_create_job(self):
+        data = {
+            "report_type": "chul_reports",
+            "query_string": "report_type=ward&format=excel",
+            "file_format": "excel"
+        }
+        response = self.client.post(self.url, data)
+        self.assertEquals(201, response.status_code)
+        self.assertEquals("PENDING", response.data["status"])
+        self.assertEquals("report_type=ward", response.data["query_string"])
+        self.assertIsNone(response.data["download_url"])
+        self.mock_delay.assert_called_once_with(str(response.data["id"]))
+
+    def test_identical_requests_share_a_job(self):
+        data = {
+            "report_type": "reports",
+            "query_string": "report_type=facility_count_by_county&page=2",
+        }
+        response = self.client.post(self.url, data)
+        response_2 = self.client.post(self.url, {
+            "report_type": "reports",
+            "query_string": "page=3&report_type=facility_count_by_county",
+        })
+        self.assertEquals(response.data["id"], response_2.data["id"])
+        self.assertEquals(1, ReportJob.objects.count())
+        self.assertEquals(1, self.mock_delay.call_count)
+
+    def test_invalid_report_type(self):
+        response = self.client.post(self.url, {"report_type": "salaries"})
+        self.assertEquals(400, response.status_code)
+        self.assertIn("report_type", response.data)
+
+    def test_generate_json_report(self):
+        facility = mommy.make(Facility)
+        mommy.make(CommunityHealthUnit, facility=facility)
+        job = self._run_job("chul_reports")
+        self.assertEquals("COMPLETED", job.status)
+        report = json.loads(job.artifact.read())
+        self.assertEquals(1, report["total"])
+
+        url = reverse(
+            "api:reporting:report_job_download", kwargs={"pk": job.id})
+        response = self.client.get(url)
+        self.assertEquals(200, response.status_code)
+        self.assertIn(
+            'filename="chul_reports.json"', response['Content-Disposition'])
+        self.assertEquals(
+            report, json.loads(b"".join(response.streaming_content)))
+
+        detail_url = reverse(
+            "api:reporting:report_job_detail", kwargs={"pk": job.id})
+        response = self.client.get(detail_url)
+        self.assertTrue(response.data["download_url"].endswith(url))
+
+    @override_settings(REPORT_JOB_CHUNK_SIZE=1)
+    def test_list_reports_are_generated_in_chunks(self):
+        mommy.make(Facility, _quantity=3)
+        job = self._run_job("facilities_list", file_format="csv")
+        self.assertEquals("COMPLETED", job.status)
+        # a header and a line per facility
+        self.assertEquals(4, len(job.artifact.read().strip().splitlines()))
+
+    @override_settings(REPORT_JOB_CHUNK_SIZE=1)
+    def test_rows_updated_during_a_report_are_written_once(self):
+        facilities = mommy.make(Facility, _quantity=3)
+        get_serializer = FacilityListView.get_serializer
+
+        def update_and_serialize(view, chunk, *args, **kwargs):
+            # the facilities are updated as they are exported
+            Facility.objects.filter(
+                id__in=[facility.id for facility in chunk]).update(
+                updated=timezone.now())
+            return get_serializer(view, chunk, *args, **kwargs)
+
+        with patch.object(
+                FacilityListView, 'get_serializer', update_and_serialize):
+            job = self._run_job("facilities_list", file_format="csv")
+        report = job.artifact.read()
+        for facility in facilities:
+            self.assertEquals(1, report.count(str(facility.id)))
+
+    @override_settings(REPORT_JOB_CHUNK_SIZE=1)
+    def test_list_excel_reports_are_written_in_chunks(self):
+        mommy.make(Facility, _quantity=3)
+        with patch('reporting.report_jobs.render_report') as mock_render:
+            job = self._run_job("facilities_list", file_format="excel")
+            self.assertFalse(mock_render.called)
+        self.assertEquals("COMPLETED", job.status)
+        sheet = zipfile.ZipFile(job.artifact).read('xl/worksheets/sheet1.xml')
+        # a header and a row per facility
+        self.assertEquals(4, sheet.count(b'<row '))
+
+    def test_failed_jobs_are_not_reused(self):
+        job = self._run_job("reports", "report_type=does_not_exist")
+        self.assertEquals("FAILED", job.status)
+        self.assertEquals("Report not found.", job.error)
+
+        job_2, created = get_or_create_report_job(
+            self.user, "reports", "report_type=does_not_exist", "json")
+        self.assertTrue(created)
+        self.assertNotEquals(job.id, job_2.id)
+
+    def test_jobs_that_can_not_be_scheduled_fail(self):
+        self.mock_delay.side_effect = IOError
+        job, created = get_or_create_report_job(
+            self.user, "chul_reports", "", "json")
+        self.assertEquals("FAILED", job.status)
+        self.assertEquals(
+            "FAILED", ReportJob.objects.get(id=job.id).status)
+
+        self.mock_delay.side_effect = None
+        job_2, created = get_or_create_report_job(
+            self.user, "chul_reports", "", "json")
+        self.assertTrue(created)
+        self.assertEquals("PENDING", job_2.status)
+
+    @override_settings(REPORT_JOB_STALE_SECONDS=60)
+    def test_stale_jobs_are_not_reused(self):
+        job, created = get_or_create_report_job(
+            self.user, "chul_reports", "", "json")
+        ReportJob.objects.filter(id=job.id).update(
+            status='RUNNING', updated=timezone.now() - timedelta(seconds=30))
+        self.assertEquals(job, get_or_create_report_job(
+            self.user, "chul_reports", "", "json")[0])
+
+        ReportJob.objects.filter(id=job.id).update(
+            updated=timezone.now() - timedelta(seconds=120))
+        job_2, created = get_or_create_report_job(
+            self.user, "chul_reports", "", "json")
+        self.assertTrue(created)
+        self.assertNotEquals(job.id, job_2.id)
+
+    def test_jobs_are_run_once(self):
+        job = self._run_job("chul_reports")
+        with patch('reporting.report_jobs.get_report_data') as mock_data:
+            run_report_job(job.id)
+            self.assertFalse(mock_data.called)
+
+    def test_download_a_pending_job(self):
+        job, created = get_or_create_report_job(
+            self.user, "chul_reports", "", "json")
+        url = reverse(
+            "api:reporting:report_job_download", kwargs={"pk": job.id})
+        response = self.client.get(url)
+        self.assertEquals(404, response.status_code)
+
+    def test_delete_expired_jobs(self):
+        job = self._run_job("chul_reports")
+        storage, name = job.artifact.storage, job.artifact.name
+        ReportJob.objects.filter(id=job.id).update(
+            expires=timezone.now() - timedelta(seconds=1))
+
+        job_2, created = get_or_create_report_job(
+            self.user, "chul_reports", "", "json")
+        self.assertTrue(created)
+
+        delete_expired_report_jobs()
+        self.assertFalse(ReportJob.everything.filter(id=job.id).exists())
+        self.assertTrue(ReportJob.objects.filter(id=job_2.id).exists())
+        self.assertFalse(storage.exists(name))
+
+    @patch.object(
+        FacilityUpgradeDowngrade, 'permission_classes', (CanViewFacilities, ))
+    def test_create_job_without_the_report_permission(self):
+        get_user_model().objects.create_user(
+            email='viewer@ehealth.or.ke',
+            first_name='Viewer',
+            employee_number='124144124125',
+            password='mtihani124')
+        self.client.logout()
+        self.client.login(email='viewer@ehealth.or.ke', password='mtihani124')
+        response = self.client.post(
+            self.url, {"report_type": "upgrade_downgrade_report"})
+        self.assertEquals(403, response.status_code)
+        self.assertFalse(ReportJob.objects.exists())
+        self.assertFalse(self.mock_delay.called)
+
+    def test_permissions_are_checked_when_the_job_runs(self):
+        job, created = get_or_create_report_job(
+            self.user, "upgrade_downgrade_report", "", "json")
+        self.user.is_superuser = False
+        self.user.save()
+        with patch.object(
+                FacilityUpgradeDowngrade, 'permission_classes',
+                (CanViewFacilities, )):
+            run_report_job(job.id)
+        job = ReportJob.objects.get(id=job.id)
+        self.assertEquals("FAILED", job.status)
+        self.assertFalse(job.artifact)
+
+    def test_report_models_are_not_indexed(self):
+        for model in (
+                ReportJob, FacilityRollup, CommunityHealthUnitRollup):
+            self.assertFalse(registry.is_indexable(model))
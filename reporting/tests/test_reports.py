@@ -1,16 +1,22 @@
 from datetime import timedelta
+from mock import patch
 
+from django.core.cache import cache
 from django.utils import timezone
 
 from rest_framework.test import APITestCase
 from django.core.urlresolvers import reverse
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings
 
 from model_mommy import mommy
 from facilities.models import (
-    Facility, FacilityType, KephLevel, FacilityUpgrade)
+    Facility, FacilityType, KephLevel, FacilityUpgrade, Owner, OwnerType)
 from common.models import Ward, County, Constituency
 from common.tests.test_views import LoginMixin
 
+from ..facility_reports import ReportView
+
 
 class TestFacilityCountByCountyReport(LoginMixin, APITestCase):
 
@@ -43,6 +49,59 @@ class TestFacilityCountByCountyReport(LoginMixin, APITestCase):
         response = self.client.get(url)
         self.assertEquals(200, response.status_code)
 
+    def test_facility_count_by_county(self):
+        county = mommy.make(County, name='Kiambu')
+        empty_county = mommy.make(County, name='Lamu')
+        constituency = mommy.make(Constituency, county=county)
+        ward = mommy.make(Ward, constituency=constituency)
+        mommy.make(Facility, ward=ward, _quantity=2)
+        url = reverse("api:reporting:reports")
+        response = self.client.get(
+            url + "?report_type=facility_count_by_county")
+        self.assertEquals(200, response.status_code)
+        counts = {
+            result['county_name']: result['number_of_facilities']
+            for result in response.data['results']
+        }
+        self.assertEquals(2, counts[county.name])
+        self.assertEquals(0, counts[empty_county.name])
+        self.assertEquals(2, response.data['total'])
+
+    def test_grouped_report(self):
+        county = mommy.make(County, name='Kiambu')
+        constituency = mommy.make(Constituency, county=county)
+        ward = mommy.make(Ward, constituency=constituency)
+        f_type = mommy.make(FacilityType, name='Dispensary')
+        mommy.make(FacilityType, name='Health Centre')
+        mommy.make(Facility, ward=ward, facility_type=f_type, _quantity=3)
+        grouped_report = {
+            "type": "complex",
+            "filter_fields": {
+                "model": "facilities.FacilityType",
+                "filter_field_name": "facility_type",
+                "return_field": ["type_category", "number_of_facilities"]
+            },
+            "group_by": {
+                "path": "common.County",
+                "name": "county",
+                "field_name": "ward__constituency__county"
+            },
+            "top_level_field": "total"
+        }
+        url = reverse("api:reporting:reports")
+        with patch.dict(
+                'reporting.facility_reports.REPORTS',
+                {"grouped_report": grouped_report}):
+            response = self.client.get(url + "?report_type=grouped_report")
+        self.assertEquals(200, response.status_code)
+        counts = {
+            (result['county'], result['type_category']):
+            result['number_of_facilities']
+            for result in response.data['results']
+        }
+        self.assertEquals(3, counts[('Kiambu', 'Dispensary')])
+        self.assertEquals(0, counts[('Kiambu', 'Health Centre')])
+
     def test_get_facility_by_facility_types(self):
         f_type = mommy.make(FacilityType)
         f_type_2 = mommy.make(FacilityType)
@@ -76,6 +135,35 @@ class TestFacilityCountByCountyReport(LoginMixin, APITestCase):
         response = self.client.get(url)
         self.assertEquals(200, response.status_code)
 
+    def test_get_facility_by_keph_level_and_owner_category(self):
+        county = mommy.make(County, name='Kiambu')
+        constituency = mommy.make(Constituency, county=county)
+        ward = mommy.make(Ward, constituency=constituency)
+        keph_level = mommy.make(KephLevel, name='Level 2')
+        mommy.make(KephLevel, name='Level 3')
+        owner_type = mommy.make(OwnerType)
+        owner = mommy.make(Owner, owner_type=owner_type)
+        mommy.make(
+            Facility, keph_level=keph_level, ward=ward, owner=owner,
+            _quantity=2)
+        mommy.make(Facility, keph_level=keph_level, ward=ward)
+        url = reverse("api:reporting:reports")
+        url = url + "?report_type=facility_keph_level_report"
+        response = self.client.get(
+            url + "&owner_category={}".format(owner_type.id))
+        self.assertEquals(200, response.status_code)
+        counts = {
+            (result['county'], result['keph_level']):
+            result['number_of_facilities']
+            for result in response.data['results']
+        }
+        self.assertEquals(2, counts[('Kiambu', 'Level 2')])
+        self.assertEquals(0, counts[('Kiambu', 'Level 3')])
+        totals = response.data['total']
+        self.assertEquals(2, totals['county']['Kiambu'])
+        self.assertEquals(2, totals['keph_level']['Level 2'])
+        self.assertEquals(2, totals['number_of_facilities'])
+
     def test_get_upgrade_downgrade_report(self):
         url = reverse("api:reporting:upgrade_downgrade_report")
         keph_level = mommy.make(KephLevel)
@@ -208,6 +296,73 @@ class TestFacilityCountByCountyReport(LoginMixin, APITestCase):
         response = self.client.get(url)
         self.assertEquals(4, response.data.get("total_number_of_changes"))
 
+    def test_upgrade_downgrade_report_uses_the_latest_change(self):
+        county = mommy.make(County)
+        constituency = mommy.make(Constituency, county=county)
+        ward = mommy.make(Ward, constituency=constituency)
+        facility = mommy.make(Facility, ward=ward)
+        mommy.make(FacilityUpgrade, facility=facility, is_confirmed=True)
+        latest_change = mommy.make(
+            FacilityUpgrade, facility=facility, keph_level=None)
+        url = reverse("api:reporting:upgrade_downgrade_report")
+
+        response = self.client.get(url)
+        self.assertEquals(2, response.data.get("total_number_of_changes"))
+        self.assertIn(
+            {"county": county.name, "county_id": county.id, "changes": 1},
+            response.data.get("results"))
+
+        response = self.client.get(url + "?county={}".format(county.id))
+        self.assertEquals(1, response.data.get("total_facilities_changed"))
+        result = response.data.get("results")[0]
+        self.assertIsNone(result["current_keph_level"])
+        self.assertEquals(
+            latest_change.facility_type.name, result["current_facility_type"])
+        self.assertEquals(latest_change.reason.reason, result["reason"])
+
+    def test_upgrade_downgrade_report_skips_deleted_facilities(self):
+        county = mommy.make(County)
+        constituency = mommy.make(Constituency, county=county)
+        ward = mommy.make(Ward, constituency=constituency)
+        facility = mommy.make(Facility, ward=ward)
+        deleted_facility = mommy.make(Facility, ward=ward)
+        mommy.make(FacilityUpgrade, facility=facility)
+        mommy.make(FacilityUpgrade, facility=deleted_facility)
+        deleted_facility.delete()
+        url = reverse("api:reporting:upgrade_downgrade_report")
+
+        response = self.client.get(url)
+        self.assertEquals(2, response.data.get("total_number_of_changes"))
+        self.assertIn(
+            {"county": county.name, "county_id": county.id, "changes": 1},
+            response.data.get("results"))
+
+        response = self.client.get(url + "?county={}".format(county.id))
+        self.assertEquals(1, response.data.get("total_facilities_changed"))
+        self.assertEquals(
+            facility.name, response.data.get("results")[0]["name"])
+
+    def test_upgrade_downgrade_queries_do_not_grow_with_facilities(self):
+        county = mommy.make(County)
+        constituency = mommy.make(Constituency, county=county)
+        ward = mommy.make(Ward, constituency=constituency)
+        url = reverse("api:reporting:upgrade_downgrade_report")
+        county_url = url + "?county={}".format(county.id)
+        mommy.make(FacilityUpgrade, facility=mommy.make(Facility, ward=ward))
+        with CaptureQueriesContext(connection) as few_facilities:
+            self.client.get(url)
+            self.client.get(county_url)
+
+        for facility in mommy.make(Facility, ward=ward, _quantity=5):
+            mommy.make(FacilityUpgrade, facility=facility)
+        with CaptureQueriesContext(connection) as many_facilities:
+            self.client.get(url)
+            response = self.client.get(county_url)
+        self.assertEquals(6, response.data.get("total_facilities_changed"))
+        self.assertEquals(
+            len(few_facilities.captured_queries),
+            len(many_facilities.captured_queries))
+
 
 class TestBedsAndCots(LoginMixin, APITestCase):
 
@@ -274,3 +429,47 @@ class TestBedsAndCots(LoginMixin, APITestCase):
             self.base_url, "beds_and_cots_by_ward", str(self.cons3.pk)
         ))
         self.assertEquals(200, response.status_code)
+
+
+@override_settings(CACHES={
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+})
+class TestReportCache(LoginMixin, APITestCase):
+
+    def setUp(self):
+        super(TestReportCache, self).setUp()
+        cache.clear()
+        self.url = reverse("api:reporting:reports")
+
+    def test_reports_are_cached(self):
+        mommy.make(Facility)
+        with patch.object(
+                ReportView, 'get_report_data',
+                wraps=ReportView.get_report_data,
+                autospec=True) as mock_data:
+            self.client.get(self.url)
+            response = self.client.get(self.url)
+            self.assertEquals(1, mock_data.call_count)
+
+            self.client.get(self.url + "?report_type=facility_count_by_county")
+            self.assertEquals(2, mock_data.call_count)
+        self.assertEquals(1, response.data["total"])
+
+    def test_facility_changes_invalidate_the_reports(self):
+        mommy.make(Facility)
+        self.client.get(self.url)
+        mommy.make(Facility)
+        response = self.client.get(self.url)
+        self.assertEquals(2, response.data["total"])
+
+    def test_lookup_changes_invalidate_the_reports(self):
+        county = mommy.make(County, name="Kiambu")
+        self.client.get(self.url)
+        county.name = "Nyeri"
+        county.save()
+        response = self.client.get(self.url)
+        self.assertIn(
+            "Nyeri", [result["county_name"] for result in
+                      response.data["results"]])
@@ -0,0 +1,121 @@
+from django.db import IntegrityError, transaction
+from django.test import TestCase
+
+from model_mommy import mommy
+
+from facilities.models import Facility, FacilityType
+from chul.models import CommunityHealthUnit
+from common.models import Ward
+
+from ..models import FacilityRollup, CommunityHealthUnitRollup
+from ..rollups import count_facilities, count_community_health_units
+from ..tasks import rebuild_rollups
+
+
+class TestFacilityRollup(TestCase):
+
+    def test_facility_saves_update_the_rollup(self):
+        ward = mommy.make(Ward)
+        facility_type = mommy.make(FacilityType)
+        facility = mommy.make(
+            Facility, ward=ward, facility_type=facility_type,
+            number_of_beds=5, number_of_cots=2)
+        mommy.make(
+            Facility, ward=ward, facility_type=facility_type,
+            owner=facility.owner, keph_level=facility.keph_level,
+            operation_status=facility.operation_status,
+            number_of_beds=3, number_of_cots=1)
+
+        rollup = FacilityRollup.objects.get(ward=ward)
+        self.assertEquals(2, rollup.number_of_facilities)
+        self.assertEquals(8, rollup.number_of_beds)
+        self.assertEquals(3, rollup.number_of_cots)
+        self.assertEquals(ward.constituency.county_id, rollup.county_id)
+        self.assertEquals(facility_type.id, rollup.facility_type_id)
+
+    def test_moving_a_facility_updates_both_wards(self):
+        facility = mommy.make(Facility)
+        old_ward = facility.ward
+        new_ward = mommy.make(Ward)
+        facility = Facility.objects.get(id=facility.id)
+        facility.ward = new_ward
+        facility.save()
+        self.assertFalse(FacilityRollup.objects.filter(ward=old_ward).exists())
+        self.assertEquals(
+            1, FacilityRollup.objects.get(ward=new_ward).number_of_facilities)
+
+    def test_deleted_facilities_are_not_counted(self):
+        facility = mommy.make(Facility)
+        facility.delete()
+        self.assertEquals(0, FacilityRollup.objects.count())
+
+    def test_count_facilities(self):
+        ward = mommy.make(Ward)
+        mommy.make(Facility, ward=ward, _quantity=2)
+        mommy.make(Facility)
+        counts = count_facilities(['ward__constituency__county'])
+        self.assertEquals(2, counts[(ward.constituency.county_id, )])
+        self.assertEquals(3, count_facilities()[()])
+        self.assertEquals(
+            2, count_facilities(filters={"ward": ward.id})[()])
+
+    def test_count_facilities_by_lookups_missing_from_the_rollup(self):
+        facility = mommy.make(Facility, name='Ile Noma')
+        mommy.make(Facility)
+        counts = count_facilities(
+            ['ward'], filters={"name__icontains": "noma"})
+        self.assertEquals({(facility.ward_id, ): 1}, counts)
+
+    def test_rebuild_rollups(self):
+        ward = mommy.make(Ward)
+        mommy.make(Facility, ward=ward, _quantity=2)
+        Facility.objects.filter(ward=ward).update(approved=True)
+        self.assertEquals(
+            0, count_facilities(filters={"approved": True})[()])
+
+        rebuild_rollups()
+        self.assertEquals(
+            2, count_facilities(filters={"approved": True})[()])
+
+    def test_a_group_can_not_be_counted_twice(self):
+        facility = mommy.make(Facility)
+        rollup = FacilityRollup.objects.get(ward_id=facility.ward_id)
+        rollup.pk = None
+        with self.assertRaises(IntegrityError):
+            with transaction.atomic():
+                rollup.save()
+
+
+class TestCommunityHealthUnitRollup(TestCase):
+
+    def test_chu_saves_update_the_rollup(self):
+        facility = mommy.make(Facility)
+        mommy.make(CommunityHealthUnit, facility=facility, _quantity=2)
+        rollup = CommunityHealthUnitRollup.objects.get(ward=facility.ward)
+        self.assertEquals(2, rollup.number_of_units)
+        self.assertEquals(
+            2, count_community_health_units(
+                ['facility__ward__constituency__county']
+            )[(facility.ward.constituency.county_id, )])
+
+    def test_moving_a_chu_updates_both_wards(self):
+        facility = mommy.make(Facility)
+        other_facility = mommy.make(Facility)
+        chu = mommy.make(CommunityHealthUnit, facility=facility)
+        chu = CommunityHealthUnit.objects.get(id=chu.id)
+        chu.facility = other_facility
+        chu.save()
+        self.assertFalse(CommunityHealthUnitRollup.objects.filter(
+            ward=facility.ward).exists())
+        self.assertEquals(1, CommunityHealthUnitRollup.objects.get(
+            ward=other_facility.ward).number_of_units)
+
+    def test_moving_a_facility_moves_its_units(self):
+        facility = mommy.make(Facility)
+        mommy.make(CommunityHealthUnit, facility=facility)
+        new_ward = mommy.make(Ward)
+        facility = Facility.objects.get(id=facility.id)
+        facility.ward = new_ward
+        facility.save()
+        self.assertEquals(1, CommunityHealthUnitRollup.objects.get(
+            ward=new_ward).number_of_units)
@@ -5,6 +5,11 @@ from .facility_reports import (
     FacilityUpgradeDowngrade,
     CommunityHealthUnitReport
 )
+from .views import (
+    ReportJobListView,
+    ReportJobDetailView,
+    ReportJobDownloadView
+)
 
 
 urlpatterns = patterns(
@@ -17,6 +22,15 @@ urlpatterns = patterns(
         FacilityUpgradeDowngrade.as_view(),
         name='upgrade_downgrade_report'),
 
+    url(r'^jobs/$', ReportJobListView.as_view(),
+        name='report_jobs_list'),
+
+    url(r'^jobs/(?P<pk>[^/]+)/$', ReportJobDetailView.as_view(),
+        name='report_job_detail'),
+
+    url(r'^jobs/(?P<pk>[^/]+)/download/$', ReportJobDownloadView.as_view(),
+        name='report_job_download'),
+
     url(r'^$', ReportView.as_view(),
         name='reports'),
 
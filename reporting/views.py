@@ -0,0 +1,57 @@
+import mimetypes
+
+from django.http import FileResponse
+
+from rest_framework import generics
+from rest_framework.exceptions import NotFound
+
+from .models import ReportJob
+from .report_jobs import REPORT_JOB_EXTENSIONS
+from .serializers import ReportJobSerializer
+
+
+class ReportJobMixin(object):
+    serializer_class = ReportJobSerializer
+
+    def get_queryset(self):
+        return ReportJob.objects.filter(created_by=self.request.user)
+
+
+class ReportJobListView(ReportJobMixin, generics.ListCreateAPIView):
+    """
+    Lists and creates the report jobs of the logged in user
+
+    report_type -- The report to generate e.g chul_reports<br>
+    query_string -- The report's query parameters e.g report_type=ward<br>
+    file_format -- One of json, csv or excel<br>
+
+    Creating a job that is identical to a job that has not failed or
+    expired returns the existing job.
+    """
+    ordering_fields = ('created', 'status', 'report_type', )
+
+
+class ReportJobDetailView(ReportJobMixin, generics.RetrieveAPIView):
+    """
+    Retrieves a report job e.g to poll its status
+    """
+
+
+class ReportJobDownloadView(ReportJobMixin, generics.RetrieveAPIView):
+    """
+    Downloads the report of a completed report job
+    """
+
+    def get(self, *args, **kwargs):
+        job = self.get_object()
+        if job.status != 'COMPLETED' or not job.artifact:
+            raise NotFound("The report is not ready")
+
+        file_name = "{}.{}".format(
+            job.report_type, REPORT_JOB_EXTENSIONS[job.file_format])
+        response = FileResponse(
+            job.artifact.storage.open(job.artifact.name, 'rb'),
+            content_type=mimetypes.guess_type(file_name)[0])
+        response['Content-Disposition'] = (
+            'attachment; filename="{}"'.format(file_name))
+        return response
@@ -4,12 +4,20 @@ Custom search filters.
 Add a custom django_filters field that interacts with Elasticsearch
 """
 
+import re
+import six
+import operator
+import functools
+
 from django.conf import settings
-from django.db.models import Q  # NOQA
+from django.db.models import Q
 
 import django_filters
+from requests.exceptions import ConnectionError, Timeout
+from rest_framework.exceptions import ValidationError
 
-from search.search_utils import ElasticAPI
+from search.search_utils import (
+    ElasticAPI, ElasticHealth, SEARCH_RESULT_SIZE)
 
 
 FIELD_TYPES = [
@@ -31,16 +39,25 @@ class SearchFilter(django_filters.filters.Filter):
         """Override this method in order to search in Elasticsearch index."""
         super(SearchFilter, self).filter(qs, value)
         api = ElasticAPI()
-        if api._is_on:
-
+        result = None
+        use_elastic = api._is_on
+        if use_elastic:
             document_type = qs.model
             index_name = settings.SEARCH.get('INDEX_NAME')
-            if self.search_type == 'full_text':
-                result = api.search_document(index_name, document_type, value)
-            else:
-                result = api.search_auto_complete_document(
-                    index_name, document_type, value)
-
+            size = self._get_result_window()
+            try:
+                if self.search_type == 'full_text':
+                    result = api.search_document(
+                        index_name, document_type, value, size=size)
+                else:
+                    result = api.search_auto_complete_document(
+                        index_name, document_type, value, size=size)
+            except (ConnectionError, Timeout):
+                # fall back to searching the database from now on
+                ElasticHealth().record_failure()
+                use_elastic = False
+
+        if use_elastic:
             hits = []
             try:
                 hits = result.json().get('hits').get('hits') if result.json() \
@@ -48,56 +65,142 @@ class SearchFilter(django_filters.filters.Filter):
             except AttributeError:
                 hits = hits
 
-            hits_ids_list = [str(hit.get('_id')) for hit in hits]
-
-            pk_list = hits_ids_list
-
-            if qs.model._meta.managed:
-                table_name = "{0}_{1}.id".format(
-                    qs.model._meta.app_label, qs.model.__name__.lower())
-            else:
-                table_name = "{}.id".format(qs.model._meta.db_table)
-
-            clauses = ' '.join(
-                [
-                    "WHEN %s='%s' THEN '%s'" % (
-                        table_name, pk, i) for i, pk in enumerate(pk_list)
+            pk_list = [str(hit.get('_id')) for hit in hits]
+            return self._order_by_hits(qs.filter(pk__in=pk_list), pk_list)
+        else:
+            return self._filter_database(qs, value)
+
+    def _get_result_window(self):
+        """
+        The number of hits needed to serve the requested page.
+
+        Only the ids of the hits are fetched from elasticsearch so growing
+        the window with the page number is cheap, while page one still
+        costs the same as before. The hits are always fetched from the
+        first one: `search_after` cursors need elasticsearch 5 while this
+        project targets the 1.x API, and scroll contexts do not fit the
+        stateless page based pagination of the API. Pages beyond
+        `MAX_SEARCH_WINDOW` hits are therefore rejected instead of being
+        silently cut off.
+        """
+        data = getattr(getattr(self, 'parent', None), 'data', None) or {}
+        rest_settings = settings.REST_FRAMEWORK
+        try:
+            page = int(data.get('page', 1))
+            page_size = int(data.get(
+                rest_settings.get('PAGINATE_BY_PARAM'),
+                rest_settings.get('PAGINATE_BY')))
+        except (TypeError, ValueError):
+            page, page_size = 1, rest_settings.get('PAGINATE_BY')
+        window = max(page, 1) * max(page_size, 1)
+        max_window = settings.SEARCH.get('MAX_SEARCH_WINDOW', 10000)
+        if window > max_window:
+            raise ValidationError({
+                "page": [
+                    "Only the first {} search results can be paged "
+                    "through; refine the search".format(max_window)
                 ]
+            })
+        return max(window, SEARCH_RESULT_SIZE)
+
+    def _order_by_hits(self, qs, pk_list):
+        """
+        Order the records in the same order as the elasticsearch hits.
+
+        The position of each record is looked up in the array of hit ids,
+        which is passed as a single query parameter.
+        """
+        hit_position = (
+            "(SELECT hit.position FROM unnest(%s::text[]) "
+            "WITH ORDINALITY AS hit(id, position) "
+            "WHERE hit.id = {0}.{1}::text)".format(
+                qs.model._meta.db_table, qs.model._meta.pk.column)
+        )
+        return qs.extra(
+            select={'search_rank': hit_position},
+            select_params=(pk_list, ),
+            order_by=('search_rank', ))
+
+    def _get_full_text_table(self, model):
+        full_text_models = settings.SEARCH.get(
+            'DATABASE_FULL_TEXT_MODELS', {})
+        return full_text_models.get("{}.{}".format(
+            model._meta.app_label, model.__name__.lower()))
+
+    def _filter_database(self, qs, value):
+        """
+        Search the database when elasticsearch is not available.
+
+        Models with a maintained `search_vector` column are searched with
+        Postgres full text search, falling back to trigram similarity on
+        the name for misspelt queries. Other models are searched with a
+        case insensitive match on their text fields.
+        """
+        value = six.text_type(value)
+        full_text_table = self._get_full_text_table(qs.model)
+        tsquery = build_prefix_tsquery(value)
+        if full_text_table and tsquery:
+            return self._filter_full_text(qs, value, tsquery, full_text_table)
+
+        model = qs.model
+
+        fields = [
+            field.name for field in model._meta.get_fields()
+            if field.concrete and field.get_internal_type() in FIELD_TYPES
+        ]
+
+        filter_params = {}
+
+        for field in fields:
+            field_type = model._meta.get_field(field).get_internal_type()
+            if field_type == 'SequenceField' and value.isdigit():
+                filter_params[field + '__exact'] = value
+                break
+            else:
+                filter_params[field + '__icontains'] = value
+
+        if not filter_params:
+            return qs.none()
+        q_filter = functools.reduce(
+            operator.or_,
+            [Q(**{key: val}) for key, val in filter_params.items()]
+        )
+        return qs.filter(q_filter)
+
+    def _filter_full_text(self, qs, value, tsquery, full_text_table):
+        match_clause = (
+            "{0}.search_vector @@ to_tsquery('simple', %s) "
+            "OR {0}.name %% %s".format(full_text_table)
+        )
+        model_table = qs.model._meta.db_table
+        if model_table == full_text_table:
+            rank = (
+                "ts_rank({0}.search_vector, to_tsquery('simple', %s)) + "
+                "similarity({0}.name, %s)".format(full_text_table)
             )
+            return qs.extra(
+                where=[match_clause], params=[tsquery, value],
+                select={'search_rank': rank},
+                select_params=(tsquery, value),
+                order_by=('-search_rank', ))
 
-            ordering = 'CASE %s END' % clauses
-            queryset = qs.filter(pk__in=pk_list).extra(
-                select={'ordering': ordering}, order_by=('ordering',))
-
-            return queryset
-        else:
-
-            model = qs.model
+        # e.g. the facilities material view is searched through the
+        # search vector of the facilities table it is built from
+        where = "{0}.id IN (SELECT {1}.id FROM {1} WHERE {2})".format(
+            model_table, full_text_table, match_clause)
+        return qs.extra(where=[where], params=[tsquery, value])
 
-            fields = [
-                field.name for field in model._meta.get_fields()
-                if field.concrete and field.get_internal_type() in FIELD_TYPES
-            ]
 
-            filter_params = {}
-
-            for field in fields:
-                field_type = model._meta.get_field(field).get_internal_type()
-                if field_type == 'SequenceField' and value.isdigit():
-                    filter_params[field + '__exact'] = value
-                    break
-                else:
-                    filter_params[field + '__icontains'] = value
-
-            q_filter = ""
-            for key, value in filter_params.items():
-                q_filter += "Q({0}='{1}') | ".format(key, value)
+def build_prefix_tsquery(value):
+    """
+    Turn a free text query into a `to_tsquery` expression.
 
-            # remove the pipe character at the end of the string
-            q_filter_reverse = q_filter[::-1]
-            q_filter = q_filter_reverse[3:len(q_filter_reverse) + 1]
-            q_filter = q_filter[::-1]
-            return qs.filter(eval(q_filter))
+    Every word is matched as a prefix and all words have to match, e.g.
+    'nairobi hosp' becomes 'nairobi:* & hosp:*'. Only word characters are
+    kept so the expression is always valid.
+    """
+    words = re.findall(r'\w+', value, re.UNICODE)
+    return u' & '.join(u"{}:*".format(word.lower()) for word in words)
 
 
 class AutoCompleteSearchFilter(SearchFilter):
@@ -1,8 +1,20 @@
+from django.core.cache import cache
 from django.core.management import BaseCommand
 from django.db.models import get_app, get_models
 from django.conf import settings
 
-from search.search_utils import index_instance, confirm_model_is_indexable
+from search.search_utils import (
+    ElasticAPI,
+    bulk_index_queryset,
+    confirm_model_is_indexable,
+    get_rebuild_target_index,
+    set_rebuild_target_index,
+    BULK_INDEX_CHUNK_SIZE,
+    INDEX_NAME
+)
+
+# Records how far a rebuild has gone so that it can be resumed
+CHECKPOINT_CACHE_KEY = 'search_build_index_checkpoint'
 
 
 class Command(BaseCommand):
@@ -13,9 +25,78 @@ class Command(BaseCommand):
             dest='test',
             default=False,
             help='Provide this if you want to create a test index')
+        parser.add_argument(
+            '--resume',
+            action='store_true',
+            dest='resume',
+            default=False,
+            help='Continue a previous rebuild from where it stopped')
+        parser.add_argument(
+            '--chunk-size',
+            action='store',
+            type=int,
+            dest='chunk_size',
+            default=BULK_INDEX_CHUNK_SIZE,
+            help='The number of documents sent in each bulk request')
+        parser.add_argument(
+            '--index',
+            action='store',
+            dest='index_name',
+            default=INDEX_NAME,
+            help='The index to build')
+
+    def _save_checkpoint(self, checkpoint):
+        cache.set(CHECKPOINT_CACHE_KEY, checkpoint, None)
+        # keep `rebuild_index` mirroring updates into the index being built
+        if get_rebuild_target_index() == checkpoint['index_name']:
+            set_rebuild_target_index(checkpoint['index_name'])
+
+    def _index_model(self, model, checkpoint, options):
+        model_label = "{}.{}".format(
+            model._meta.app_label, model.__name__)
+        if model_label in checkpoint['completed']:
+            self.stdout.write(
+                "Skipping {} as it was already indexed".format(model_label))
+            return
+
+        queryset = model.objects.all()
+        if options.get('test'):
+            queryset = queryset.filter(
+                pk__in=list(queryset.values_list('pk', flat=True)[0:100]))
+
+        indexed = 0
+        for batch in bulk_index_queryset(
+                queryset, index_name=options.get('index_name'),
+                chunk_size=options.get('chunk_size'),
+                start_after=checkpoint['last_pks'].get(model_label)):
+            indexed += batch.get('indexed')
+            for error in batch.get('errors'):
+                self.stderr.write(
+                    "Failed to index {} {}: {}".format(
+                        model_label, error.get('instance_id'),
+                        error.get('error')))
+            checkpoint['last_pks'][model_label] = batch.get('last_pk')
+            self._save_checkpoint(checkpoint)
+
+        checkpoint['completed'].append(model_label)
+        checkpoint['last_pks'].pop(model_label, None)
+        self._save_checkpoint(checkpoint)
+        message = "Indexed {} {}".format(
+            indexed, model._meta.verbose_name_plural.capitalize())
+        self.stdout.write(message)
 
     def handle(self, *args, **options):
-        # optimize this to index in bulk
+        if not ElasticAPI()._is_on:
+            self.stderr.write("Elastic Search is not running")
+            return
+
+        index_name = options.get('index_name')
+        checkpoint = cache.get(CHECKPOINT_CACHE_KEY) \
+            if options.get('resume') else None
+        if not checkpoint or checkpoint.get('index_name') != index_name:
+            checkpoint = {
+                "index_name": index_name, "completed": [], "last_pks": {}
+            }
 
         apps_lists = settings.LOCAL_APPS
 
@@ -23,21 +104,11 @@ class Command(BaseCommand):
             app = get_app(app_name)
             for model in get_models(app):
                 if model and confirm_model_is_indexable(model):
-                    all_instances = model.objects.all()[0:100] \
-                        if options.get('test') else model.objects.all()
-                    [
-                        index_instance(
-                            obj._meta.app_label,
-                            obj.__class__.__name__,
-                            str(obj.id))
-                        for obj in all_instances]
-                    message = "Indexed {} {}".format(
-                        all_instances.count(),
-                        model._meta.verbose_name_plural.capitalize())
-                    self.stdout.write(message)
+                    self._index_model(model, checkpoint, options)
                 else:
                     message = "Not indexing model {}".format(
                         model.__name__)
                     self.stdout.write(message)
 
+        cache.delete(CHECKPOINT_CACHE_KEY)
         self.stdout.write("Finished indexing")
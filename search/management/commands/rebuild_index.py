@@ -0,0 +1,51 @@
+"""
+Rebuilds the search index without taking search offline
+
+A new generation of the index is created and filled while the alias keeps
+serving the current one. Once the build completes the alias is swapped
+over to the new index and old generations are removed.
+"""
+from django.core.cache import cache
+from django.core.management import BaseCommand, call_command
+
+from search.search_utils import (
+    ElasticAPI, INDEX_NAME, REBUILD_TARGET_CACHE_KEY, set_rebuild_target_index)
+
+
+class Command(BaseCommand):
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--resume',
+            action='store_true',
+            dest='resume',
+            default=False,
+            help='Continue filling the newest index if it is not live yet')
+
+    def _get_target_index(self, api, resume):
+        versions = api.get_index_versions()
+        if resume and versions:
+            latest_index = "{}_v{}".format(INDEX_NAME, versions[-1])
+            if latest_index not in api.get_aliased_indices():
+                return latest_index
+        return api.create_index_version()
+
+    def handle(self, *args, **options):
+        api = ElasticAPI()
+        if not api._is_on:
+            self.stderr.write("Elastic Search is not running")
+            return
+
+        new_index = self._get_target_index(api, options.get('resume'))
+        self.stdout.write("Building {}".format(new_index))
+        set_rebuild_target_index(new_index)
+        try:
+            call_command(
+                'build_index', index_name=new_index,
+                resume=options.get('resume'), stdout=self.stdout)
+        finally:
+            cache.delete(REBUILD_TARGET_CACHE_KEY)
+
+        api.swap_alias(new_index)
+        self.stdout.write("Search is now served from {}".format(new_index))
+        for index_name in api.remove_old_index_versions():
+            self.stdout.write("Removed {}".format(index_name))
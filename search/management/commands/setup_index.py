@@ -5,4 +5,8 @@ from search.search_utils import ElasticAPI
 class Command(BaseCommand):
     def handle(self, *args, **kwargs):
         api = ElasticAPI()
-        api.setup_index()
+        if api.get_index().status_code == 200:
+            self.stdout.write("The search index already exists")
+            return
+        # the first generation of the index behind the alias
+        api.swap_alias(api.create_index_version())
@@ -0,0 +1,110 @@
+"""
+The registry of models that are indexed for search.
+
+Everything the indexing and search code needs to know about a model,
+whether it is indexable, its serializer and its search and autocomplete
+fields, is worked out once when the app is ready instead of on every
+call.
+"""
+import pydoc
+import logging
+
+from django.apps import apps
+from django.conf import settings
+from django.dispatch import receiver
+from django.test.signals import setting_changed
+
+LOGGER = logging.getLogger(__name__)
+
+_REGISTRY = {}
+
+
+def _locate_serializer(model):
+    serializer_path = "{}{}{}{}".format(
+        model._meta.app_label, ".serializers.", model.__name__, 'Serializer')
+    return pydoc.locate(serializer_path)
+
+
+def _get_non_indexable_models(search_settings):
+    non_indexable_models = set()
+    for app_model in search_settings.get('NON_INDEXABLE_MODELS', []):
+        try:
+            non_indexable_models.add(apps.get_model(app_model))
+        except LookupError:
+            LOGGER.info(
+                "{} is listed as non indexable but does not exist".format(
+                    app_model))
+    return non_indexable_models
+
+
+def _get_search_fields(search_settings):
+    full_text_fields = search_settings.get('FULL_TEXT_SEARCH_FIELDS') or {}
+    return {
+        model_conf.get('name'): model_conf.get('fields')
+        for model_conf in full_text_fields.get('models', [])
+    }
+
+
+def _get_autocomplete_fields(search_settings):
+    autocomplete_fields = {}
+    for app_conf in search_settings.get('AUTOCOMPLETE_MODEL_FIELDS') or []:
+        for model_conf in app_conf.get('models'):
+            autocomplete_fields.setdefault(
+                model_conf.get('name').lower(), model_conf.get('fields'))
+    return autocomplete_fields
+
+
+def build_registry():
+    """
+    Work out the search configuration of every model in the local apps
+    """
+    search_settings = settings.SEARCH
+    non_indexable_models = _get_non_indexable_models(search_settings)
+    serializers = {}
+    for app_name in settings.LOCAL_APPS:
+        for model in apps.get_app_config(app_name).get_models():
+            if model not in non_indexable_models:
+                serializers[model] = _locate_serializer(model)
+
+    _REGISTRY.clear()
+    _REGISTRY.update({
+        "non_indexable_models": non_indexable_models,
+        "serializers": serializers,
+        "search_fields": _get_search_fields(search_settings),
+        "autocomplete_fields": _get_autocomplete_fields(search_settings)
+    })
+    return _REGISTRY
+
+
+def get_registry():
+    return _REGISTRY or build_registry()
+
+
+def is_indexable(model):
+    return model not in get_registry()['non_indexable_models']
+
+
+def get_serializer(model):
+    """
+    Returns the '<model_name>Serializer' of a model or None
+
+    Models outside the local apps are looked up once and remembered.
+    """
+    serializers = get_registry()['serializers']
+    if model not in serializers:
+        serializers[model] = _locate_serializer(model)
+    return serializers[model]
+
+
+def get_search_fields(document_type):
+    return get_registry()['search_fields'].get(document_type)
+
+
+def get_autocomplete_fields(document_type):
+    return get_registry()['autocomplete_fields'].get(document_type)
+
+
+@receiver(setting_changed)
+def clear_registry(sender, setting, **kwargs):
+    if setting in ('SEARCH', 'LOCAL_APPS'):
+        _REGISTRY.clear()
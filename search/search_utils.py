@@ -1,79 +1,411 @@
-import pydoc
+import os
+import re
+import time
+import zlib
 import json
 import uuid
+import threading
 import requests
 import logging
+import six
 
+from collections import defaultdict
+from contextlib import contextmanager
+
+from django.apps import apps
 from django.conf import settings
+from django.core.cache import cache
+from django.core.signals import request_started, request_finished
 from django.dispatch import receiver
 from django.db.models.signals import post_save
-from django.db.models import get_app, get_models
 from common.models import ErrorQueue
 from celery import shared_task
 
+from . import registry
 from .index_settings import INDEX_SETTINGS
 
 ELASTIC_URL = settings.SEARCH.get('ELASTIC_URL')
-AUTO_COMPLETE_MODELS = settings.SEARCH.get('AUTOCOMPLETE_MODEL_FIELDS')
 INDEX_NAME = settings.SEARCH.get('INDEX_NAME')
 SEARCH_RESULT_SIZE = settings.SEARCH.get('SEARCH_RESULT_SIZE')
-SEARCH_FIELDS = settings.SEARCH.get('FULL_TEXT_SEARCH_FIELDS')
+BULK_INDEX_CHUNK_SIZE = settings.SEARCH.get('BULK_INDEX_CHUNK_SIZE', 500)
+INDEX_GENERATIONS_TO_KEEP = settings.SEARCH.get(
+    'INDEX_GENERATIONS_TO_KEEP', 2)
+# Holds the name of the index being built while the alias is being rebuilt
+REBUILD_TARGET_CACHE_KEY = 'search_index_rebuild_target'
+# The rebuild refreshes the name as it goes, so that the name of an index
+# whose rebuild crashed expires
+REBUILD_TARGET_TTL = settings.SEARCH.get('REBUILD_TARGET_TTL', 60 * 10)
+HTTP_POOL_SIZE = settings.SEARCH.get('HTTP_POOL_SIZE', 10)
+HTTP_TIMEOUT = (
+    settings.SEARCH.get('HTTP_CONNECT_TIMEOUT', 2),
+    settings.SEARCH.get('HTTP_READ_TIMEOUT', 10)
+)
+HTTP_RETRIES = settings.SEARCH.get('HTTP_RETRIES', 2)
+HTTP_RETRY_BACKOFF = settings.SEARCH.get('HTTP_RETRY_BACKOFF', 0.5)
+HTTP_GZIP_MIN_LENGTH = settings.SEARCH.get('HTTP_GZIP_MIN_LENGTH', 1024)
+REALTIME_INDEX_DEBOUNCE = settings.SEARCH.get('REALTIME_INDEX_DEBOUNCE', 5)
+# Only these methods are retried; retrying a search or a bulk request could
+# repeat work elasticsearch has already done
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'PUT', 'DELETE')
 LOGGER = logging.getLogger(__name__)
 
+_SESSIONS = {}
+_SESSION_LOCK = threading.Lock()
+# Records saved in the current request or batch waiting to be indexed
+_DIRTY_RECORDS = threading.local()
+_STATS_LOCK = threading.Lock()
+REQUEST_STATS = {
+    "requests": 0,
+    "errors": 0,
+    "retries": 0,
+    "total_latency": 0.0,
+    "max_latency": 0.0
+}
+
 
 def default(obj):
     if isinstance(obj, uuid.UUID):
         return str(obj)
 
 
-class ElasticAPI(object):
+def get_session():
+    """
+    Returns the keep-alive session shared by all threads in this process
 
-    @property
-    def _is_on(self):
-        url = ELASTIC_URL
+    Sessions are keyed by the process id so that a worker forked from a
+    process that already had a session does not share its sockets.
+    """
+    pid = os.getpid()
+    session = _SESSIONS.get(pid)
+    if session is None:
+        with _SESSION_LOCK:
+            session = _SESSIONS.get(pid)
+            if session is None:
+                session = requests.Session()
+                adapter = requests.adapters.HTTPAdapter(
+                    pool_connections=HTTP_POOL_SIZE,
+                    pool_maxsize=HTTP_POOL_SIZE)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                _SESSIONS.clear()
+                _SESSIONS[pid] = session
+    return session
+
+
+def _record_request(latency, is_error=False, is_retry=False):
+    with _STATS_LOCK:
+        REQUEST_STATS['requests'] += 1
+        REQUEST_STATS['total_latency'] += latency
+        REQUEST_STATS['max_latency'] = max(
+            REQUEST_STATS['max_latency'], latency)
+        if is_error:
+            REQUEST_STATS['errors'] += 1
+        if is_retry:
+            REQUEST_STATS['retries'] += 1
+
+
+def get_request_stats():
+    """
+    Returns the elasticsearch request counters for this process
+    """
+    with _STATS_LOCK:
+        stats = dict(REQUEST_STATS)
+    stats['average_latency'] = (
+        stats['total_latency'] / stats['requests']
+        if stats['requests'] else 0.0
+    )
+    return stats
+
+
+def compress(data):
+    """
+    Gzip a request body
+    """
+    if isinstance(data, six.text_type):
+        data = data.encode('utf-8')
+    compressor = zlib.compressobj(
+        zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+class ElasticHealth(object):
+    """
+    A circuit breaker around the elasticsearch liveness probe.
+
+    The outcome of a probe is shared by all workers through the cache and
+    kept in a process-local copy, so most calls do not touch the network.
+    A healthy result is trusted for `HEALTH_CHECK_TTL` seconds. Once
+    elasticsearch is found to be down the circuit stays open for
+    `HEALTH_CHECK_RETRY_INTERVAL` seconds; after that a single trial probe
+    is let through ( half-open ) while everyone else keeps treating
+    elasticsearch as down until the probe succeeds.
+    """
+
+    cache_key = 'search_elastic_health'
+    probe_lock_key = 'search_elastic_health_probe'
+
+    # process-local copy of the shared state
+    _local_state = {}
+
+    def __init__(self):
+        search_settings = settings.SEARCH
+        self.ttl = search_settings.get('HEALTH_CHECK_TTL', 10)
+        self.retry_interval = search_settings.get(
+            'HEALTH_CHECK_RETRY_INTERVAL', 30)
+        self.timeout = search_settings.get('HEALTH_CHECK_TIMEOUT', 2)
+
+    def _probe(self):
         try:
-            requests.get(url)
+            get_session().get(ELASTIC_URL, timeout=self.timeout)
             return True
-        except requests.exceptions.ConnectionError:
+        except (requests.exceptions.ConnectionError,
+                requests.exceptions.Timeout):
             return False
 
+    def _is_stale(self, state):
+        max_age = self.ttl if state.get('is_on') else self.retry_interval
+        return time.time() - state.get('checked') >= max_age
+
+    def _get_state(self):
+        state = self._local_state.get('state')
+        if state and not self._is_stale(state):
+            return state
+        shared_state = cache.get(self.cache_key)
+        if shared_state:
+            self._local_state['state'] = shared_state
+            return shared_state
+        return state
+
+    def _set_state(self, is_on):
+        state = {
+            "is_on": is_on,
+            "checked": time.time()
+        }
+        self._local_state['state'] = state
+        cache.set(
+            self.cache_key, state, max(self.ttl, self.retry_interval) * 2)
+        return state
+
+    @property
+    def is_on(self):
+        state = self._get_state()
+        if state and not self._is_stale(state):
+            return state.get('is_on')
+        if state and not state.get('is_on'):
+            # half-open; only the worker that wins the lock probes
+            if cache.add(self.probe_lock_key, True, self.timeout * 2) \
+                    is False:
+                return False
+        return self._set_state(self._probe()).get('is_on')
+
+    def record_failure(self):
+        """Open the circuit after a failed call to elasticsearch"""
+        self._set_state(False)
+
+    def reset(self):
+        self._local_state.clear()
+        cache.delete(self.cache_key)
+
+
+class ElasticAPI(object):
+
+    @property
+    def _is_on(self):
+        return ElasticHealth().is_on
+
+    def _request(self, method, url, data=None):
+        """
+        Sends a request to elasticsearch over the shared session
+
+        Idempotent requests are retried with an exponential backoff when
+        the connection fails or elasticsearch is temporarily unavailable.
+        """
+        headers = {}
+        if HTTP_GZIP_MIN_LENGTH is not None and data and \
+                len(data) >= HTTP_GZIP_MIN_LENGTH:
+            data = compress(data)
+            headers['Content-Encoding'] = 'gzip'
+
+        retries = HTTP_RETRIES if method in IDEMPOTENT_METHODS else 0
+        attempt = 0
+        while True:
+            start = time.time()
+            try:
+                result = get_session().request(
+                    method, url, data=data, headers=headers,
+                    timeout=HTTP_TIMEOUT)
+            except (requests.exceptions.ConnectionError,
+                    requests.exceptions.Timeout):
+                _record_request(
+                    time.time() - start, is_error=True, is_retry=attempt > 0)
+                if attempt >= retries:
+                    raise
+            else:
+                is_error = result.status_code >= 500
+                _record_request(
+                    time.time() - start, is_error=is_error,
+                    is_retry=attempt > 0)
+                if result.status_code not in (502, 503, 504) or \
+                        attempt >= retries:
+                    return result
+            time.sleep(HTTP_RETRY_BACKOFF * (2 ** attempt))
+            attempt += 1
+
     def setup_index(self, index_name=INDEX_NAME):
         url = ELASTIC_URL + index_name
         mfl_settings = json.dumps(INDEX_SETTINGS)
-        result = requests.put(url, data=mfl_settings)
+        result = self._request('PUT', url, mfl_settings)
         return result
 
     def get_index(self, index_name=INDEX_NAME):
         url = ELASTIC_URL + index_name
-        result = requests.get(url)
+        result = self._request('GET', url)
         return result
 
     def delete_index(self, index_name=INDEX_NAME):
         url = ELASTIC_URL + index_name
-        result = requests.delete(url)
+        result = self._request('DELETE', url)
+        return result
+
+    def get_aliased_indices(self, alias=INDEX_NAME):
+        """
+        Returns the names of the physical indices that an alias points to
+        """
+        url = "{}_alias/{}".format(ELASTIC_URL, alias)
+        result = self._request('GET', url)
+        if result.status_code != 200:
+            return []
+        return list(result.json().keys())
+
+    def get_index_versions(self, alias=INDEX_NAME):
+        """
+        Returns the sorted generation numbers of the `<alias>_v<N>` indices
+        """
+        url = "{}_aliases".format(ELASTIC_URL)
+        result = self._request('GET', url)
+        pattern = re.compile(r'^{}_v(\d+)$'.format(re.escape(alias)))
+        versions = []
+        for index_name in result.json().keys():
+            match = pattern.match(index_name)
+            if match:
+                versions.append(int(match.group(1)))
+        return sorted(versions)
+
+    def create_index_version(self, alias=INDEX_NAME):
+        """
+        Creates the next `<alias>_v<N>` index without touching the alias
+        """
+        versions = self.get_index_versions(alias)
+        next_version = versions[-1] + 1 if versions else 1
+        index_name = "{}_v{}".format(alias, next_version)
+        self.setup_index(index_name=index_name)
+        return index_name
+
+    def swap_alias(self, new_index, alias=INDEX_NAME):
+        """
+        Atomically points the alias at `new_index`
+
+        The alias is removed from the indices it currently points to and
+        added to the new index in a single `_aliases` request so searches
+        never see a missing or half built index.
+
+        A concrete index created before indices were versioned occupies the
+        alias name. It is removed, with a `remove_index` action, in the same
+        request that adds the alias. Versions of elasticsearch without that
+        action reject the request; the legacy index is then deleted and the
+        alias added right after it, which leaves searches failing for the
+        moment in between.
+        """
+        url = "{}_aliases".format(ELASTIC_URL)
+        current_indices = self.get_aliased_indices(alias)
+        add_action = {"add": {"index": new_index, "alias": alias}}
+        if not current_indices and self.get_index(alias).status_code == 200:
+            result = self._request('POST', url, json.dumps({"actions": [
+                {"remove_index": {"index": alias}}, add_action]}))
+            if result.status_code < 300:
+                return result
+            LOGGER.warning(
+                "Unable to replace the {} index with an alias in one "
+                "request; deleting it first".format(alias))
+            self.delete_index(alias)
+
+        actions = [
+            {"remove": {"index": index_name, "alias": alias}}
+            for index_name in current_indices if index_name != new_index
+        ]
+        actions.append(add_action)
+        result = self._request(
+            'POST', url, json.dumps({"actions": actions}))
         return result
 
+    def remove_old_index_versions(
+            self, alias=INDEX_NAME, keep=INDEX_GENERATIONS_TO_KEEP):
+        """
+        Deletes old generations of an index
+
+        The live generation and the most recent `keep - 1` previous ones
+        are kept so that the alias can be rolled back if need be.
+        """
+        live_indices = self.get_aliased_indices(alias)
+        old_indices = [
+            "{}_v{}".format(alias, version)
+            for version in self.get_index_versions(alias)
+        ]
+        old_indices = [
+            index_name for index_name in old_indices
+            if index_name not in live_indices
+        ]
+        keep_previous = max(keep - 1, 0)
+        stale_indices = old_indices[:max(len(old_indices) - keep_previous, 0)]
+        for index_name in stale_indices:
+            self.delete_index(index_name)
+        return stale_indices
+
     def index_document(self, index_name, instance_data):
         instance_type = instance_data.get('instance_type')
         instance_id = instance_data.get('instance_id')
         data = instance_data.get('data')
         url = "{}{}{}{}{}{}".format(
             ELASTIC_URL, index_name, "/", instance_type, "/", instance_id)
-        result = requests.put(url, data)
+        result = self._request('PUT', url, data)
+        return result
+
+    def bulk_index(self, index_name, documents):
+        """
+        Index a batch of serialized documents in a single `_bulk` request.
+
+        `documents` is a list of dicts as returned by `serialize_model`.
+        The body is sent as newline delimited JSON; an action line followed
+        by the document's source for every document in the batch.
+        """
+        lines = []
+        for document in documents:
+            action = {
+                "index": {
+                    "_index": index_name,
+                    "_type": document.get('instance_type'),
+                    "_id": document.get('instance_id')
+                }
+            }
+            lines.append(json.dumps(action))
+            lines.append(document.get('data'))
+        # the bulk API requires the body to end with a newline
+        data = "\n".join(lines) + "\n"
+        url = "{}{}".format(ELASTIC_URL, "_bulk")
+        result = self._request('POST', url, data)
         return result
 
     def remove_document(self, index_name, document_type, document_id):
         url = "{}{}{}{}{}{}".format(
             ELASTIC_URL, index_name, "/", document_type, "/", document_id)
-        result = requests.delete(url)
+        result = self._request('DELETE', url)
         return result
 
     def get_search_fields(self, model_name):
-        for field in SEARCH_FIELDS.get("models"):
-            if field.get("name") == model_name:
-                return field.get("fields")
+        return registry.get_search_fields(model_name)
 
-    def search_document(self, index_name, instance_type, query):
+    def search_document(
+            self, index_name, instance_type, query, size=SEARCH_RESULT_SIZE):
         document_type = instance_type.__name__.lower()
         url = "{}{}/{}/_search".format(
             ELASTIC_URL, index_name, document_type)
@@ -97,7 +429,9 @@ class ElasticAPI(object):
 
         data = {
             "from": 0,
-            "size": SEARCH_RESULT_SIZE,
+            "size": size,
+            # only the ids of the hits are used
+            "_source": False,
             "query": {
                 "fuzzy_like_this": {
                     "fields": fields,
@@ -109,26 +443,24 @@ class ElasticAPI(object):
 
         data = json.dumps(data)
         if query_dsl:
-            result = requests.post(url, query_dsl)
+            result = self._request('POST', url, query_dsl)
         else:
-            result = requests.post(url, data)
+            result = self._request('POST', url, data)
 
         return result
 
-    def search_auto_complete_document(self, index_name, instance_type, query):
-        search_fields = ["name"]
+    def search_auto_complete_document(
+            self, index_name, instance_type, query, size=SEARCH_RESULT_SIZE):
         document_type = instance_type.__name__.lower()
-        for model_config in AUTO_COMPLETE_MODELS:
-            for model in model_config.get('models'):
-                if model.get('name').lower() == document_type:
-                    search_fields = model.get('fields')
-                    break
+        search_fields = registry.get_autocomplete_fields(document_type) or \
+            ["name"]
 
         url = "{}{}/{}/_search".format(
             ELASTIC_URL, index_name, document_type)
         data = {
             "from": 0,
-            "size": SEARCH_RESULT_SIZE,
+            "size": size,
+            "_source": False,
             "query": {
                 "query_string": {
                     "fields": search_fields,
@@ -138,26 +470,13 @@ class ElasticAPI(object):
             }
         }
         data = json.dumps(data)
-        result = requests.post(url, data)
+        result = self._request('POST', url, data)
 
         return result
 
 
 def confirm_model_is_indexable(model):
-        non_indexable_models = settings.SEARCH.get('NON_INDEXABLE_MODELS')
-        non_indexable_models_classes = []
-        non_indexable_models_names = []
-        for app_model in non_indexable_models:
-            app_name, cls_name = app_model.split('.')
-            non_indexable_models_names.append(cls_name)
-            app = get_app(app_name)
-            app_models = get_models(app)
-
-            for model_cls in app_models:
-                if model_cls.__name__ in non_indexable_models_names:
-                    non_indexable_models_classes.append(model_cls)
-        non_indexable_models_classes = list(set(non_indexable_models_classes))
-        return True if model not in non_indexable_models_classes else False
+    return registry.is_indexable(model)
 
 
 def serialize_model(obj):
@@ -175,10 +494,7 @@ def serialize_model(obj):
     function throw a TypeError exception.
     Only apps in local apps will be indexed.
     """
-    app_label = obj._meta.app_label
-    serializer_path = "{}{}{}{}".format(
-        app_label, ".serializers.", obj.__class__.__name__, 'Serializer')
-    serializer_cls = pydoc.locate(serializer_path)
+    serializer_cls = get_model_serializer(obj.__class__)
     if not serializer_cls:
         LOGGER.info("Unable to locate a serializer for model {}".format(
             obj.__class__))
@@ -193,12 +509,160 @@ def serialize_model(obj):
         }
 
 
+def get_model_serializer(model):
+    """
+    Returns the '<model_name>Serializer' in the model's app serializers
+    """
+    return registry.get_serializer(model)
+
+
+def serialize_instances(model, instances):
+    """
+    Serialize a batch of instances of the same model in one pass.
+
+    Returns a list of documents in the same shape as `serialize_model`
+    or an empty list if the model does not have a serializer.
+    """
+    serializer_cls = get_model_serializer(model)
+    if not serializer_cls:
+        LOGGER.info("Unable to locate a serializer for model {}".format(
+            model))
+        return []
+    instance_type = model.__name__.lower()
+    serialized_instances = serializer_cls(instances, many=True).data
+    return [
+        {
+            "data": json.dumps(serialized_data, default=default),
+            "instance_type": instance_type,
+            "instance_id": str(instance.id)
+        }
+        for instance, serialized_data in zip(
+            instances, serialized_instances)
+    ]
+
+
+def iterate_in_chunks(queryset, chunk_size=BULK_INDEX_CHUNK_SIZE,
+                      start_after=None):
+    """
+    Iterate over a queryset in primary key order, one chunk at a time.
+
+    Uses keyset pagination ( pk > last seen pk ) rather than offsets so
+    that every chunk is a cheap index range scan.
+    `start_after` allows iteration to resume after a given primary key.
+    """
+    queryset = queryset.order_by('pk')
+    if start_after:
+        queryset = queryset.filter(pk__gt=start_after)
+    while True:
+        chunk = list(queryset[:chunk_size])
+        if not chunk:
+            return
+        yield chunk
+        queryset = queryset.filter(pk__gt=chunk[-1].pk)
+
+
+def get_bulk_errors(result, documents):
+    """
+    Extract the documents that failed to index from a `_bulk` response
+
+    Every document in the batch failed when the request as a whole failed
+    or the response does not list the outcome of each document.
+    """
+    def all_failed(error):
+        return [
+            {
+                "instance_type": document.get('instance_type'),
+                "instance_id": document.get('instance_id'),
+                "error": error
+            }
+            for document in documents
+        ]
+
+    status_code = getattr(result, 'status_code', None)
+    if status_code is None or status_code >= 300:
+        return all_failed(
+            "The bulk request failed with status {}".format(status_code))
+    try:
+        response = result.json()
+    except ValueError:
+        response = None
+    if not isinstance(response, dict) or 'items' not in response:
+        return all_failed("The bulk response did not list the documents")
+    if not response.get('errors'):
+        return []
+    failed = []
+    for item in response['items']:
+        action_result = item.get('index', {})
+        if action_result.get('status', 200) >= 300:
+            failed.append({
+                "instance_type": action_result.get('_type'),
+                "instance_id": action_result.get('_id'),
+                "error": action_result.get('error')
+            })
+    return failed
+
+
+def bulk_index_queryset(
+        queryset, index_name=INDEX_NAME, chunk_size=BULK_INDEX_CHUNK_SIZE,
+        start_after=None):
+    """
+    Index all the records in a queryset using the `_bulk` API.
+
+    This is a generator; it yields a summary of each batch once the batch
+    has been sent to elasticsearch so that the caller can report progress
+    and checkpoint the last indexed primary key.
+    Documents that elasticsearch rejects are pushed to the error queue so
+    that `retry_indexing` can pick them up later.
+    """
+    elastic_api = ElasticAPI()
+    model = queryset.model
+    for chunk in iterate_in_chunks(queryset, chunk_size, start_after):
+        documents = serialize_instances(model, chunk)
+        errors = []
+        if documents:
+            result = elastic_api.bulk_index(index_name, documents)
+            errors = get_bulk_errors(result, documents)
+            rebuild_target = get_rebuild_target_index(index_name)
+            if rebuild_target:
+                elastic_api.bulk_index(rebuild_target, documents)
+            for error in errors:
+                ErrorQueue.objects.get_or_create(
+                    object_pk=error.get('instance_id'),
+                    app_label=model._meta.app_label,
+                    model_name=model.__name__,
+                    defaults={
+                        "except_message": str(error.get('error')),
+                        "error_type": "SEARCH_INDEXING_ERROR"
+                    }
+                )
+        yield {
+            "indexed": len(documents) - len(errors),
+            "errors": errors,
+            "last_pk": str(chunk[-1].pk)
+        }
+
+
+def set_rebuild_target_index(target_index):
+    """
+    Mirror the index updates into `target_index` while it is being built
+    """
+    cache.set(REBUILD_TARGET_CACHE_KEY, target_index, REBUILD_TARGET_TTL)
+
+
+def get_rebuild_target_index(index_name=INDEX_NAME):
+    """
+    Returns the index being built behind `index_name` if a rebuild is running
+    """
+    if index_name != INDEX_NAME:
+        return None
+    return cache.get(REBUILD_TARGET_CACHE_KEY)
+
+
 @shared_task(name='Update_the_search_index')
 def index_instance(app_label, model_name, instance_id, index_name=INDEX_NAME):
     indexed = False
     elastic_api = ElasticAPI()
-    obj_path = "{0}.models.{1}".format(app_label, model_name)
-    obj = pydoc.locate(obj_path).objects.get(id=instance_id)
+    obj = apps.get_model(app_label, model_name).objects.get(id=instance_id)
     if not elastic_api._is_on:
         ErrorQueue.objects.get_or_create(
             object_pk=str(obj.pk),
@@ -212,7 +676,23 @@ def index_instance(app_label, model_name, instance_id, index_name=INDEX_NAME):
     if confirm_model_is_indexable(obj.__class__):
         data = serialize_model(obj)
         if data:
-            elastic_api.index_document(index_name, data)
+            try:
+                elastic_api.index_document(index_name, data)
+                rebuild_target = get_rebuild_target_index(index_name)
+                if rebuild_target:
+                    # keep the index being rebuilt in sync with the live one
+                    elastic_api.index_document(rebuild_target, data)
+            except (requests.exceptions.ConnectionError,
+                    requests.exceptions.Timeout):
+                ElasticHealth().record_failure()
+                ErrorQueue.objects.get_or_create(
+                    object_pk=str(obj.pk),
+                    app_label=obj._meta.app_label,
+                    model_name=obj.__class__.__name__,
+                    except_message="Elastic Search is not running",
+                    error_type="SEARCH_INDEXING_ERROR"
+                )
+                return indexed
             LOGGER.info("Indexed {0}".format(data))
             indexed = True
         else:
@@ -227,17 +707,173 @@ def index_instance(app_label, model_name, instance_id, index_name=INDEX_NAME):
     return indexed
 
 
+def queue_index_errors(records, message):
+    """
+    Put (app_label, model_name, instance_id) records in the error queue
+
+    The `retry_indexing` command indexes them later.
+    """
+    for app_label, model_name, instance_id in records:
+        ErrorQueue.objects.get_or_create(
+            object_pk=str(instance_id),
+            app_label=app_label,
+            model_name=model_name,
+            defaults={
+                "except_message": message,
+                "error_type": "SEARCH_INDEXING_ERROR"
+            }
+        )
+
+
+def _pending_index_key(record):
+    return "search_pending_index:{}:{}:{}".format(*record)
+
+
+def enqueue_bulk_index(records):
+    """
+    Schedule a single debounced task that indexes all the given records
+
+    `records` are (app_label, model_name, instance_id) tuples. A record
+    that is already waiting in a scheduled task is skipped; the task reads
+    the record from the database when it runs so it will pick up the
+    latest changes anyway. With realtime indexing on, the task waits for
+    `REALTIME_INDEX_DEBOUNCE` seconds so that bursts of saves share it;
+    otherwise it runs right away.
+
+    If the task can not be scheduled e.g the broker is down, the records
+    are put in the error queue for the `retry_indexing` command.
+    """
+    pending_ttl = max(REALTIME_INDEX_DEBOUNCE * 10, 60)
+    records = [
+        record for record in sorted(set(records))
+        if cache.add(_pending_index_key(record), True, pending_ttl)
+        is not False
+    ]
+    if records:
+        countdown = REALTIME_INDEX_DEBOUNCE if settings.SEARCH.get(
+            "REALTIME_INDEX") else 0
+        try:
+            bulk_index_instances.apply_async(
+                args=[records], countdown=countdown)
+        except Exception:
+            LOGGER.exception("Unable to schedule the indexing of records")
+            cache.delete_many(
+                [_pending_index_key(record) for record in records])
+            queue_index_errors(records, "Unable to schedule the indexing")
+    return records
+
+
+def start_index_batch():
+    if getattr(_DIRTY_RECORDS, 'records', None) is None:
+        _DIRTY_RECORDS.records = set()
+        return True
+    return False
+
+
+def flush_index_batch():
+    records = getattr(_DIRTY_RECORDS, 'records', None)
+    _DIRTY_RECORDS.records = None
+    if records:
+        enqueue_bulk_index(records)
+
+
+@contextmanager
+def batched_indexing():
+    """
+    Coalesce the index updates of every save made inside the block
+
+    The saved records are de-duplicated and indexed by one bulk task once
+    the block exits. Nested blocks are flushed by the outermost one.
+    """
+    is_outermost = start_index_batch()
+    try:
+        yield
+    finally:
+        if is_outermost:
+            flush_index_batch()
+
+
+def schedule_index(record):
+    """
+    Index an (app_label, model_name, instance_id) record asynchronously
+
+    Inside a request or `batched_indexing` the record is indexed when the
+    request or batch ends, otherwise by a task of its own.
+    """
+    records = getattr(_DIRTY_RECORDS, 'records', None)
+    if records is not None:
+        records.add(record)
+    else:
+        enqueue_bulk_index([record])
+
+
+@receiver(request_started)
+def start_request_index_batch(sender, **kwargs):
+    # flush anything left over by a request that did not finish cleanly
+    flush_index_batch()
+    start_index_batch()
+
+
+@receiver(request_finished)
+def flush_request_index_batch(sender, **kwargs):
+    """
+    Index the records saved by a request once the response has been sent
+
+    By then the request's changes have been committed.
+    """
+    flush_index_batch()
+
+
+@shared_task(name='Bulk_update_the_search_index')
+def bulk_index_instances(records, index_name=INDEX_NAME):
+    """
+    Index a batch of (app_label, model_name, instance_id) records
+    """
+    cache.delete_many([_pending_index_key(record) for record in records])
+    records_by_model = defaultdict(list)
+    for app_label, model_name, instance_id in records:
+        records_by_model[(app_label, model_name)].append(instance_id)
+
+    elastic_api_on = ElasticAPI()._is_on
+    indexed = 0
+    for (app_label, model_name), instance_ids in records_by_model.items():
+        model = apps.get_model(app_label, model_name)
+        if not confirm_model_is_indexable(model):
+            continue
+        if elastic_api_on:
+            queryset = model.objects.filter(pk__in=instance_ids)
+            try:
+                for batch in bulk_index_queryset(
+                        queryset, index_name=index_name):
+                    indexed += batch.get('indexed')
+                continue
+            except (requests.exceptions.ConnectionError,
+                    requests.exceptions.Timeout):
+                ElasticHealth().record_failure()
+                elastic_api_on = False
+        # the records of a batch that was already indexed are queued too;
+        # indexing them again is harmless
+        queue_index_errors(
+            [(app_label, model_name, instance_id)
+             for instance_id in instance_ids],
+            "Elastic Search is not running")
+    return indexed
+
+
 @receiver(post_save)
 def index_on_save(sender, instance, **kwargs):
     """
     Listen for save signals and index the instances being created.
+
+    Saves made during a request or inside `batched_indexing` are collected
+    and indexed together when the request or batch ends.
     """
     if sender == ErrorQueue:
         return
     app_label = instance._meta.app_label
     index_in_realtime = settings.SEARCH.get("REALTIME_INDEX")
+    if app_label not in settings.LOCAL_APPS or not index_in_realtime:
+        return
     model_name = sender.__name__
     instance_id = str(instance.id) if hasattr(instance, 'id') else None
-
-    index_instance.delay(app_label, model_name, instance_id) if app_label \
-        in settings.LOCAL_APPS and index_in_realtime else None
+    schedule_index((app_label, model_name, instance_id))
@@ -1,16 +1,117 @@
-import pydoc
 import logging
 
+import requests
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
 from django.core.mail import mail_admins
+from django.db.models import F
+from django.utils import timezone
 from celery.task.schedules import crontab
 from celery.decorators import periodic_task
 
 from common.models import ErrorQueue
-from search.search_utils import index_instance
+from search.search_utils import ElasticAPI, ElasticHealth, bulk_index_queryset
 
 
 LOGGER = logging.getLogger(__name__)
 
+RETRY_INDEXING_LOCK_KEY = 'search_retry_indexing_lock'
+
+
+def get_retry_settings():
+    search_settings = settings.SEARCH
+    return {
+        "chunk_size": search_settings.get('RETRY_INDEXING_CHUNK_SIZE', 500),
+        "max_rows": search_settings.get('RETRY_INDEXING_MAX_ROWS', 5000),
+        "backoff": search_settings.get('RETRY_INDEXING_BACKOFF', 60),
+        "max_backoff": search_settings.get(
+            'RETRY_INDEXING_MAX_BACKOFF', 60 * 60),
+        "lock_timeout": search_settings.get(
+            'RETRY_INDEXING_LOCK_TIMEOUT', 60 * 10)
+    }
+
+
+def get_due_errors(backoff, max_backoff, max_rows):
+    """
+    Returns the ids of the oldest indexing errors that are due for a retry.
+
+    A record that has failed `n` times is only retried
+    `backoff * (2 ** n - 1)` seconds ( capped at `max_backoff` ) after it
+    was first queued, so records that keep failing are attempted less and
+    less often instead of crowding out the rest of the queue.
+    """
+    delay = (
+        "LEAST(%s * (power(2, retries) - 1), %s) * interval '1 second'")
+    return list(
+        ErrorQueue.objects.filter(
+            error_type='SEARCH_INDEXING_ERROR'
+        ).extra(
+            where=["created + {} <= %s".format(delay)],
+            params=[backoff, max_backoff, timezone.now()]
+        ).order_by('created', 'id').values_list('id', flat=True)[:max_rows]
+    )
+
+
+def record_failed_retries(error_ids):
+    """
+    Bump the retry count of the given errors and alert the admins
+    once any of them has failed more than twice
+    """
+    if not error_ids:
+        return
+    errors = ErrorQueue.objects.filter(id__in=error_ids)
+    errors.update(retries=F('retries') + 1)
+    if errors.filter(retries__gt=2).exists():
+        mail_admins(
+            subject="Update Search Index Error",
+            message="Indexing failed records is failing."
+            " Please check and ensure elasticsearch is up"
+        )
+
+
+def retry_errors(errors):
+    """
+    Re-index a chunk of queued errors, one bulk request per model.
+
+    Errors whose records were indexed, or deleted from the database, are
+    deleted; the ids of those that still failed are returned. A record is
+    only taken as indexed when the bulk response confirms it; every record
+    of a bulk request that failed as a whole e.g with a 429 or 503 is
+    kept for the next run.
+    """
+    by_model = {}
+    for error in errors:
+        by_model.setdefault(
+            (error.app_label, error.model_name), []).append(error)
+
+    failed = []
+    for (app_label, model_name), model_errors in by_model.items():
+        model = apps.get_model(app_label, model_name)
+        queryset = model.objects.filter(
+            pk__in=[error.object_pk for error in model_errors])
+        existing_pks = set(
+            str(pk) for pk in queryset.values_list('pk', flat=True))
+        rejected_pks = set()
+        for batch in bulk_index_queryset(queryset):
+            rejected_pks.update(
+                str(error.get('instance_id')) for error in batch['errors'])
+
+        indexed = []
+        for error in model_errors:
+            if error.object_pk not in existing_pks:
+                # The related object is already deleted in the database
+                # hence there is nothing left to index
+                LOGGER.info("The record to be indexed has been deleted")
+                indexed.append(error.id)
+            elif error.object_pk in rejected_pks:
+                failed.append(error.id)
+            else:
+                indexed.append(error.id)
+        ErrorQueue.objects.filter(id__in=indexed).delete()
+    return failed
+
 
 @periodic_task(
     run_every=(crontab(minute='*/2')),
@@ -19,31 +120,36 @@ LOGGER = logging.getLogger(__name__)
 def retry_indexing():
     """
     Indexes the the objects that were not indexed on save
+
+    The queue is drained oldest first in chunks, with a single bulk request
+    per model in each chunk. A lock in the cache ensures that a run that
+    overruns the schedule is not overlapped by the next one.
     """
+    retry_settings = get_retry_settings()
+    if not cache.add(
+            RETRY_INDEXING_LOCK_KEY, True, retry_settings['lock_timeout']):
+        LOGGER.info("Retrying failed indexing is already in progress")
+        return
 
-    objects_with_errors = ErrorQueue.objects.filter(
-        error_type='SEARCH_INDEXING_ERROR')
-    for obj in objects_with_errors:
-        obj_path = "{}.models.{}".format(obj.app_label, obj.model_name)
-        model = pydoc.locate(obj_path)
-
-        try:
-            instance = model.objects.get(id=obj.object_pk)
-            result = index_instance(
-                instance._meta.app_label,
-                instance.__class__.__name__,
-                instance.id)
-            if result:
-                obj.delete()
-            else:
-                obj.retries = obj.retries + 1
-                if obj.retries > 2:
-                    mail_admins(
-                        subject="Update Search Index Error",
-                        message="Indexing failed records is failing."
-                        " Please check and ensure elasticsearch is up"
-                    )
-                obj.save()
-        except model.DoesNotExist:
-            # The related object is already deleted in the database
-            LOGGER.info("The record to be indexed has been deleted")
+    try:
+        error_ids = get_due_errors(
+            retry_settings['backoff'], retry_settings['max_backoff'],
+            retry_settings['max_rows'])
+        if not ElasticAPI()._is_on:
+            record_failed_retries(error_ids)
+            return
+
+        chunk_size = retry_settings['chunk_size']
+        for start in range(0, len(error_ids), chunk_size):
+            chunk_ids = error_ids[start:start + chunk_size]
+            try:
+                failed = retry_errors(
+                    ErrorQueue.objects.filter(id__in=chunk_ids))
+            except (requests.exceptions.ConnectionError,
+                    requests.exceptions.Timeout):
+                ElasticHealth().record_failure()
+                record_failed_retries(error_ids[start:])
+                return
+            record_failed_retries(failed)
+    finally:
+        cache.delete(RETRY_INDEXING_LOCK_KEY)
@@ -1,17 +1,22 @@
 import json
-from mock import patch
-from requests.exceptions import ConnectionError
+import time
+from mock import patch, Mock
+from requests.exceptions import ConnectionError, Timeout
 
 from django.test import TestCase
+from rest_framework.exceptions import ValidationError
+from rest_framework.test import APITestCase
 from django.test.utils import override_settings
 from django.core.urlresolvers import reverse
+from django.core.cache import cache
 from django.core.management import call_command
 from django.contrib.auth.models import Group
 from django.contrib.auth import get_user_model
 
 from model_mommy import mommy
 
-from facilities.models import Facility, FacilityApproval
+from facilities.models import (
+    Facility, FacilityApproval, FacilityExportExcelMaterialView)
 
 from facilities.serializers import FacilitySerializer
 from common.models import (
@@ -22,19 +27,30 @@ from common.models import (
     ErrorQueue
 )
 from common.tests import ViewTestBase
+from common.tests.test_views import LoginMixin
 from mfl_gis.models import FacilityCoordinates
 from chul.models import CommunityHealthUnit
 
-from search.filters import SearchFilter
+from search.filters import SearchFilter, build_prefix_tsquery
+from search.management.commands.build_index import CHECKPOINT_CACHE_KEY
 from search.search_utils import (
-    ElasticAPI, index_instance, default, serialize_model)
+    ElasticAPI, ElasticHealth, get_session, get_request_stats, compress,
+    index_instance, default, serialize_model,
+    serialize_instances, iterate_in_chunks, get_bulk_errors,
+    bulk_index_queryset, batched_indexing, bulk_index_instances)
 from users.models import JobTitle
 from ..index_settings import get_mappings
+from .. import registry
 
 
 SEARCH_TEST_SETTINGS = {
     "ELASTIC_URL": "http://localhost:9200/",
     "INDEX_NAME": "test_index",
+    # probe elasticsearch on every call so that tests can switch it off
+    "HEALTH_CHECK_TTL": 0,
+    "HEALTH_CHECK_RETRY_INTERVAL": 0,
+    # retry failed indexing on every run
+    "RETRY_INDEXING_BACKOFF": 0,
     "NON_INDEXABLE_MODELS": [
         "mfl_gis.FacilityCoordinates",
         "mfl_gis.WorldBorder",
@@ -169,11 +185,126 @@ class TestElasticSearchAPI(TestCase):
                             True,
                             values.get('store'))
 
+    def test_bulk_index(self):
+        self.elastic_search_api.setup_index(index_name='test_index')
+        facility = mommy.make(Facility, name='Fig tree medical clinic')
+        documents = serialize_instances(Facility, [facility])
+        result = self.elastic_search_api.bulk_index('test_index', documents)
+        self.assertEquals(200, result.status_code)
+        self.assertEquals([], get_bulk_errors(result, documents))
+
+    def test_bulk_index_queryset(self):
+        self.elastic_search_api.setup_index(index_name='test_index')
+        mommy.make(Facility, _quantity=5)
+        batches = list(bulk_index_queryset(
+            Facility.objects.all(), index_name='test_index', chunk_size=2))
+        self.assertEquals(3, len(batches))
+        self.assertEquals(5, sum(batch['indexed'] for batch in batches))
+        last_facility = Facility.objects.order_by('-pk')[0]
+        self.assertEquals(str(last_facility.pk), batches[-1]['last_pk'])
+
+    def test_versioned_index_alias_swap(self):
+        alias = 'test_alias_index'
+        first_index = self.elastic_search_api.create_index_version(alias)
+        self.assertEquals('test_alias_index_v1', first_index)
+        self.elastic_search_api.swap_alias(first_index, alias)
+        self.assertEquals(
+            [first_index],
+            self.elastic_search_api.get_aliased_indices(alias))
+
+        second_index = self.elastic_search_api.create_index_version(alias)
+        self.assertEquals('test_alias_index_v2', second_index)
+        # the alias keeps serving the live index while the new one is built
+        self.assertEquals(
+            [first_index],
+            self.elastic_search_api.get_aliased_indices(alias))
+
+        self.elastic_search_api.swap_alias(second_index, alias)
+        self.assertEquals(
+            [second_index],
+            self.elastic_search_api.get_aliased_indices(alias))
+        self.assertEquals(
+            [1, 2], self.elastic_search_api.get_index_versions(alias))
+        for index_name in [first_index, second_index]:
+            self.elastic_search_api.delete_index(index_name)
+
+    def test_swap_alias_replaces_a_legacy_index_in_one_request(self):
+        api = self.elastic_search_api
+        with patch.object(ElasticAPI, 'get_aliased_indices',
+                          return_value=[]), \
+                patch.object(ElasticAPI, 'get_index',
+                             return_value=Mock(status_code=200)), \
+                patch.object(ElasticAPI, 'delete_index') as mock_delete, \
+                patch.object(ElasticAPI, '_request') as mock_request:
+            mock_request.return_value = Mock(status_code=200)
+            api.swap_alias('legacy_index_v1', 'legacy_index')
+            self.assertFalse(mock_delete.called)
+            self.assertEquals(1, mock_request.call_count)
+            actions = json.loads(mock_request.call_args[0][2])['actions']
+            self.assertEquals([
+                {"remove_index": {"index": "legacy_index"}},
+                {"add": {"index": "legacy_index_v1",
+                         "alias": "legacy_index"}}
+            ], actions)
+
+            # elasticsearch versions without the remove_index action
+            mock_request.reset_mock()
+            mock_request.return_value = Mock(status_code=400)
+            api.swap_alias('legacy_index_v1', 'legacy_index')
+            mock_delete.assert_called_once_with('legacy_index')
+            self.assertEquals(2, mock_request.call_count)
+            actions = json.loads(mock_request.call_args[0][2])['actions']
+            self.assertEquals([
+                {"add": {"index": "legacy_index_v1",
+                         "alias": "legacy_index"}}
+            ], actions)
+
+    def test_remove_old_index_versions(self):
+        alias = 'test_alias_index'
+        indices = [
+            self.elastic_search_api.create_index_version(alias)
+            for i in range(3)
+        ]
+        self.elastic_search_api.swap_alias(indices[-1], alias)
+        removed = self.elastic_search_api.remove_old_index_versions(
+            alias, keep=2)
+        self.assertEquals([indices[0]], removed)
+        self.assertEquals(
+            [2, 3], self.elastic_search_api.get_index_versions(alias))
+        for index_name in indices[1:]:
+            self.elastic_search_api.delete_index(index_name)
+
+    def test_index_into_rebuild_target(self):
+        self.elastic_search_api.setup_index(index_name='test_index')
+        facility = mommy.make(Facility, name='Fig tree medical clinic')
+        with patch('search.search_utils.get_rebuild_target_index') as target:
+            target.return_value = 'test_index_rebuild'
+            with patch.object(ElasticAPI, 'index_document') as mock_index:
+                result = index_instance(
+                    'facilities', 'Facility', str(facility.id), 'test_index')
+        self.assertTrue(result)
+        self.assertEquals(
+            ['test_index', 'test_index_rebuild'],
+            [call[0][0] for call in mock_index.call_args_list])
+
+    def test_index_into_rebuild_target_fails(self):
+        self.elastic_search_api.setup_index(index_name='test_index')
+        facility = mommy.make(Facility, name='Fig tree medical clinic')
+        with patch('search.search_utils.get_rebuild_target_index') as target:
+            target.return_value = 'test_index_rebuild'
+            with patch.object(ElasticAPI, 'index_document') as mock_index:
+                mock_index.side_effect = [None, ConnectionError]
+                result = index_instance(
+                    'facilities', 'Facility', str(facility.id), 'test_index')
+        self.assertFalse(result)
+        self.assertTrue(ErrorQueue.objects.filter(
+            object_pk=str(facility.id), model_name='Facility').exists())
+
     def test_is_on_true(self):
         self.assertTrue(self.elastic_search_api._is_on)
 
     def test_is_on_false(self):
-        with patch('search.search_utils.requests.get') as mock_get:
+        with patch('search.search_utils.requests.Session.get') as mock_get:
             mock_get.side_effect = ConnectionError
             elastic_api = ElasticAPI()
             self.assertFalse(elastic_api._is_on)
@@ -183,11 +314,216 @@ class TestElasticSearchAPI(TestCase):
         super(TestElasticSearchAPI, self).tearDown()
 
 
+class TestElasticSession(TestCase):
+
+    def test_session_is_shared(self):
+        self.assertIs(get_session(), get_session())
+
+    def test_new_session_after_fork(self):
+        session = get_session()
+        with patch('search.search_utils.os.getpid') as mock_getpid:
+            mock_getpid.return_value = -1
+            self.assertIsNot(session, get_session())
+        self.assertIsNot(session, get_session())
+
+    def test_request_uses_timeouts(self):
+        with patch('search.search_utils.requests.Session.request') as mock:
+            mock.return_value.status_code = 200
+            ElasticAPI().get_index('test_index')
+            self.assertEquals(
+                (2, 10), mock.call_args[1].get('timeout'))
+
+    def test_request_stats(self):
+        before = get_request_stats()
+        with patch('search.search_utils.requests.Session.request') as mock:
+            mock.return_value.status_code = 500
+            ElasticAPI().get_index('test_index')
+        after = get_request_stats()
+        self.assertEquals(before['requests'] + 1, after['requests'])
+        self.assertEquals(before['errors'] + 1, after['errors'])
+        self.assertTrue(after['average_latency'] >= 0)
+
+    def test_idempotent_requests_are_retried(self):
+        with patch('search.search_utils.time.sleep'):
+            with patch(
+                    'search.search_utils.requests.Session.request') as mock:
+                mock.side_effect = ConnectionError
+                with self.assertRaises(ConnectionError):
+                    ElasticAPI().get_index('test_index')
+                self.assertEquals(3, mock.call_count)
+
+    def test_unavailable_responses_are_retried(self):
+        with patch('search.search_utils.time.sleep'):
+            with patch(
+                    'search.search_utils.requests.Session.request') as mock:
+                mock.return_value.status_code = 503
+                result = ElasticAPI().delete_index('test_index')
+                self.assertEquals(503, result.status_code)
+                self.assertEquals(3, mock.call_count)
+
+    def test_searches_are_not_retried(self):
+        with patch('search.search_utils.requests.Session.request') as mock:
+            mock.side_effect = ConnectionError
+            with self.assertRaises(ConnectionError):
+                ElasticAPI().bulk_index('test_index', [])
+            self.assertEquals(1, mock.call_count)
+
+    def test_large_bodies_are_compressed(self):
+        data = json.dumps({"query": "a" * 2048})
+        with patch('search.search_utils.requests.Session.request') as mock:
+            mock.return_value.status_code = 200
+            ElasticAPI().index_document('test_index', {
+                "instance_type": "facility",
+                "instance_id": "1",
+                "data": data
+            })
+            self.assertEquals(
+                'gzip', mock.call_args[1]['headers']['Content-Encoding'])
+            self.assertEquals(compress(data), mock.call_args[1]['data'])
+
+    def test_small_bodies_are_not_compressed(self):
+        with patch('search.search_utils.requests.Session.request') as mock:
+            mock.return_value.status_code = 200
+            ElasticAPI().index_document('test_index', {
+                "instance_type": "facility",
+                "instance_id": "1",
+                "data": '{"name": "test"}'
+            })
+            self.assertEquals({}, mock.call_args[1]['headers'])
+
+
+@override_settings(SEARCH=SEARCH_TEST_SETTINGS)
+class TestSearchRegistry(TestCase):
+
+    def test_non_indexable_models(self):
+        self.assertFalse(registry.is_indexable(FacilityCoordinates))
+        self.assertTrue(registry.is_indexable(Facility))
+
+    def test_missing_non_indexable_model_is_ignored(self):
+        with self.settings(SEARCH=dict(
+                SEARCH_TEST_SETTINGS,
+                NON_INDEXABLE_MODELS=["facilities.NoSuchModel"])):
+            self.assertTrue(registry.is_indexable(FacilityCoordinates))
+
+    def test_registry_rebuilt_when_settings_change(self):
+        self.assertTrue(registry.is_indexable(Facility))
+        with self.settings(SEARCH=dict(
+                SEARCH_TEST_SETTINGS,
+                NON_INDEXABLE_MODELS=["facilities.Facility"])):
+            self.assertFalse(registry.is_indexable(Facility))
+        self.assertTrue(registry.is_indexable(Facility))
+
+    def test_serializers(self):
+        self.assertEquals(
+            FacilitySerializer, registry.get_serializer(Facility))
+        self.assertIsNone(registry.get_serializer(Group))
+        self.assertIn(Group, registry.get_registry()['serializers'])
+
+    def test_serializers_are_located_once(self):
+        registry.build_registry()
+        with patch('search.registry.pydoc.locate') as mock_locate:
+            registry.get_serializer(Facility)
+            registry.get_serializer(Facility)
+            self.assertFalse(mock_locate.called)
+
+    def test_search_and_autocomplete_fields(self):
+        self.assertEquals(10, len(registry.get_search_fields('facility')))
+        self.assertIsNone(registry.get_search_fields('owner'))
+        self.assertEquals(
+            ["name", "ward_name"],
+            registry.get_autocomplete_fields('facility'))
+        self.assertIsNone(registry.get_autocomplete_fields('county'))
+
+
+@override_settings(
+    SEARCH=SEARCH_TEST_SETTINGS,
+    CACHES=CACHES_TEST_SETTINGS)
+class TestElasticHealth(TestCase):
+
+    def setUp(self):
+        ElasticHealth().reset()
+        super(TestElasticHealth, self).setUp()
+
+    def test_probe_uses_timeout(self):
+        with patch('search.search_utils.requests.Session.get') as mock_get:
+            ElasticHealth().is_on
+            self.assertEquals(2, mock_get.call_args[1].get('timeout'))
+
+    def test_probe_timeout(self):
+        with patch('search.search_utils.requests.Session.get') as mock_get:
+            mock_get.side_effect = Timeout
+            self.assertFalse(ElasticHealth().is_on)
+
+    def test_healthy_state_is_cached(self):
+        with self.settings(SEARCH=dict(
+                SEARCH_TEST_SETTINGS, HEALTH_CHECK_TTL=60)):
+            with patch('search.search_utils.requests.Session.get') as mock_get:
+                self.assertTrue(ElasticHealth().is_on)
+                self.assertTrue(ElasticHealth().is_on)
+                self.assertEquals(1, mock_get.call_count)
+
+    def test_open_circuit_does_not_probe(self):
+        with self.settings(SEARCH=dict(
+                SEARCH_TEST_SETTINGS, HEALTH_CHECK_RETRY_INTERVAL=60)):
+            with patch('search.search_utils.requests.Session.get') as mock_get:
+                mock_get.side_effect = ConnectionError
+                self.assertFalse(ElasticHealth().is_on)
+                self.assertFalse(ElasticHealth().is_on)
+                self.assertEquals(1, mock_get.call_count)
+
+    def test_half_open_probe_closes_circuit(self):
+        with patch('search.search_utils.requests.Session.get') as mock_get:
+            mock_get.side_effect = ConnectionError
+            self.assertFalse(ElasticHealth().is_on)
+            mock_get.side_effect = None
+            self.assertTrue(ElasticHealth().is_on)
+
+    def test_half_open_probe_already_running(self):
+        with patch('search.search_utils.requests.Session.get') as mock_get:
+            mock_get.side_effect = ConnectionError
+            self.assertFalse(ElasticHealth().is_on)
+            mock_get.side_effect = None
+            with patch('search.search_utils.cache.add') as mock_add:
+                mock_add.return_value = False
+                self.assertFalse(ElasticHealth().is_on)
+
+    def test_record_failure(self):
+        with self.settings(SEARCH=dict(
+                SEARCH_TEST_SETTINGS, HEALTH_CHECK_TTL=60,
+                HEALTH_CHECK_RETRY_INTERVAL=60)):
+            with patch('search.search_utils.requests.Session.get'):
+                self.assertTrue(ElasticHealth().is_on)
+                ElasticHealth().record_failure()
+                self.assertFalse(ElasticHealth().is_on)
+
+    def test_state_shared_through_cache(self):
+        with patch('search.search_utils.cache.get') as mock_cache_get:
+            mock_cache_get.return_value = {
+                "is_on": False, "checked": time.time()
+            }
+            with self.settings(SEARCH=dict(
+                    SEARCH_TEST_SETTINGS, HEALTH_CHECK_RETRY_INTERVAL=60)):
+                with patch(
+                        'search.search_utils.requests.Session.get') as mock:
+                    self.assertFalse(ElasticHealth().is_on)
+                    self.assertFalse(mock.called)
+
+    def tearDown(self):
+        ElasticHealth().reset()
+        super(TestElasticHealth, self).tearDown()
+
+
 @override_settings(
     SEARCH=SEARCH_TEST_SETTINGS,
     CACHES=CACHES_TEST_SETTINGS)
 class TestSearchFunctions(ViewTestBase):
     def setUp(self):
+        # run the indexing tasks scheduled by saves right away
+        patcher = patch.object(
+            bulk_index_instances, 'apply_async',
+            side_effect=lambda args, countdown: bulk_index_instances(*args))
+        patcher.start()
+        self.addCleanup(patcher.stop)
         self.elastic_search_api = ElasticAPI()
         self.elastic_search_api.setup_index(index_name='test_index')
         super(TestSearchFunctions, self).setUp()
@@ -209,6 +545,92 @@ class TestSearchFunctions(ViewTestBase):
         serialized_data = serialize_model(group)
         self.assertIsNone(serialized_data)
 
+    def test_serialize_instances(self):
+        facilities = mommy.make(Facility, _quantity=2)
+        documents = serialize_instances(Facility, facilities)
+        self.assertEquals(2, len(documents))
+        for facility, document in zip(facilities, documents):
+            self.assertEquals(str(facility.id), document.get('instance_id'))
+            self.assertEquals('facility', document.get('instance_type'))
+            self.assertEquals(
+                serialize_model(facility).get('data'), document.get('data'))
+
+    def test_serialize_instances_serializer_not_found(self):
+        groups = mommy.make(Group, _quantity=2)
+        self.assertEquals([], serialize_instances(Group, groups))
+
+    def test_iterate_in_chunks(self):
+        mommy.make(Facility, _quantity=5)
+        chunks = list(iterate_in_chunks(Facility.objects.all(), 2))
+        self.assertEquals([2, 2, 1], [len(chunk) for chunk in chunks])
+        ids = [obj.pk for chunk in chunks for obj in chunk]
+        self.assertEquals(sorted(ids), ids)
+
+        resumed = list(iterate_in_chunks(
+            Facility.objects.all(), 2, start_after=chunks[0][-1].pk))
+        self.assertEquals([2, 1], [len(chunk) for chunk in resumed])
+
+    def test_get_bulk_errors(self):
+        facility = mommy.make(Facility)
+        with patch.object(ElasticAPI, 'bulk_index') as mock_bulk:
+            mock_bulk.return_value.status_code = 200
+            mock_bulk.return_value.json.return_value = {
+                "errors": True,
+                "items": [
+                    {
+                        "index": {
+                            "_type": "facility",
+                            "_id": str(facility.id),
+                            "status": 400,
+                            "error": "MapperParsingException"
+                        }
+                    }
+                ]
+            }
+            batches = list(bulk_index_queryset(
+                Facility.objects.all(), index_name='test_index'))
+        self.assertEquals(0, batches[0]['indexed'])
+        self.assertEquals(1, len(batches[0]['errors']))
+        self.assertEquals(1, ErrorQueue.objects.filter(
+            object_pk=str(facility.id),
+            error_type='SEARCH_INDEXING_ERROR').count())
+
+    def test_get_bulk_errors_invalid_response(self):
+        facility = mommy.make(Facility)
+        documents = serialize_instances(Facility, [facility])
+        result = Mock(status_code=200)
+        result.json.side_effect = ValueError
+        errors = get_bulk_errors(result, documents)
+        self.assertEquals(
+            [str(facility.id)], [error['instance_id'] for error in errors])
+
+        result.json.side_effect = None
+        result.json.return_value = {"errors": False}
+        self.assertEquals(1, len(get_bulk_errors(result, documents)))
+
+    def test_get_bulk_errors_failed_request(self):
+        facility = mommy.make(Facility)
+        documents = serialize_instances(Facility, [facility])
+        for status_code in (413, 429, 503):
+            result = Mock(status_code=status_code)
+            errors = get_bulk_errors(result, documents)
+            self.assertEquals(
+                [str(facility.id)],
+                [error['instance_id'] for error in errors])
+        self.assertEquals(1, len(get_bulk_errors(None, documents)))
+
+    def test_bulk_index_queryset_failed_request(self):
+        self.elastic_search_api.setup_index(index_name='test_index')
+        facility = mommy.make(Facility)
+        ErrorQueue.objects.all().delete()
+        with patch.object(ElasticAPI, 'bulk_index') as mock_bulk:
+            mock_bulk.return_value.status_code = 429
+            batches = list(bulk_index_queryset(
+                Facility.objects.all(), index_name='test_index'))
+        self.assertEquals(0, batches[0]['indexed'])
+        self.assertEquals(1, ErrorQueue.objects.filter(
+            object_pk=str(facility.id)).count())
+
     def test_default_json_dumps_function(self):
         facility = mommy.make(Facility)
         data = FacilitySerializer(
@@ -378,13 +800,13 @@ class TestSearchFunctions(ViewTestBase):
         self.assertEquals(200, response.status_code)
 
     def test_record_pushed_to_error_queue(self):
-        with patch('search.search_utils.requests.get') as mock_get:
+        with patch('search.search_utils.requests.Session.get') as mock_get:
             mock_get.side_effect = ConnectionError
             mommy.make(Facility, name='Ile Noma')
             self.assertEquals(1, ErrorQueue.objects.count())
 
     def test_unique_record_in_error_queue(self):
-        with patch('search.search_utils.requests.get') as mock_get:
+        with patch('search.search_utils.requests.Session.get') as mock_get:
             mock_get.side_effect = ConnectionError
             facility = mommy.make(Facility, name='Ile Noma')
             self.assertEquals(1, ErrorQueue.objects.count())
@@ -393,7 +815,7 @@ class TestSearchFunctions(ViewTestBase):
             self.assertEquals(1, ErrorQueue.objects.count())
 
     def test_retrying_indexing_elastic_search_off(self):
-        with patch('search.search_utils.requests.get') as mock_get:
+        with patch('search.search_utils.requests.Session.get') as mock_get:
             mock_get.side_effect = ConnectionError
             mommy.make(Facility, name='Ile Noma')
             call_command('retry_indexing')
@@ -417,11 +839,15 @@ class TestSearchFunctions(ViewTestBase):
             error_type='SEARCH_INDEXING_ERROR',
             app_label='facilities',
             model_name='Facility')
-        call_command('retry_indexing')
-        self.assertEquals(1, ErrorQueue.objects.count())
+        with patch('search.tasks.mail_admins') as mock_mail_admins:
+            for _ in range(3):
+                call_command('retry_indexing')
+        # a deleted record is dropped from the queue, not retried
+        self.assertEquals(0, ErrorQueue.objects.count())
+        self.assertFalse(mock_mail_admins.called)
 
     def test_retry_indexing_objects_in_queue(self):
-        with patch('search.search_utils.requests.get') as mock_get:
+        with patch('search.search_utils.requests.Session.get') as mock_get:
             mock_get.side_effect = ConnectionError
             mommy.make(Facility, name='Ile Noma')
             self.assertEquals(1, ErrorQueue.objects.count())
@@ -443,7 +869,7 @@ class TestSearchFunctions(ViewTestBase):
         of retries on a record is more than one
         """
 
-        with patch('search.search_utils.requests.get') as mock_get:
+        with patch('search.search_utils.requests.Session.get') as mock_get:
             mock_get.side_effect = ConnectionError
             mommy.make(Facility, name='Ile Noma')
             self.assertEquals(1, ErrorQueue.objects.count())
@@ -463,8 +889,97 @@ class TestSearchFunctions(ViewTestBase):
             error_queue_object = ErrorQueue.objects.all()[0]
             self.assertEquals(3, error_queue_object.retries)
 
+    def _queue_for_indexing(self, facility, **kwargs):
+        return ErrorQueue.objects.create(
+            object_pk=str(facility.pk),
+            error_type='SEARCH_INDEXING_ERROR',
+            app_label='facilities',
+            model_name='Facility',
+            **kwargs)
+
+    def test_retry_indexing_sends_one_bulk_request_per_model(self):
+        facilities = mommy.make(Facility, _quantity=3)
+        ErrorQueue.objects.all().delete()
+        for facility in facilities:
+            self._queue_for_indexing(facility)
+        with patch.object(ElasticAPI, 'bulk_index') as mock_bulk:
+            mock_bulk.return_value.status_code = 200
+            mock_bulk.return_value.json.return_value = {
+                "errors": False, "items": []}
+            call_command('retry_indexing')
+            self.assertEquals(1, mock_bulk.call_count)
+        self.assertEquals(0, ErrorQueue.objects.count())
+
+    def test_retry_indexing_keeps_rejected_documents(self):
+        facility, rejected = mommy.make(Facility, _quantity=2)
+        ErrorQueue.objects.all().delete()
+        self._queue_for_indexing(facility)
+        self._queue_for_indexing(rejected)
+        with patch.object(ElasticAPI, 'bulk_index') as mock_bulk:
+            mock_bulk.return_value.status_code = 200
+            mock_bulk.return_value.json.return_value = {
+                "errors": True,
+                "items": [
+                    {
+                        "index": {
+                            "_type": "facility",
+                            "_id": str(rejected.id),
+                            "status": 400,
+                            "error": "MapperParsingException"
+                        }
+                    }
+                ]
+            }
+            call_command('retry_indexing')
+        error = ErrorQueue.objects.get()
+        self.assertEquals(str(rejected.pk), error.object_pk)
+        self.assertEquals(1, error.retries)
+
+    def test_retry_indexing_keeps_records_of_a_failed_bulk_request(self):
+        facility = mommy.make(Facility)
+        ErrorQueue.objects.all().delete()
+        self._queue_for_indexing(facility)
+        for retries, status_code in enumerate((429, 503), 1):
+            with patch.object(ElasticAPI, 'bulk_index') as mock_bulk:
+                mock_bulk.return_value.status_code = status_code
+                mock_bulk.return_value.json.side_effect = ValueError
+                call_command('retry_indexing')
+            error = ErrorQueue.objects.get()
+            self.assertEquals(str(facility.pk), error.object_pk)
+            self.assertEquals(retries, error.retries)
+
+    def test_retry_indexing_backs_off_records_that_keep_failing(self):
+        facility = mommy.make(Facility)
+        ErrorQueue.objects.all().delete()
+        self._queue_for_indexing(facility, retries=1)
+        search_settings = dict(SEARCH_TEST_SETTINGS)
+        search_settings['RETRY_INDEXING_BACKOFF'] = 60
+        with override_settings(SEARCH=search_settings):
+            with patch.object(ElasticAPI, 'bulk_index') as mock_bulk:
+                call_command('retry_indexing')
+                self.assertFalse(mock_bulk.called)
+        self.assertEquals(1, ErrorQueue.objects.get().retries)
+
+    def test_retry_indexing_does_not_overlap_a_running_drain(self):
+        facility = mommy.make(Facility)
+        ErrorQueue.objects.all().delete()
+        self._queue_for_indexing(facility)
+        with patch('search.tasks.cache.add') as mock_add:
+            mock_add.return_value = False
+            call_command('retry_indexing')
+        self.assertEquals(1, ErrorQueue.objects.count())
+
+    def test_retry_indexing_elastic_search_stops_responding(self):
+        facility = mommy.make(Facility)
+        ErrorQueue.objects.all().delete()
+        self._queue_for_indexing(facility)
+        with patch.object(ElasticAPI, 'bulk_index') as mock_bulk:
+            mock_bulk.side_effect = ConnectionError
+            call_command('retry_indexing')
+        self.assertEquals(1, ErrorQueue.objects.get().retries)
+
     def test_search_using_facility_name_when_elastic_search_is_off(self):
-        with patch('search.search_utils.requests.get') as mock_get:
+        with patch('search.search_utils.requests.Session.get') as mock_get:
             mock_get.side_effect = ConnectionError
             mommy.make(Facility, name='Ile Noma')
             url = reverse('api:facilities:facilities_list')
@@ -472,8 +987,27 @@ class TestSearchFunctions(ViewTestBase):
             response = self.client.get(url)
             self.assertEquals(200, response.status_code)
 
+    def test_search_falls_back_when_elastic_search_stops_responding(self):
+        mommy.make(Facility, name='Ile Noma')
+        with patch.object(ElasticAPI, 'search_document') as mock_search:
+            mock_search.side_effect = ConnectionError
+            url = reverse('api:facilities:facilities_list')
+            url = url + '?search=noma'
+            response = self.client.get(url)
+            self.assertEquals(200, response.status_code)
+            self.assertTrue(mock_search.called)
+
+    def test_index_instance_elastic_search_stops_responding(self):
+        facility = mommy.make(Facility, name='Ile Noma')
+        with patch.object(ElasticAPI, 'index_document') as mock_index:
+            mock_index.side_effect = ConnectionError
+            self.assertFalse(index_instance(
+                'facilities', 'Facility', str(facility.id), 'test_index'))
+        self.assertEquals(1, ErrorQueue.objects.filter(
+            object_pk=str(facility.id)).count())
+
     def test_search_using_facility_code_when_elastic_search_is_off(self):
-        with patch('search.search_utils.requests.get') as mock_get:
+        with patch('search.search_utils.requests.Session.get') as mock_get:
             mock_get.side_effect = ConnectionError
             mommy.make(Facility, name='Ile Noma', code=10000)
             url = reverse('api:facilities:facilities_list')
@@ -486,6 +1020,129 @@ class TestSearchFunctions(ViewTestBase):
         super(TestSearchFunctions, self).tearDown()
 
 
+@override_settings(
+    SEARCH=dict(SEARCH_TEST_SETTINGS, REALTIME_INDEX=True),
+    CACHES=CACHES_TEST_SETTINGS)
+class TestRealtimeIndexing(LoginMixin, APITestCase):
+
+    def setUp(self):
+        patcher = patch.object(bulk_index_instances, 'apply_async')
+        self.mock_task = patcher.start()
+        self.addCleanup(patcher.stop)
+        super(TestRealtimeIndexing, self).setUp()
+        self.mock_task.reset_mock()
+
+    def test_saves_in_a_batch_are_coalesced(self):
+        with batched_indexing():
+            facility = mommy.make(Facility, name='Ile Noma')
+            facility.name = 'Ile Noma sana'
+            facility.save()
+            facility.save()
+            self.assertFalse(self.mock_task.called)
+        self.assertEquals(1, self.mock_task.call_count)
+        records = self.mock_task.call_args[1]['args'][0]
+        self.assertEquals(
+            1, len([
+                record for record in records
+                if record == ('facilities', 'Facility', str(facility.id))
+            ]))
+
+    def test_facility_material_view_is_indexed_with_the_batch(self):
+        with batched_indexing():
+            facility = mommy.make(Facility)
+            facility.save()
+            self.assertFalse(self.mock_task.called)
+        self.assertEquals(1, self.mock_task.call_count)
+        records = self.mock_task.call_args[1]['args'][0]
+        self.assertIn(
+            ('facilities', 'FacilityExportExcelMaterialView',
+             str(facility.id)),
+            records)
+
+    def test_facility_material_view_is_indexed_without_realtime_index(self):
+        with override_settings(
+                SEARCH=dict(SEARCH_TEST_SETTINGS, REALTIME_INDEX=False)):
+            with batched_indexing():
+                facility = mommy.make(Facility)
+                self.assertFalse(self.mock_task.called)
+        self.assertEquals(1, self.mock_task.call_count)
+        self.assertEquals(
+            [('facilities', 'FacilityExportExcelMaterialView',
+              str(facility.id))],
+            self.mock_task.call_args[1]['args'][0])
+        # not debounced
+        self.assertEquals(0, self.mock_task.call_args[1]['countdown'])
+
+    def test_records_go_to_the_error_queue_when_the_broker_is_down(self):
+        self.mock_task.side_effect = IOError
+        job_title = mommy.make(JobTitle)
+        self.assertEquals(
+            1, ErrorQueue.objects.filter(
+                object_pk=str(job_title.id), model_name='JobTitle').count())
+
+    def test_nested_batches_flush_once(self):
+        with batched_indexing():
+            with batched_indexing():
+                mommy.make(Facility)
+            self.assertFalse(self.mock_task.called)
+        self.assertEquals(1, self.mock_task.call_count)
+
+    def test_save_outside_a_batch_is_debounced(self):
+        mommy.make(JobTitle)
+        self.assertTrue(self.mock_task.called)
+        self.assertEquals(5, self.mock_task.call_args[1]['countdown'])
+
+    def test_pending_records_are_not_scheduled_twice(self):
+        with patch('search.search_utils.cache.add') as mock_add:
+            mock_add.return_value = False
+            mommy.make(JobTitle)
+        self.assertFalse(self.mock_task.called)
+
+    def test_request_saves_are_indexed_in_one_task(self):
+        url = reverse('api:facilities:owner_types_list')
+        response = self.client.post(url, {"name": "Private"})
+        self.assertEquals(201, response.status_code)
+        self.assertEquals(1, self.mock_task.call_count)
+
+    def test_bulk_index_instances(self):
+        self.elastic_search_api = ElasticAPI()
+        self.elastic_search_api.setup_index(index_name='test_index')
+        facility = mommy.make(Facility)
+        indexed = bulk_index_instances(
+            [['facilities', 'Facility', str(facility.id)]], 'test_index')
+        self.assertEquals(1, indexed)
+        self.elastic_search_api.delete_index('test_index')
+
+    def test_bulk_index_instances_elastic_search_off(self):
+        facility = mommy.make(Facility)
+        with patch('search.search_utils.requests.Session.get') as mock_get:
+            mock_get.side_effect = ConnectionError
+            indexed = bulk_index_instances(
+                [['facilities', 'Facility', str(facility.id)]], 'test_index')
+        self.assertEquals(0, indexed)
+        self.assertEquals(1, ErrorQueue.objects.filter(
+            object_pk=str(facility.id)).count())
+
+    def test_bulk_index_instances_elastic_search_stops_responding(self):
+        facility = mommy.make(Facility)
+        with patch.object(ElasticAPI, 'bulk_index') as mock_bulk, \
+                patch.object(ElasticHealth, 'record_failure') as mock_failure:
+            mock_bulk.side_effect = Timeout
+            indexed = bulk_index_instances(
+                [['facilities', 'Facility', str(facility.id)]], 'test_index')
+        self.assertEquals(0, indexed)
+        self.assertTrue(mock_failure.called)
+        self.assertEquals(1, ErrorQueue.objects.filter(
+            object_pk=str(facility.id)).count())
+
+    def test_bulk_index_instances_skips_non_indexable(self):
+        obj = mommy.make_recipe(
+            'mfl_gis.tests.facility_coordinates_recipe')
+        self.assertEquals(0, bulk_index_instances(
+            [['mfl_gis', 'FacilityCoordinates', str(obj.id)]],
+            'test_index'))
+
+
 @override_settings(
     SEARCH=SEARCH_TEST_SETTINGS,
     CACHES=CACHES_TEST_SETTINGS)
@@ -544,6 +1201,63 @@ class TestSearchFilter(ViewTestBase):
             search_filter.filter(qs, 'test')
         api.delete_index('test_index')
 
+    def test_filter_preserves_hit_order(self):
+        facilities = mommy.make(Facility, _quantity=3)
+        hit_ids = [str(facilities[2].id), str(facilities[0].id)]
+        with patch.object(ElasticAPI, 'search_document') as mock_search:
+            mock_search.return_value.json.return_value = {
+                "hits": {"hits": [{"_id": hit_id} for hit_id in hit_ids]}
+            }
+            search_filter = SearchFilter(name='search')
+            result = search_filter.filter(Facility.objects.all(), 'test')
+            self.assertEquals(hit_ids, [str(obj.id) for obj in result])
+
+    def test_filter_preserves_hit_order_integer_ids(self):
+        users = [mommy.make(get_user_model()) for i in range(3)]
+        hit_ids = [str(users[2].id), str(users[0].id), str(users[1].id)]
+        with patch.object(ElasticAPI, 'search_document') as mock_search:
+            mock_search.return_value.json.return_value = {
+                "hits": {"hits": [{"_id": hit_id} for hit_id in hit_ids]}
+            }
+            search_filter = SearchFilter(name='search')
+            result = search_filter.filter(
+                get_user_model().objects.all(), 'test')
+            self.assertEquals(hit_ids, [str(obj.id) for obj in result])
+
+    def test_result_window_grows_with_page(self):
+        search_filter = SearchFilter(name='search')
+        self.assertEquals(50, search_filter._get_result_window())
+
+        search_filter.parent = Mock(data={'page': '4', 'page_size': '30'})
+        self.assertEquals(120, search_filter._get_result_window())
+
+        search_filter.parent = Mock(data={'page': '200', 'page_size': '50'})
+        self.assertEquals(10000, search_filter._get_result_window())
+
+        search_filter.parent = Mock(data={'page': 'last'})
+        self.assertEquals(50, search_filter._get_result_window())
+
+    def test_pages_beyond_the_result_window_are_rejected(self):
+        search_filter = SearchFilter(name='search')
+        search_filter.parent = Mock(data={'page': '201', 'page_size': '50'})
+        with self.assertRaises(ValidationError):
+            search_filter._get_result_window()
+
+        with patch.object(ElasticAPI, 'search_document') as mock_search:
+            url = reverse('api:facilities:facilities_list')
+            response = self.client.get(
+                url + "?search=test&page=201&page_size=50")
+            self.assertFalse(mock_search.called)
+        self.assertEquals(400, response.status_code)
+        self.assertIn("page", response.data)
+
+    def test_search_requests_result_window(self):
+        with patch.object(ElasticAPI, 'search_document') as mock_search:
+            url = reverse('api:facilities:facilities_list')
+            url = url + "?search=test&page=3&page_size=40"
+            self.client.get(url)
+            self.assertEquals(120, mock_search.call_args[1].get('size'))
+
     def test_create_index(self):
         call_command('setup_index')
         api = ElasticAPI()
@@ -556,6 +1270,74 @@ class TestSearchFilter(ViewTestBase):
         mommy.make(Facility, name='medical clinic one')
         call_command('build_index')
 
+    def test_build_index_in_chunks(self):
+        call_command('setup_index')
+        mommy.make(Facility, _quantity=3)
+        call_command('build_index', chunk_size=2)
+
+    @override_settings(CACHES={
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    })
+    def test_build_index_resume(self):
+        call_command('setup_index')
+        facility_ids = sorted(
+            str(facility.id)
+            for facility in mommy.make(Facility, _quantity=3))
+
+        def get_indexed_facility_ids(mock_bulk_index):
+            return sorted(
+                document.get('instance_id')
+                for call in mock_bulk_index.call_args_list
+                for document in call[0][1]
+                if document.get('instance_type') == 'facility')
+
+        # a build that stopped after indexing the first facility
+        cache.set(CHECKPOINT_CACHE_KEY, {
+            "index_name": 'test_index',
+            "completed": [],
+            "last_pks": {"facilities.Facility": facility_ids[0]}
+        })
+        with patch.object(ElasticAPI, 'bulk_index') as mock_bulk_index:
+            mock_bulk_index.return_value = None
+            call_command(
+                'build_index', resume=True, test=True,
+                index_name='test_index')
+        self.assertEquals(
+            facility_ids[1:], get_indexed_facility_ids(mock_bulk_index))
+        self.assertIsNone(cache.get(CHECKPOINT_CACHE_KEY))
+
+        # a build that stopped after indexing all the facilities
+        cache.set(CHECKPOINT_CACHE_KEY, {
+            "index_name": 'test_index',
+            "completed": ["facilities.Facility"],
+            "last_pks": {}
+        })
+        with patch.object(ElasticAPI, 'bulk_index') as mock_bulk_index:
+            mock_bulk_index.return_value = None
+            call_command(
+                'build_index', resume=True, test=True,
+                index_name='test_index')
+        self.assertEquals([], get_indexed_facility_ids(mock_bulk_index))
+
+    def test_rebuild_index(self):
+        call_command('setup_index')
+        mommy.make(Facility, name='medical clinic one')
+        call_command('rebuild_index')
+        call_command('rebuild_index', resume=True)
+
+    def test_rebuild_index_elastic_search_off(self):
+        with patch('search.search_utils.requests.Session.get') as mock_get:
+            mock_get.side_effect = ConnectionError
+            call_command('rebuild_index')
+
+    def test_build_index_elastic_search_off(self):
+        with patch('search.search_utils.requests.Session.get') as mock_get:
+            mock_get.side_effect = ConnectionError
+            mommy.make(Facility, name='medical clinic two')
+            call_command('build_index')
+
     def test_delete_index(self):
         # a very naive test. When results are checked with status codes,
         # tests pass locally but fail on circle ci
@@ -595,3 +1377,70 @@ class TestSearchFilter(ViewTestBase):
     def tearDown(self):
         self.elastic_search_api.delete_index(index_name='test_index')
         super(TestSearchFilter, self).tearDown()
+
+
+@override_settings(
+    SEARCH=dict(SEARCH_TEST_SETTINGS, DATABASE_FULL_TEXT_MODELS={
+        "facilities.facility": "facilities_facility",
+        "facilities.facilityexportexcelmaterialview": "facilities_facility"
+    }),
+    CACHES=CACHES_TEST_SETTINGS)
+class TestDatabaseSearchFilter(ViewTestBase):
+
+    def setUp(self):
+        super(TestDatabaseSearchFilter, self).setUp()
+        patcher = patch('search.search_utils.requests.Session.get')
+        mock_get = patcher.start()
+        mock_get.side_effect = ConnectionError
+        self.addCleanup(patcher.stop)
+
+    def test_build_prefix_tsquery(self):
+        self.assertEquals(
+            'nairobi:* & hosp:*', build_prefix_tsquery('Nairobi hosp'))
+        self.assertEquals(
+            'st:* & mary:*', build_prefix_tsquery("St. Mary's!"))
+        self.assertEquals('', build_prefix_tsquery('&|!'))
+
+    def test_full_text_search(self):
+        facility = mommy.make(Facility, name='Kanyakini Dispensary')
+        mommy.make(Facility, name='Mordal mountains medical clinic')
+        search_filter = SearchFilter(name='search')
+        result = search_filter.filter(Facility.objects.all(), 'kanya disp')
+        self.assertEquals([facility], list(result))
+
+    def test_full_text_search_by_code(self):
+        facility = mommy.make(Facility, name='Kanyakini')
+        mommy.make(Facility, name='Mordal')
+        search_filter = SearchFilter(name='search')
+        result = search_filter.filter(Facility.objects.all(), facility.code)
+        self.assertIn(facility, list(result))
+
+    def test_full_text_search_misspelt_name(self):
+        facility = mommy.make(Facility, name='Kanyakini')
+        mommy.make(Facility, name='Mordal mountains medical clinic')
+        search_filter = SearchFilter(name='search')
+        result = search_filter.filter(Facility.objects.all(), 'Kanyakinni')
+        self.assertEquals([facility], list(result))
+
+    def test_full_text_search_ranking(self):
+        best_match = mommy.make(Facility, name='Noma')
+        other_match = mommy.make(
+            Facility, name='Ile', description='Near noma market')
+        search_filter = SearchFilter(name='search')
+        result = search_filter.filter(Facility.objects.all(), 'noma')
+        self.assertEquals([best_match, other_match], list(result))
+
+    def test_full_text_search_material_view(self):
+        facility = mommy.make(Facility, name='Kanyakini')
+        mommy.make(Facility, name='Mordal mountains medical clinic')
+        search_filter = SearchFilter(name='search')
+        result = search_filter.filter(
+            FacilityExportExcelMaterialView.objects.all(), 'kanya')
+        self.assertEquals([facility.id], [obj.id for obj in result])
+
+    def test_search_model_without_search_vector(self):
+        mommy.make(County, name='Nairobi')
+        mommy.make(County, name='Mombasa')
+        search_filter = SearchFilter(name='search')
+        result = search_filter.filter(County.objects.all(), 'nair')
+        self.assertEquals(['Nairobi'], [county.name for county in result])